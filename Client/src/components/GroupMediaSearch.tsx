@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { searchMedia} from '../services/ApiService';
+import { searchMedia, thumbnailUrl } from '../services/ApiService';
 import axios from 'axios';
 import { useParams } from 'react-router-dom';
 
@@ -109,7 +109,7 @@ const MediaSearch: React.FC<{ onAddMedia: () => void }> = ({ onAddMedia }) => {
       <div className="space-y-4">
         {results.map((result) => (
           <div key={result.id} className="flex space-x-4 bg-white p-4 rounded-lg shadow">
-            <img src={result.image} alt={result.title} className="w-24 h-36 object-cover rounded" />
+            <img src={thumbnailUrl(result.image, 'small')} alt={result.title} className="w-24 h-36 object-cover rounded" />
             <div className="flex-grow">
               <h3 className="text-lg font-medium">{result.title}</h3>
               <p className="text-sm text-gray-600 mt-2">{result.summary}</p>
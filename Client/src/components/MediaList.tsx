@@ -1,5 +1,6 @@
 import React from 'react';
 import { Link, useParams } from 'react-router-dom';
+import { thumbnailUrl } from '../services/ApiService';
 
 interface Media {
   id: number;
@@ -25,7 +26,7 @@ const MediaList: React.FC<MediaListProps> = ({ media, isGroupMedia = false }) =>
         >
           <div className="bg-white rounded-lg shadow-md overflow-hidden transition-transform duration-300 transform group-hover:scale-105">
             <div className="relative">
-              <img src={item.image} alt={item.title} className="w-full h-64 object-cover" />
+              <img src={thumbnailUrl(item.image, 'medium')} alt={item.title} className="w-full h-64 object-cover" />
               <div className="absolute inset-0 bg-black bg-opacity-0 group-hover:bg-opacity-50 transition-opacity duration-300 flex items-center justify-center">
                 <h3 className="text-white text-center font-medium px-2 opacity-0 group-hover:opacity-100 transition-opacity duration-300">
                   {item.title}
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { searchMedia, addMedia } from '../services/ApiService';
+import { searchMedia, addMedia, thumbnailUrl } from '../services/ApiService';
 
 interface SearchResult {
   id: number;
@@ -83,7 +83,7 @@ const MediaSearch: React.FC<{ onAddMedia: () => void }> = ({ onAddMedia }) => {
       <div className="space-y-4">
         {results.map((result) => (
           <div key={result.id} className="flex space-x-4 bg-white p-4 rounded-lg shadow">
-            <img src={result.image} alt={result.title} className="w-24 h-36 object-cover rounded" />
+            <img src={thumbnailUrl(result.image, 'small')} alt={result.title} className="w-24 h-36 object-cover rounded" />
             <div className="flex-grow">
               <h3 className="text-lg font-medium">{result.title}</h3>
               <p className="text-sm text-gray-600 mt-2">{result.summary}</p>
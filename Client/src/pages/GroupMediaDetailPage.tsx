@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import GroupReviewForm from '../components/GroupReviewForm';
 import axios from 'axios';
+import { thumbnailUrl } from '../services/ApiService';
 import { formatInTimeZone } from 'date-fns-tz';
 import { FaStar, FaArrowLeft, FaTrash, FaPencilAlt, FaPlus } from 'react-icons/fa';
 import { Link } from 'react-router-dom';
@@ -52,18 +53,21 @@ const GroupMediaDetail: React.FC = () => {
   const [currentUser, setCurrentUser] = useState<User | null>(null);
 
   useEffect(() => {
-    fetchMediaDetails();
-    fetchReviews();
+    fetchPage();
     fetchCurrentUser();
   }, [groupId, mediaId]);
 
-  const fetchMediaDetails = async () => {
+  // 媒体详情和评价一次取回
+  const fetchPage = async () => {
     try {
       const token = localStorage.getItem('token');
-      const response = await axios.get(`${apiUrl}/groups/${groupId}/media/${mediaId}`, {
-        headers: { Authorization: `Bearer ${token}` }
+      const response = await axios.get(`${apiUrl}/groups/${groupId}/media/${mediaId}/page`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { fields: ['media', 'reviews'] },
+        paramsSerializer: { indexes: null }
       });
-      setMedia(response.data);
+      setMedia(response.data.media);
+      setReviews(response.data.reviews || []);
     } catch (error) {
       //console.error('Failed to fetch media details', error);
       setError('获取媒体详情失败');
@@ -192,7 +196,7 @@ const GroupMediaDetail: React.FC = () => {
         <div className="bg-white rounded-lg shadow-lg overflow-hidden mb-8">
           <div className="md:flex">
             <div className="md:flex-shrink-0 md:w-1/3">
-              <img src={media.image} alt={media.title} className="w-full h-auto object-cover" style={{maxHeight: '500px'}} />
+              <img src={thumbnailUrl(media.image, 'large')} alt={media.title} className="w-full h-auto object-cover" style={{maxHeight: '500px'}} />
             </div>
             <div className="p-8 md:w-2/3">
               <div className="flex items-center mb-4">
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import ReviewForm from '../components/ReviewForm';
 import axios from 'axios';
+import { thumbnailUrl } from '../services/ApiService';
 import { formatInTimeZone } from 'date-fns-tz';
 import { FaStar, FaArrowLeft, FaTrash, FaPencilAlt, FaPlus } from 'react-icons/fa';
 
@@ -151,7 +152,7 @@ const MediaDetail: React.FC = () => {
         <div className="bg-white rounded-lg shadow-lg overflow-hidden mb-8">
           <div className="md:flex">
             <div className="md:flex-shrink-0 md:w-1/3">
-              <img src={media.image} alt={media.title} className="w-full h-auto object-cover" style={{maxHeight: '500px'}} />
+              <img src={thumbnailUrl(media.image, 'large')} alt={media.title} className="w-full h-auto object-cover" style={{maxHeight: '500px'}} />
             </div>
             <div className="p-8 md:w-2/3">
               <div className="flex items-center mb-4">
@@ -69,4 +69,21 @@ export const addMedia = (bangumiId: number) =>
 export const getUserMedia = () =>
   api.get('/media/getAll');
 
+export type ImageSize = 'small' | 'medium' | 'large';
+
+// 与服务端 IMAGE_ALLOWED_HOSTS 一致；其他主机的图片（手动添加的条目）直接加载
+const THUMBNAIL_HOSTS = ['lain.bgm.tv'];
+
+const isThumbnailHost = (image: string) => {
+  try {
+    return THUMBNAIL_HOSTS.includes(new URL(image).hostname);
+  } catch {
+    return false;
+  }
+};
+
+// Bangumi 封面走服务端的缩略图缓存；small 160px、medium 320px、large 640px 宽
+export const thumbnailUrl = (image: string, size: ImageSize) =>
+  image && isThumbnailHost(image) ? `${API_URL}/images/${size}?src=${encodeURIComponent(image)}` : image;
+
 export default api;
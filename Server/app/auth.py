@@ -3,10 +3,12 @@ from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from . import schemas, crud
-from .database import get_db
+from . import schemas, crud, crud_async
+from .database import get_async_db
+from .cache import TTLCache
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 
@@ -17,6 +19,9 @@ REFRESH_TOKEN_EXPIRE_DAYS = 7
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# 已解码 token 的短期缓存，条目同时受 token 自身 exp 约束
+token_cache = TTLCache("auth.token", maxsize=4096, ttl=crud.AUTH_CACHE_TTL)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -32,17 +37,24 @@ def create_refresh_token(data: dict):
     return encoded_jwt
 
 def verify_token(token: str):
+    cached = token_cache.get(token)
+    if cached is not None:
+        token_data, expires_at = cached
+        if expires_at > time.time():
+            return token_data
+        token_cache.pop(token)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             return None
-        token_data = schemas.TokenData(username=username)
+        token_data = schemas.TokenData(username=username, user_id=payload.get("uid"))
     except JWTError:
         return None
+    token_cache.set(token, (token_data, payload.get("exp", 0)))
     return token_data
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -51,7 +63,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     token_data = verify_token(token)
     if token_data is None:
         raise credentials_exception
-    user = crud.get_user(db, username=token_data.username)
+    user = await crud_async.get_user_cached(db, username=token_data.username, user_id=token_data.user_id)
     if user is None:
         raise credentials_exception
     return user
\ No newline at end of file
@@ -0,0 +1,190 @@
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from datetime import timedelta
+from typing import List
+from importlib.util import find_spec
+from .cache import TTLCache
+from .concurrency import SingleFlight, TokenBucket
+from .database import async_session_scope
+from . import crud_async, metrics, schemas
+import asyncio
+import httpx
+import os
+
+load_dotenv()
+
+BANGUMI_BASE_URL = os.getenv("BANGUMI_BASE_URL", "https://api.bgm.tv")
+BANGUMI_SEARCH_CACHE_TTL = int(os.getenv("BANGUMI_SEARCH_CACHE_TTL", "600"))
+BANGUMI_SEARCH_CACHE_SIZE = int(os.getenv("BANGUMI_SEARCH_CACHE_SIZE", "2048"))
+# 条目详情在本地表中的有效期，过期后重新向 Bangumi 拉取
+BANGUMI_SUBJECT_MAX_AGE = timedelta(hours=float(os.getenv("BANGUMI_SUBJECT_MAX_AGE_HOURS", "168")))
+# 对 bgm.tv 的并发上限与限速（令牌桶）
+BANGUMI_MAX_CONCURRENCY = int(os.getenv("BANGUMI_MAX_CONCURRENCY", "8"))
+BANGUMI_RATE_PER_SEC = float(os.getenv("BANGUMI_RATE_PER_SEC", "10"))
+BANGUMI_RATE_BURST = int(os.getenv("BANGUMI_RATE_BURST", "20"))
+# 批量导入一次最多的条目数，避免单个请求占满共用的令牌桶
+BANGUMI_BATCH_MAX_IDS = int(os.getenv("BANGUMI_BATCH_MAX_IDS", "200"))
+# 封面图下载的大小上限（字节）
+BANGUMI_IMAGE_MAX_BYTES = int(os.getenv("BANGUMI_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+BANGUMI_IMAGE_MAX_REDIRECTS = int(os.getenv("BANGUMI_IMAGE_MAX_REDIRECTS", "3"))
+
+# 整个应用共用一个连接池，避免每次搜索都重新握手
+_client: httpx.AsyncClient | None = None
+
+search_cache = TTLCache("bangumi.search", maxsize=BANGUMI_SEARCH_CACHE_SIZE, ttl=BANGUMI_SEARCH_CACHE_TTL)
+
+# 相同的上游请求同时只发一次
+_flights = SingleFlight("bangumi.flight")
+_semaphore = asyncio.Semaphore(BANGUMI_MAX_CONCURRENCY)
+_bucket = TokenBucket(BANGUMI_RATE_PER_SEC, BANGUMI_RATE_BURST)
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=BANGUMI_BASE_URL,
+            http2=find_spec("h2") is not None,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+    return _client
+
+def set_client(client: httpx.AsyncClient | None):
+    """Replace the shared client, e.g. with one using a mock transport in tests."""
+    global _client
+    _client = client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _get(path: str, **kwargs):
+    # 先取令牌再占并发名额，避免排队等令牌时占着连接
+    await _bucket.acquire()
+    async with _semaphore:
+        return await get_client().get(path, **kwargs)
+
+async def search_subjects(query: str, media_type: int):
+    key = (query, media_type)
+    results = search_cache.get(key)
+    if results is not None:
+        return results
+    return await _flights.do(("search",) + key, lambda: _search_upstream(query, media_type))
+
+async def _search_upstream(query: str, media_type: int):
+    response = await _get(f"/search/subject/{query}", params={"type": media_type, "responseGroup": "medium"})
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Failed to fetch data from Bangumi API")
+
+    data = response.json()
+    results = [{
+        "id": item['id'],
+        "title": item['name'],
+        "image": (item.get('images') or {}).get('large', ''),
+        "summary": item.get('summary', ''),
+        "type": item['type']
+    } for item in data.get('list') or []]
+    search_cache.set((query, media_type), results)
+    return results
+
+async def fetch_subject(bangumi_id: int):
+    response = await _get(f"/subject/{bangumi_id}")
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Failed to fetch data from Bangumi API")
+
+    data = response.json()
+    return {
+        "bangumi_id": bangumi_id,
+        "name": data['name'],
+        "name_cn": data.get('name_cn') or '',
+        "media_type": data['type'],
+        "image": (data.get('images') or {}).get('large', ''),
+        "summary": data.get('summary') or ''
+    }
+
+async def fetch_image(url: str, allow):
+    """Download a cover image through the shared client and return `(content, content_type)`.
+
+    Redirects are followed only to URLs for which `allow(url)` is true. Raises
+    502 unless the response is an image within `BANGUMI_IMAGE_MAX_BYTES`.
+    """
+    # 绝对 URL 不受 base_url 影响，图片服务器（lain.bgm.tv）同样走令牌桶和并发上限
+    # 不让客户端自动跟随重定向：每一跳都要重新检查主机，否则允许的主机可以把请求转到任意地址
+    for _ in range(BANGUMI_IMAGE_MAX_REDIRECTS + 1):
+        await _bucket.acquire()
+        async with _semaphore:
+            async with get_client().stream("GET", url) as response:
+                if not response.is_redirect:
+                    return await _read_image(response)
+                url = str(response.next_request.url)
+        if not allow(url):
+            raise HTTPException(status_code=502, detail="Image redirected to a host that is not allowed")
+    raise HTTPException(status_code=502, detail="Too many redirects fetching image")
+
+async def _read_image(response: httpx.Response):
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail="Failed to fetch image")
+    content_type = response.headers.get("content-type", "").split(";")[0].strip()
+    length = response.headers.get("content-length", "")
+    if not content_type.startswith("image/") or (length.isdigit() and int(length) > BANGUMI_IMAGE_MAX_BYTES):
+        raise HTTPException(status_code=502, detail="Upstream response is not a usable image")
+    # 边读边计数，超过上限立即断开，不把整个响应读进内存
+    chunks, size = [], 0
+    async for chunk in response.aiter_bytes():
+        size += len(chunk)
+        if size > BANGUMI_IMAGE_MAX_BYTES:
+            raise HTTPException(status_code=502, detail="Upstream image is too large")
+        chunks.append(chunk)
+    return b"".join(chunks), content_type
+
+async def get_subject(db: Session, bangumi_id: int) -> schemas.BangumiSubject:
+    """Return subject details, served from the local table while still fresh."""
+    subject = await crud_async.get_bangumi_subject(db, bangumi_id, BANGUMI_SUBJECT_MAX_AGE)
+    if subject is not None:
+        metrics.incr("bangumi.subject.hits")
+        return schemas.BangumiSubject.model_validate(subject)
+
+    metrics.incr("bangumi.subject.misses")
+    return await _flights.do(("subject", bangumi_id), lambda: _fetch_and_store(bangumi_id))
+
+async def iter_subjects(bangumi_ids: List[int]):
+    """Yield `(bangumi_id, subject, error)` for each id as soon as it is available.
+
+    Fresh rows come from one local query; the rest are fetched concurrently,
+    bounded by the shared upstream semaphore and rate limiter.
+    """
+    async with async_session_scope() as db:
+        rows = await crud_async.get_bangumi_subjects(db, bangumi_ids, BANGUMI_SUBJECT_MAX_AGE)
+        known = {row.bangumi_id: schemas.BangumiSubject.model_validate(row) for row in rows}
+    metrics.incr("bangumi.subject.hits", len(known))
+    metrics.incr("bangumi.subject.misses", len(bangumi_ids) - len(known))
+
+    for bangumi_id in bangumi_ids:
+        if bangumi_id in known:
+            yield bangumi_id, known[bangumi_id], None
+
+    async def fetch_one(bangumi_id: int):
+        try:
+            return bangumi_id, await _flights.do(("subject", bangumi_id), lambda: _fetch_and_store(bangumi_id)), None
+        except HTTPException as e:
+            return bangumi_id, None, e.detail
+        except httpx.HTTPError as e:
+            return bangumi_id, None, str(e) or type(e).__name__
+
+    tasks = [asyncio.ensure_future(fetch_one(bangumi_id)) for bangumi_id in bangumi_ids if bangumi_id not in known]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _fetch_and_store(bangumi_id: int):
+    data = await fetch_subject(bangumi_id)
+    # 合并后的请求可能来自多个会话，这里单独开一个会话写入
+    async with async_session_scope() as db:
+        await crud_async.save_bangumi_subject(db, data)
+    return schemas.BangumiSubject(**data)
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+from . import metrics
+
+_MISSING = object()
+
+class TTLCache:
+    """In-process LRU cache whose entries expire after `ttl` seconds.
+
+    Hits and misses are counted under `<name>.hits` / `<name>.misses` in
+    the metrics registry.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    metrics.incr(f"{self.name}.hits")
+                    return value
+                del self._data[key]
+        metrics.incr(f"{self.name}.misses")
+        return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
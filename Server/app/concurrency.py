@@ -0,0 +1,46 @@
+import asyncio
+import time
+from . import metrics
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight task.
+
+    Callers arriving while a call for `key` is running await the same task
+    instead of starting their own; the key is released once it finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            metrics.incr(f"{self.name}.coalesced")
+        # shield: 一个请求被取消不应影响其他等待同一结果的请求
+        return await asyncio.shield(task)
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -1,75 +1,258 @@
-from sqlalchemy.orm import Session, joinedload
-from . import models, schemas
-from passlib.context import CryptContext
+from sqlalchemy.orm import Session, Query, joinedload
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta
+from . import models, pubsub, schemas, versions
 from fastapi import HTTPException, status
 from typing import List
+from collections import defaultdict
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert, exists, delete, select, func, literal
+from .cache import TTLCache
+from .pagination import paginate, order_by_keys
+import os
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 小组的媒体和讨论总数超过该值时，删除改为后台分批执行（见 deletion.py）
+GROUP_DELETE_BACKGROUND_ROWS = int(os.getenv("GROUP_DELETE_BACKGROUND_ROWS", "2000"))
+
+# 已认证用户的短期缓存：user id -> schemas.User，命中数即节省的数据库查询次数。
+# 以不变的 id 为键，命中时再核对 token 中的用户名：改名后旧用户名无论在哪个 worker 都不会
+# 解析到其他用户。update_user 通过 pubsub 通知失效；没有配置 PUBSUB_URL 时其他 worker 最多
+# AUTH_CACHE_TTL 秒内仍接受该用户改名前签发的 token（新 token 的用户名对不上，会立即重新查询）
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+user_cache = TTLCache("auth.user_lookup", maxsize=4096, ttl=AUTH_CACHE_TTL)
+
+def _invalidate_users(event: str, user_ids: list):
+    for user_id in user_ids:
+        user_cache.pop(user_id)
+
+pubsub.add_handler(pubsub.USER_CACHE_CHANNEL, _invalidate_users)
+
+# 动态中保存的正文摘录长度；新成员加入时复制到其时间线的最近动态数
+ACTIVITY_EXCERPT_LENGTH = int(os.getenv("ACTIVITY_EXCERPT_LENGTH", "140"))
+TIMELINE_BACKFILL = int(os.getenv("TIMELINE_BACKFILL", "50"))
 
 def get_user(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+def load_user(db: Session, username: str, user_id: int = None):
+    """Look up the user a token names and refresh the cache; None when the id and username no longer match."""
+    if user_id is None:
+        # 不带 uid 的旧 token：按用户名查询，不缓存
+        db_user = get_user(db, username)
+        return schemas.User.model_validate(db_user, from_attributes=True) if db_user else None
+    db_user = db.get(models.User, user_id)
+    if db_user is None:
+        user_cache.pop(user_id)
+        return None
+    user = schemas.User.model_validate(db_user, from_attributes=True)
+    user_cache.set(user_id, user)
+    return user if user.username == username else None
+
+def cached_user(username: str, user_id: int = None):
+    user = user_cache.get(user_id) if user_id is not None else None
+    return user if user is not None and user.username == username else None
+
+def get_user_cached(db: Session, username: str, user_id: int = None):
+    return cached_user(username, user_id) or load_user(db, username, user_id)
+
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if db_user:
         db_user.username = user_update.username
+        versions.bump(db, versions.USERS)
         db.commit()
         db.refresh(db_user)
+        user_cache.pop(user_id)
+        pubsub.publish(pubsub.USER_CACHE_CHANNEL, "invalidate", [user_id])
     return db_user
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
     db_user = models.User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
-    if not user or not pwd_context.verify(password, user.hashed_password):
-        return False
-    return user
+#------------------------------------------------------------------------------------------------
+
+def get_bangumi_subject(db: Session, bangumi_id: int, max_age: timedelta):
+    return db.query(models.BangumiSubject).filter(
+        models.BangumiSubject.bangumi_id == bangumi_id,
+        models.BangumiSubject.fetched_at >= datetime.utcnow() - max_age
+    ).first()
+
+def get_bangumi_subjects(db: Session, bangumi_ids: List[int], max_age: timedelta):
+    return db.query(models.BangumiSubject).filter(
+        models.BangumiSubject.bangumi_id.in_(bangumi_ids),
+        models.BangumiSubject.fetched_at >= datetime.utcnow() - max_age
+    ).all()
+
+def save_bangumi_subject(db: Session, subject: dict):
+    db_subject = db.merge(models.BangumiSubject(**subject, fetched_at=datetime.utcnow()))
+    db.commit()
+    return db_subject
 
 #------------------------------------------------------------------------------------------------
 
+CATALOG_FIELDS = ("bangumi_id", "title", "media_type", "image", "summary")
+
+def _insert_ignoring_duplicates(db: Session, model, index_elements: list):
+    # 并发添加同一条目时由唯一索引去重，不支持 ON CONFLICT 的数据库退回普通 INSERT
+    dialect_insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}.get(db.get_bind().dialect.name)
+    if dialect_insert is None:
+        return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing(index_elements=index_elements)
+
+def get_catalog_entries(db: Session, items: List[dict]):
+    """Catalog rows for `items` (dicts with the `CATALOG_FIELDS` keys), in the same order.
+
+    An item with a `bangumi_id` shares the subject's row when its title, image
+    and summary match that row, so they are stored once. Any other item, manual
+    or with its own title, image or summary, gets a new row without a
+    `bangumi_id`; the full-text index is on the catalog, so each entry's own
+    title stays searchable.
+    """
+    by_bangumi_id = {}
+    for item in items:
+        if item.get("bangumi_id") is not None:
+            # 同一批次中同一条目出现多次时，以第一条的内容建共享行
+            by_bangumi_id.setdefault(item["bangumi_id"], item)
+    shared = {}
+    if by_bangumi_id:
+        catalog_query = db.query(models.MediaCatalog).filter(models.MediaCatalog.bangumi_id.in_(by_bangumi_id))
+        shared = {entry.bangumi_id: entry for entry in catalog_query}
+        missing = [
+            {field: item.get(field) for field in CATALOG_FIELDS}
+            for bangumi_id, item in by_bangumi_id.items() if bangumi_id not in shared
+        ]
+        if missing:
+            db.execute(_insert_ignoring_duplicates(db, models.MediaCatalog, ["bangumi_id"]), missing)
+            shared = {entry.bangumi_id: entry for entry in catalog_query}
+
+    def shares_row(item):
+        entry = shared.get(item.get("bangumi_id"))
+        return entry is not None and (entry.title, entry.image, entry.summary) == (item.get("title"), item.get("image"), item.get("summary"))
+
+    # 其余条目按顺序对应新行，逐行插入；它们通常一次只有一条
+    own = [item for item in items if not shares_row(item)]
+    created = iter(db.scalars(
+        insert(models.MediaCatalog).returning(models.MediaCatalog, sort_by_parameter_order=True),
+        [dict({field: item.get(field) for field in CATALOG_FIELDS}, bangumi_id=None) for item in own]
+    ).all() if own else [])
+    return [shared[item["bangumi_id"]] if shares_row(item) else next(created) for item in items]
+
+def _media_row(item: dict, catalog: models.MediaCatalog, **owner):
+    # 行上只保留排序/筛选用的列，图片和简介在目录中
+    return dict(bangumi_id=item.get("bangumi_id"), title=item["title"], media_type=item["media_type"],
+                catalog_id=catalog.id, **owner)
+
+def delete_where(db: Session, model, *conditions):
+    # 集合式删除；不同步会话中的对象，避免为删除的每一行取回主键
+    return db.execute(delete(model).where(*conditions), execution_options={"synchronize_session": False})
+
+def prune_catalog(db: Session, catalog_ids):
+    # 删除不再被任何库或小组引用的手动条目；Bangumi 条目保留，以后再次添加时复用
+    catalog_ids = {catalog_id for catalog_id in catalog_ids if catalog_id is not None}
+    if not catalog_ids:
+        return
+    db.execute(delete(models.MediaCatalog).where(
+        models.MediaCatalog.id.in_(catalog_ids),
+        models.MediaCatalog.bangumi_id.is_(None),
+        ~exists().where(models.UserMedia.catalog_id == models.MediaCatalog.id),
+        ~exists().where(models.GroupMedia.catalog_id == models.MediaCatalog.id),
+    ))
+
 def create_user_media(db: Session, user_id: int, media: schemas.UserMediaCreate):
-    db_media = models.UserMedia(**media.dict(), user_id=user_id)
+    item = media.model_dump()
+    catalog, = get_catalog_entries(db, [item])
+    db_media = models.UserMedia(**_media_row(item, catalog, user_id=user_id))
     db.add(db_media)
     db.commit()
     db.refresh(db_media)
     return db_media
 
-def create_manual_user_media(db: Session, user_id: int, media: schemas.ManualMediaCreate):
-    db_media = models.UserMedia(**media.dict(), user_id=user_id)
-    db.add(db_media)
+def bulk_create_user_media(db: Session, user_id: int, media: List[schemas.UserMediaCreate]):
+    if not media:
+        return []
+    items = [item.model_dump() for item in media]
+    catalog = get_catalog_entries(db, items)
+    # 一次 INSERT ... RETURNING id，整个批次一个事务；图片和简介是子查询列，不能放进 RETURNING，再用一次查询取回
+    # 不要求 RETURNING 按参数顺序：SQLite 没有插入哨兵列，要求顺序会退化为逐行 INSERT；按 id 排序即插入顺序
+    ids = db.scalars(
+        insert(models.UserMedia).returning(models.UserMedia.id),
+        [_media_row(item, entry, user_id=user_id) for item, entry in zip(items, catalog)]
+    ).all()
+    db_media = db.query(models.UserMedia).filter(models.UserMedia.id.in_(ids)).order_by(models.UserMedia.id).all()
+    # 提交前移出会话，避免提交后逐行重新加载
+    for item in db_media:
+        db.expunge(item)
     db.commit()
-    db.refresh(db_media)
     return db_media
 
-def get_user_media(db: Session, user_id: int):
-    return db.query(models.UserMedia).filter(models.UserMedia.user_id == user_id).all()
+def create_manual_user_media(db: Session, user_id: int, media: schemas.ManualMediaCreate):
+    return create_user_media(db, user_id, media)
+
+def _media_query(model, owner_filter, media_type: int = None, title_prefix: str = None):
+    # 未绑定 session 的查询，分页/全量查询用 with_session 绑定，流式导出取 .statement
+    query = Query(model).filter(owner_filter)
+    if media_type is not None:
+        query = query.filter(model.media_type == media_type)
+    if title_prefix:
+        query = query.filter(model.title.startswith(title_prefix, autoescape=True))
+    return query
+
+def _media_sort(model, sort: str):
+    # sort 取值见 schemas.MediaSort，"-" 前缀表示倒序
+    return (model.title if sort.lstrip("-") == "title" else model.id), sort.startswith("-")
+
+def get_user_media(db: Session, user_id: int, media_type: int = None, title_prefix: str = None, sort: str = "id"):
+    query = _media_query(models.UserMedia, models.UserMedia.user_id == user_id, media_type, title_prefix)
+    return query.with_session(db).order_by(*order_by_keys(models.UserMedia, *_media_sort(models.UserMedia, sort))).all()
+
+def get_user_media_page(db: Session, user_id: int, media_type: int = None, title_prefix: str = None, sort: str = "id",
+                        cursor: str = None, limit: int = 100):
+    query = _media_query(models.UserMedia, models.UserMedia.user_id == user_id, media_type, title_prefix)
+    return paginate(query.with_session(db), models.UserMedia, cursor, limit, *_media_sort(models.UserMedia, sort))
+
+def user_media_statement(user_id: int, media_type: int = None, title_prefix: str = None, sort: str = "id"):
+    query = _media_query(models.UserMedia, models.UserMedia.user_id == user_id, media_type, title_prefix)
+    return query.order_by(*order_by_keys(models.UserMedia, *_media_sort(models.UserMedia, sort))).statement
 
 def get_single_media(db: Session, media_id: int):
     return db.query(models.UserMedia).filter(models.UserMedia.id == media_id).all()
     
 
 def delete_user_media(db: Session, user_id: int, media_id: int):
-    media = db.query(models.UserMedia).filter(models.UserMedia.id == media_id, models.UserMedia.user_id == user_id).first()
+    media = db.query(models.UserMedia.catalog_id).filter(models.UserMedia.id == media_id, models.UserMedia.user_id == user_id).first()
     if media is None:
         raise HTTPException(status_code=404, detail="Media not found")
-    
-    for review in media.reviews:
-        db.delete(review)
 
-    db.delete(media)
+    delete_where(db, models.Review, models.Review.media_id == media_id)
+    delete_where(db, models.UserMedia, models.UserMedia.id == media_id)
+    prune_catalog(db, [media.catalog_id])
+    # id 可能被复用，删除时也递增，旧的 ETag 不会再命中
+    versions.bump(db, versions.media_reviews(media_id))
     db.commit()
     return {"message": "Media deleted successfully"}
 
 #------------------------------------------------------------------------------------------------
 
+def _adjust_rating_aggregates(db: Session, model, media_id: int, old_rating: float = None, new_rating: float = None):
+    # 在当前事务中用 col = col + delta 更新媒体的评分汇总列，并发写入不会互相覆盖
+    deltas = defaultdict(int)
+    for rating, sign in ((old_rating, -1), (new_rating, 1)):
+        if rating is not None:
+            deltas["review_count"] += sign
+            deltas["rating_sum"] += sign * rating
+            deltas[f"rating_{models.rating_bucket(rating)}"] += sign
+    values = {getattr(model, name): getattr(model, name) + delta for name, delta in deltas.items() if delta}
+    if values:
+        db.query(model).filter(model.id == media_id).update(values, synchronize_session=False)
+
 def create_review(db: Session, user_id: int, media_id: int, review: schemas.ReviewCreate):
+    # 外键约束已开启：先检查，不存在的媒体返回 404 而不是 IntegrityError
+    if not db.query(exists().where(models.UserMedia.id == media_id)).scalar():
+        raise HTTPException(status_code=404, detail="Media not found")
     db_review = models.Review(
         text=review.text,
         rating=review.rating,
@@ -77,6 +260,8 @@ def create_review(db: Session, user_id: int, media_id: int, review: schemas.Revi
         media_id=media_id
     )
     db.add(db_review)
+    _adjust_rating_aggregates(db, models.UserMedia, media_id, new_rating=review.rating)
+    versions.bump(db, versions.media_reviews(media_id))
     db.commit()
     db.refresh(db_review)
     return db_review
@@ -89,7 +274,9 @@ def update_review(db: Session, review_id: int, user_id: int, review: schemas.Rev
     if review.text is not None:
         db_review.text = review.text
     if review.rating is not None:
+        _adjust_rating_aggregates(db, models.UserMedia, db_review.media_id, db_review.rating, review.rating)
         db_review.rating = review.rating
+    versions.bump(db, versions.media_reviews(db_review.media_id))
     
     db.commit()
     db.refresh(db_review)
@@ -99,16 +286,20 @@ def delete_review(db: Session, review_id: int, user_id: int):
     db_review = db.query(models.Review).filter(models.Review.id == review_id, models.Review.user_id == user_id).first()
     if db_review is None:
         raise HTTPException(status_code=404, detail="Review not found")
+    _adjust_rating_aggregates(db, models.UserMedia, db_review.media_id, old_rating=db_review.rating)
+    versions.bump(db, versions.media_reviews(db_review.media_id))
     db.delete(db_review)
     db.commit()
     return {"message": "Review deleted successfully"}
 
-def get_media_reviews(db: Session, media_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Review).filter(models.Review.media_id == media_id).offset(skip).limit(limit).all()
+def get_media_reviews(db: Session, media_id: int, cursor: str = None, limit: int = 100):
+    query = db.query(models.Review).filter(models.Review.media_id == media_id)
+    return paginate(query, models.Review, cursor, limit)
 
 # 获取用户的所有评论
-def get_user_reviews(db: Session, user_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Review).filter(models.Review.user_id == user_id).offset(skip).limit(limit).all()
+def get_user_reviews(db: Session, user_id: int, cursor: str = None, limit: int = 100):
+    query = db.query(models.Review).filter(models.Review.user_id == user_id)
+    return paginate(query, models.Review, cursor, limit)
 
 # ------------------------------------------------------------------------------------------------------------
 
@@ -116,24 +307,74 @@ def create_group(db: Session, group: schemas.GroupCreate, user_id: int):
     db_group = models.Group(**group.dict(), owner_id=user_id)
     db_group.members.append(db.query(models.User).get(user_id))
     db.add(db_group)
+    db.flush()
+    versions.bump(db, versions.group(db_group.id))
     db.commit()
     db.refresh(db_group)
     return db_group
 
+# 已标记删除、正在后台清理的小组对所有接口都不可见
+_live_group = models.Group.deleted_at.is_(None)
+
 def get_group(db: Session, group_id: int):
     return db.query(models.Group).options(
-        joinedload(models.Group.members),
         joinedload(models.Group.owner)
-    ).filter(models.Group.id == group_id).first()
+    ).filter(models.Group.id == group_id, _live_group).first()
+
+def _membership_exists(group_id: int, user_id: int):
+    # 命中 group_members 的 (group_id, user_id) 唯一索引
+    return exists().where(
+        models.group_members.c.group_id == group_id,
+        models.group_members.c.user_id == user_id
+    )
+
+def get_group_access(db: Session, group_id: int, user_id: int):
+    """Return `(owner_id, is_member)` for the group in one query, or None if it does not exist."""
+    is_member = _membership_exists(group_id, user_id).label("is_member")
+    return db.query(models.Group.owner_id, is_member).filter(models.Group.id == group_id, _live_group).first()
+
+def check_group_member(db: Session, group_id: int, user_id: int):
+    access = get_group_access(db, group_id, user_id)
+    if access is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if not access.is_member:
+        raise HTTPException(status_code=403, detail="User is not a member of this group")
+    return access
+
+def is_group_member(db: Session, group_id: int, user_id: int):
+    return db.query(_membership_exists(group_id, user_id)).scalar()
+
+def get_group_members(db: Session, group_id: int, exclude_user_id: int = None):
+    query = db.query(models.User).join(models.group_members, models.group_members.c.user_id == models.User.id)\
+              .filter(models.group_members.c.group_id == group_id)
+    if exclude_user_id is not None:
+        query = query.filter(models.User.id != exclude_user_id)
+    return query.all()
+
+def get_group_media(db: Session, group_id: int, media_type: int = None, title_prefix: str = None, sort: str = "id"):
+    query = _media_query(models.GroupMedia, models.GroupMedia.group_id == group_id, media_type, title_prefix)
+    return query.with_session(db).order_by(*order_by_keys(models.GroupMedia, *_media_sort(models.GroupMedia, sort))).all()
+
+def get_group_media_page(db: Session, group_id: int, media_type: int = None, title_prefix: str = None, sort: str = "id",
+                         cursor: str = None, limit: int = 100):
+    query = _media_query(models.GroupMedia, models.GroupMedia.group_id == group_id, media_type, title_prefix)
+    return paginate(query.with_session(db), models.GroupMedia, cursor, limit, *_media_sort(models.GroupMedia, sort))
+
+def group_media_statement(group_id: int, media_type: int = None, title_prefix: str = None, sort: str = "id"):
+    query = _media_query(models.GroupMedia, models.GroupMedia.group_id == group_id, media_type, title_prefix)
+    return query.order_by(*order_by_keys(models.GroupMedia, *_media_sort(models.GroupMedia, sort))).statement
 
 def get_user_groups(db: Session, user_id: int):
+    # 从 group_members 的 (user_id, group_id) 索引出发，而不是逐个小组检查成员关系
     return db.query(models.Group) \
+             .join(models.group_members, models.group_members.c.group_id == models.Group.id) \
              .options(joinedload(models.Group.owner)) \
-             .filter(models.Group.members.any(id=user_id)) \
+             .filter(models.group_members.c.user_id == user_id, _live_group) \
+             .order_by(models.group_members.c.group_id) \
              .all()
 
 def invite_user_to_group(db: Session, group_id: int, user_id: int, inviter_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    group = db.query(models.Group).filter(models.Group.id == group_id, _live_group).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     if group.owner_id != inviter_id:
@@ -141,9 +382,13 @@ def invite_user_to_group(db: Session, group_id: int, user_id: int, inviter_id: i
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if user in group.members:
+    if is_group_member(db, group_id, user_id):
         raise HTTPException(status_code=400, detail="User is already a member of this group")
-    group.members.append(user)
+    db.execute(models.group_members.insert().values(group_id=group_id, user_id=user_id))
+    # 新成员的时间线从小组最近的动态开始，而不是空的
+    recent = select(literal(user_id), models.Activity.id, models.Activity.group_id) \
+        .where(models.Activity.group_id == group_id).order_by(models.Activity.id.desc()).limit(TIMELINE_BACKFILL)
+    db.execute(insert(models.TimelineEntry.__table__).from_select(["user_id", "activity_id", "group_id"], recent))
     db.commit()
     db.refresh(group)
     return {
@@ -156,7 +401,7 @@ def invite_user_to_group(db: Session, group_id: int, user_id: int, inviter_id: i
     }
 
 def remove_group_member(db: Session, group_id: int, member_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    group = db.query(models.Group).filter(models.Group.id == group_id, _live_group).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
@@ -164,10 +409,14 @@ def remove_group_member(db: Session, group_id: int, member_id: int):
     if not member:
         raise HTTPException(status_code=404, detail="Member not found")
     
-    if member not in group.members:
+    if not is_group_member(db, group_id, member_id):
         raise HTTPException(status_code=400, detail="User is not a member of this group")
     
-    group.members.remove(member)
+    db.execute(models.group_members.delete().where(
+        models.group_members.c.group_id == group_id,
+        models.group_members.c.user_id == member_id
+    ))
+    delete_where(db, models.TimelineEntry, models.TimelineEntry.user_id == member_id, models.TimelineEntry.group_id == group_id)
     db.commit()
     db.refresh(group)
     return {
@@ -180,36 +429,23 @@ def remove_group_member(db: Session, group_id: int, member_id: int):
     }
 
 def add_media_to_group(db: Session, group_id: int, media: schemas.GroupMediaCreate, user_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if user_id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="User is not a member of this group")
-    db_media = models.GroupMedia(**media.dict(), group_id=group_id, added_by_id=user_id)
+    check_group_member(db, group_id, user_id)
+    item = media.dict()
+    catalog, = get_catalog_entries(db, [item])
+    db_media = models.GroupMedia(**_media_row(item, catalog, group_id=group_id, added_by_id=user_id))
     db.add(db_media)
+    db.flush()
+    record_activity(db, "media_added", group_id, user_id, media_id=db_media.id, title=db_media.title)
+    versions.bump(db, versions.group_media(group_id))
     db.commit()
     db.refresh(db_media)
     return db_media
 
 def create_manual_group_media(db: Session, group_id: int, media: schemas.ManualGroupMediaCreate, user_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if user_id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="User is not a member of this group")
-    db_media = models.GroupMedia(**media.dict(), group_id=group_id, added_by_id=user_id)
-    db.add(db_media)
-    db.commit()
-    db.refresh(db_media)
-    return db_media
+    return add_media_to_group(db, group_id, media, user_id)
 
 def add_review_to_group_media(db: Session, group_id: int, media_id: int, review: schemas.GroupReviewCreate, user_id: int, username: str):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    if user_id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="User is not a member of this group")
+    check_group_member(db, group_id, user_id)
     
     media = db.query(models.GroupMedia).filter(models.GroupMedia.id == media_id, models.GroupMedia.group_id == group_id).first()
     if not media:
@@ -217,68 +453,127 @@ def add_review_to_group_media(db: Session, group_id: int, media_id: int, review:
     
     db_review = models.GroupReview(**review.dict(), user_id=user_id, media_id=media_id, username=username)
     db.add(db_review)
+    _adjust_rating_aggregates(db, models.GroupMedia, media_id, new_rating=review.rating)
+    db.flush()
+    record_activity(db, "review_added", group_id, user_id, media_id=media_id, target_id=db_review.id,
+                    title=media.title, excerpt=_excerpt(review.text))
+    # 评分汇总在媒体列表中，列表和评价列表一起失效
+    versions.bump(db, versions.group_media(group_id), versions.group_reviews(media_id))
     db.commit()
     db.refresh(db_review)
+    pubsub.publish(pubsub.group_media_channel(group_id, media_id), "review", schemas.GroupReview.model_validate(db_review))
     
     return db_review
 
 def sync_media_to_group(db: Session, group_id: int, media_ids: List[int], user_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if user_id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="User is not a member of this group")
-    
-    synced_media = []
-    for media_id in media_ids:
-        user_media = db.query(models.UserMedia).filter(models.UserMedia.id == media_id, models.UserMedia.user_id == user_id).first()
-        if user_media:
-            group_media = models.GroupMedia(
-                title=user_media.title,
-                image=user_media.image,
-                summary=user_media.summary,
-                bangumi_id=user_media.bangumi_id,
-                media_type=user_media.media_type,
-                group_id=group_id,
-                added_by_id=user_id
-            )
-            db.add(group_media)
-            synced_media.append(group_media)
-    
+    """Copy the caller's library entries `media_ids` into the group; returns the newly added group media.
+
+    Entries the group already has (same Bangumi subject or catalog row) and ids
+    outside the caller's library are skipped. Runs a fixed number of statements
+    however many ids are given.
+    """
+    check_group_member(db, group_id, user_id)
+    if not media_ids:
+        return []
+
+    # 改过标题、图片或简介的 Bangumi 条目有自己的目录行，所以除 catalog_id 外还要按 bangumi_id 判断。
+    # 两个条件分成两个 EXISTS，各走各的索引；写成一个 OR 会让 SQLite 为每个候选扫描整个小组
+    same_catalog = exists().where(
+        models.GroupMedia.catalog_id == models.UserMedia.catalog_id, models.GroupMedia.group_id == group_id,
+    )
+    same_subject = exists().where(
+        models.GroupMedia.bangumi_id == models.UserMedia.bangumi_id, models.GroupMedia.group_id == group_id,
+    )
+    candidates = db.query(
+        models.UserMedia.id, models.UserMedia.title, models.UserMedia.bangumi_id,
+        models.UserMedia.media_type, models.UserMedia.catalog_id,
+    ).filter(models.UserMedia.id.in_(set(media_ids)), models.UserMedia.user_id == user_id, ~same_catalog, ~same_subject).all()
+
+    # 按请求中的顺序添加；库中重复的同一条目只添加一次
+    position = {media_id: i for i, media_id in reversed(list(enumerate(media_ids)))}
+    rows, seen = [], set()
+    for media in sorted(candidates, key=lambda media: position[media.id]):
+        key = ("bangumi", media.bangumi_id) if media.bangumi_id is not None else ("catalog", media.catalog_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        rows.append(dict(
+            title=media.title, bangumi_id=media.bangumi_id, media_type=media.media_type, catalog_id=media.catalog_id,
+            group_id=group_id, added_by_id=user_id,
+        ))
+    if not rows:
+        return []
+
+    # 一次 INSERT ... RETURNING id；图片和简介是子查询列，插入后一次查询取回
+    ids = db.scalars(insert(models.GroupMedia).returning(models.GroupMedia.id), rows).all()
+    synced_media = db.query(models.GroupMedia).filter(models.GroupMedia.id.in_(ids)).order_by(models.GroupMedia.id).all()
+    # 整批同步只记一条动态，不为每个条目刷屏
+    record_activity(db, "media_synced", group_id, user_id, title=rows[0]["title"], item_count=len(rows))
+    versions.bump(db, versions.group_media(group_id))
+    # 提交前整体移出会话，避免提交后逐行重新加载（逐个 expunge 要为每行遍历关系级联）
+    db.expunge_all()
     db.commit()
-    for media in synced_media:
-        db.refresh(media)
-    
     return synced_media
 
 
-def delete_group(db: Session, group_id: int, user_id: int):
-    group = db.query(models.Group).options(
-        joinedload(models.Group.media),
-        joinedload(models.Group.discussions)
-    ).filter(models.Group.id == group_id).first()
+def group_contents(group_id: int):
+    """`(model, condition)` pairs selecting everything in a group, in a safe deletion order."""
+    discussions = select(models.Discussion.id).where(models.Discussion.group_id == group_id)
+    media = select(models.GroupMedia.id).where(models.GroupMedia.group_id == group_id)
+    return [
+        # 时间线条目随动态级联删除
+        (models.Activity, models.Activity.group_id == group_id),
+        (models.Comment, models.Comment.discussion_id.in_(discussions)),
+        (models.Discussion, models.Discussion.group_id == group_id),
+        (models.GroupReview, models.GroupReview.media_id.in_(media)),
+        (models.GroupMedia, models.GroupMedia.group_id == group_id),
+    ]
+
+def group_manual_catalog_ids(db: Session, group_id: int):
+    # 只有手动条目的目录行可能在删除后变成孤立行，先记下来，删完再清理
+    return db.scalars(select(models.GroupMedia.catalog_id).where(
+        models.GroupMedia.group_id == group_id, models.GroupMedia.bangumi_id.is_(None)
+    ).distinct()).all()
+
+def _group_size(db: Session, group_id: int, limit: int):
+    # 计数到 limit 为止即可判断是否为大小组，不必数完
+    return sum(
+        db.scalar(select(func.count()).select_from(select(column).where(condition).limit(limit + 1).subquery()))
+        for column, condition in (
+            (models.GroupMedia.id, models.GroupMedia.group_id == group_id),
+            (models.Discussion.id, models.Discussion.group_id == group_id),
+        )
+    )
 
+def delete_group(db: Session, group_id: int, user_id: int):
+    """Delete the group and everything in it with one DELETE per table.
+
+    Groups with more than `GROUP_DELETE_BACKGROUND_ROWS` media and discussions
+    are only marked deleted and lose their members here. The caller then runs
+    `deletion.purge_group` in the background. Returns True when the group is
+    already gone, False when the purge is still pending.
+    """
+    group = db.query(models.Group).filter(models.Group.id == group_id, _live_group).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-    
+
     if group.owner_id != user_id:
         raise HTTPException(status_code=403, detail="Only the group owner can delete the group")
 
     try:
-        # Delete related reviews
-        db.query(models.GroupReview).filter(models.GroupReview.media_id.in_([m.id for m in group.media])).delete(synchronize_session='fetch')
-
-        # Delete related comments
-        db.query(models.Comment).filter(models.Comment.discussion_id.in_([d.id for d in group.discussions])).delete(synchronize_session='fetch')
-
-        # Delete related discussions
-        db.query(models.Discussion).filter(models.Discussion.group_id == group_id).delete(synchronize_session='fetch')
-
-        # Delete related media
-        db.query(models.GroupMedia).filter(models.GroupMedia.group_id == group_id).delete(synchronize_session='fetch')
-
-        # Delete the group
-        db.delete(group)
+        # 成员关系立即删除：小组随即从成员的小组列表和搜索范围中消失
+        db.execute(models.group_members.delete().where(models.group_members.c.group_id == group_id))
+        versions.bump(db, versions.group(group_id))
+        if _group_size(db, group_id, GROUP_DELETE_BACKGROUND_ROWS) > GROUP_DELETE_BACKGROUND_ROWS:
+            group.deleted_at = func.now()
+            db.commit()
+            return False
+
+        catalog_ids = group_manual_catalog_ids(db, group_id)
+        for model, condition in group_contents(group_id):
+            delete_where(db, model, condition)
+        prune_catalog(db, catalog_ids)
+        delete_where(db, models.Group, models.Group.id == group_id)
         db.commit()
     except IntegrityError as e:
         db.rollback()
@@ -287,19 +582,27 @@ def delete_group(db: Session, group_id: int, user_id: int):
         db.rollback()
         raise HTTPException(status_code=500, detail="An error occurred while deleting the group")
 
-    return {"status": "success", "message": "Group and related data deleted successfully"}
-
+    return True
 
 def get_group_media_detail(db: Session, group_id: int, media_id: int):
     return db.query(models.GroupMedia).filter(models.GroupMedia.id == media_id, models.GroupMedia.group_id == group_id).first()
 
+def _bump_group_review_versions(db: Session, media_id: int):
+    # 按评价所属媒体的小组递增，不依赖路径中的 group_id
+    group_id = db.query(models.GroupMedia.group_id).filter(models.GroupMedia.id == media_id).scalar()
+    versions.bump(db, versions.group_media(group_id), versions.group_reviews(media_id))
+
 def update_group_review(db: Session, group_id: int, review_id: int, review: schemas.GroupReviewUpdate, user_id: int):
     db_review = db.query(models.GroupReview).filter(
         models.GroupReview.id == review_id,
         models.GroupReview.user_id == user_id
     ).first()
     if db_review:
-        for key, value in review.dict(exclude_unset=True).items():
+        changes = review.dict(exclude_unset=True)
+        if "rating" in changes:
+            _adjust_rating_aggregates(db, models.GroupMedia, db_review.media_id, db_review.rating, changes["rating"])
+        _bump_group_review_versions(db, db_review.media_id)
+        for key, value in changes.items():
             setattr(db_review, key, value)
         db.commit()
         db.refresh(db_review)
@@ -311,20 +614,24 @@ def delete_group_review(db: Session, group_id: int, review_id: int, user_id: int
         models.GroupReview.user_id == user_id
     ).first()
     if db_review:
+        _adjust_rating_aggregates(db, models.GroupMedia, db_review.media_id, old_rating=db_review.rating)
+        _bump_group_review_versions(db, db_review.media_id)
+        delete_where(db, models.Activity, models.Activity.media_id == db_review.media_id,
+                     models.Activity.kind == "review_added", models.Activity.target_id == review_id)
         db.delete(db_review)
         db.commit()
         return True
     return False
 
 def delete_group_media(db: Session, group_id: int, media_id: int, user_id: int):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    group = db.query(models.Group).filter(models.Group.id == group_id, _live_group).first()
     if not group:
         return {"status": "error", "message": "Group not found"}
     
     if group.owner_id != user_id:
         return {"status": "error", "message": "Only the group owner can delete media"}
     
-    db_media = db.query(models.GroupMedia).filter(
+    db_media = db.query(models.GroupMedia.catalog_id).filter(
         models.GroupMedia.id == media_id,
         models.GroupMedia.group_id == group_id
     ).first()
@@ -332,25 +639,91 @@ def delete_group_media(db: Session, group_id: int, media_id: int, user_id: int):
     if not db_media:
         return {"status": "error", "message": "Media not found"}
     
-    # Delete related reviews
-    db.query(models.GroupReview).filter(models.GroupReview.media_id == media_id).delete()
-
-    # Delete related discussions and their comments
-    discussions = db.query(models.Discussion).filter(models.Discussion.media_id == media_id).all()
-    for discussion in discussions:
-        db.query(models.Comment).filter(models.Comment.discussion_id == discussion.id).delete()
-        db.delete(discussion)
-
-    # Delete the media
-    db.delete(db_media)
+    # 动态、评论、讨论、评分和媒体本身各一条 DELETE
+    delete_where(db, models.Activity, models.Activity.media_id == media_id)
+    discussions = select(models.Discussion.id).where(models.Discussion.media_id == media_id)
+    delete_where(db, models.Comment, models.Comment.discussion_id.in_(discussions))
+    delete_where(db, models.Discussion, models.Discussion.media_id == media_id)
+    delete_where(db, models.GroupReview, models.GroupReview.media_id == media_id)
+    delete_where(db, models.GroupMedia, models.GroupMedia.id == media_id)
+    prune_catalog(db, [db_media.catalog_id])
+    versions.bump(db, versions.group_media(group_id), versions.group_reviews(media_id))
     db.commit()
     return {"status": "success", "message": "Media and related data deleted successfully"}
 
-def get_group_media_reviews(db: Session, group_id: int, media_id: int, skip: int = 0, limit: int = 100):
-    reviews = db.query(models.GroupReview).join(models.GroupMedia)\
-                .filter(models.GroupMedia.group_id == group_id, models.GroupReview.media_id == media_id)\
-                .offset(skip).limit(limit).all()
-    return reviews
+def get_group_media_reviews(db: Session, group_id: int, media_id: int, cursor: str = None, limit: int = 100):
+    query = db.query(models.GroupReview).join(models.GroupMedia)\
+              .filter(models.GroupMedia.group_id == group_id, models.GroupReview.media_id == media_id)
+    return paginate(query, models.GroupReview, cursor, limit)
+
+def get_group_media_detail_page(db: Session, group_id: int, media_id: int, fields, limit: int = 100):
+    """Media, first review page and first discussion page of a group media item, in one session.
+
+    Returns a dict with only the requested `fields` (plus their next cursors),
+    or None when the media is not in the group. The media row is always looked
+    up, so the two lists can filter on `media_id` alone instead of joining it.
+    """
+    media = get_group_media_detail(db, group_id, media_id)
+    if media is None:
+        return None
+    page = {}
+    if "media" in fields:
+        page["media"] = media
+    if "reviews" in fields:
+        query = db.query(models.GroupReview).filter(models.GroupReview.media_id == media_id)
+        page["reviews"], page["reviews_next_cursor"] = paginate(query, models.GroupReview, None, limit)
+    if "discussions" in fields:
+        page["discussions"], page["discussions_next_cursor"] = get_discussions(db, group_id, media_id, limit=limit)
+    return page
+
+#-------------------------------------------------------------------------------------------------------------------------
+
+def _excerpt(text: str):
+    return text[:ACTIVITY_EXCERPT_LENGTH] if text else text
+
+def record_activity(db: Session, kind: str, group_id: int, actor_id: int, **fields):
+    """Append an activity to the group's feed and copy it into every member's timeline.
+
+    Does not commit: the activity is written in the caller's transaction, together
+    with the change it describes. The fan-out is a single INSERT ... SELECT over
+    the group's members.
+    """
+    activity_id = db.scalar(insert(models.Activity).values(kind=kind, group_id=group_id, actor_id=actor_id, **fields)
+                            .returning(models.Activity.id))
+    members = select(models.group_members.c.user_id, literal(activity_id), literal(group_id)) \
+        .where(models.group_members.c.group_id == group_id)
+    db.execute(insert(models.TimelineEntry.__table__).from_select(["user_id", "activity_id", "group_id"], members))
+    return activity_id
+
+def _activity_query(db: Session):
+    # 只取列并连接 users 取用户名，标题和摘录已在动态中，不再连接内容表
+    return db.query(
+        models.Activity.id,
+        models.Activity.kind,
+        models.Activity.group_id,
+        models.Activity.actor_id,
+        models.User.username,
+        models.Activity.media_id,
+        models.Activity.discussion_id,
+        models.Activity.target_id,
+        models.Activity.title,
+        models.Activity.excerpt,
+        models.Activity.item_count,
+        models.Activity.created_at,
+    ).outerjoin(models.User, models.User.id == models.Activity.actor_id)
+
+def get_group_activity(db: Session, group_id: int, cursor: str = None, limit: int = 50):
+    # 走 (group_id, id) 索引，新的在前
+    query = _activity_query(db).filter(models.Activity.group_id == group_id)
+    return paginate(query, models.Activity, cursor, limit, models.Activity.id, descending=True)
+
+def get_user_timeline(db: Session, user_id: int, cursor: str = None, limit: int = 50):
+    # 按时间线主键 (user_id, activity_id) 倒序扫描；后台删除中的小组的条目在清理完成前跳过
+    query = _activity_query(db) \
+        .join(models.TimelineEntry, models.TimelineEntry.id == models.Activity.id) \
+        .join(models.Group, models.Group.id == models.TimelineEntry.group_id) \
+        .filter(models.TimelineEntry.user_id == user_id, _live_group)
+    return paginate(query, models.TimelineEntry, cursor, limit, models.TimelineEntry.id, descending=True)
 
 #-------------------------------------------------------------------------------------------------------------------------
 
@@ -358,9 +731,17 @@ def create_discussion(db: Session, discussion: schemas.DiscussionCreate, user_id
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    in_group = exists().where(models.GroupMedia.id == media_id, models.GroupMedia.group_id == group_id)
+    if not db.query(in_group).scalar():
+        raise HTTPException(status_code=404, detail="Media not found in this group")
     
     db_discussion = models.Discussion(**discussion.dict(), user_id=user_id, group_id=group_id, media_id=media_id)
     db.add(db_discussion)
+    db.flush()
+    record_activity(db, "discussion_created", group_id, user_id, media_id=media_id, discussion_id=db_discussion.id,
+                    target_id=db_discussion.id, title=db_discussion.title, excerpt=_excerpt(db_discussion.content))
+    # 新讨论也递增：id 被复用时旧的 ETag 不会命中
+    versions.bump(db, versions.discussion(db_discussion.id))
     db.commit()
     db.refresh(db_discussion)
     
@@ -374,10 +755,23 @@ def create_discussion(db: Session, discussion: schemas.DiscussionCreate, user_id
         "media_id": db_discussion.media_id,
         "username": user.username
     }
+    pubsub.publish(pubsub.group_media_channel(group_id, media_id), "discussion", discussion_data)
     return discussion_data
 
-def get_discussions(db: Session, group_id: int, media_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Discussion).filter(models.Discussion.group_id == group_id, models.Discussion.media_id == media_id).offset(skip).limit(limit).all()
+def get_discussions(db: Session, group_id: int, media_id: int, cursor: str = None, limit: int = 100):
+    # 只取列并连接 users 取用户名，避免逐条加载 Discussion.user
+    query = db.query(
+        models.Discussion.id,
+        models.Discussion.title,
+        models.Discussion.content,
+        models.Discussion.created_at,
+        models.Discussion.user_id,
+        models.Discussion.group_id,
+        models.Discussion.media_id,
+        models.User.username
+    ).outerjoin(models.User, models.User.id == models.Discussion.user_id) \
+     .filter(models.Discussion.group_id == group_id, models.Discussion.media_id == media_id)
+    return paginate(query, models.Discussion, cursor, limit)
 
 def get_discussion(db: Session, discussion_id: int):
     discussion = db.query(models.Discussion).options(
@@ -409,15 +803,32 @@ def get_discussion(db: Session, discussion_id: int):
         }
     return None
 
+def get_discussion_etag(db: Session, discussion_id: int):
+    # 讨论随媒体或小组一起删除时不递增版本，所以同时检查它是否还存在；用户名来自 users 表，改名也使其失效
+    return versions.current_etag(
+        db, versions.discussion(discussion_id), versions.USERS,
+        exists_clause=exists().where(models.Discussion.id == discussion_id),
+    )
+
 def create_comment(db: Session, comment: schemas.CommentCreate, user_id: int, discussion_id: int):
+    discussion = db.query(models.Discussion.group_id, models.Discussion.media_id, models.Discussion.title) \
+                   .filter(models.Discussion.id == discussion_id).first()
+    if not discussion:
+        raise HTTPException(status_code=404, detail="Discussion not found")
+
     db_comment = models.Comment(**comment.dict(), user_id=user_id, discussion_id=discussion_id)
     db.add(db_comment)
+    db.flush()
+    record_activity(db, "comment_created", discussion.group_id, user_id, media_id=discussion.media_id,
+                    discussion_id=discussion_id, target_id=db_comment.id, title=discussion.title,
+                    excerpt=_excerpt(db_comment.content))
+    versions.bump(db, versions.discussion(discussion_id))
     db.commit()
     db.refresh(db_comment)
     
     user = db.query(models.User).filter(models.User.id == user_id).first()
     
-    return {
+    comment_data = {
         "id": db_comment.id,
         "content": db_comment.content,
         "created_at": db_comment.created_at,
@@ -425,12 +836,40 @@ def create_comment(db: Session, comment: schemas.CommentCreate, user_id: int, di
         "discussion_id": db_comment.discussion_id,
         "username": user.username if user else None
     }
-
-def get_comments(db: Session, discussion_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Comment).filter(models.Comment.discussion_id == discussion_id).offset(skip).limit(limit).all()
+    pubsub.publish(pubsub.discussion_channel(discussion_id), "comment", comment_data, event_id=db_comment.id)
+    return comment_data
+
+def _comments_query(db: Session, discussion_id: int):
+    return db.query(
+        models.Comment.id,
+        models.Comment.content,
+        models.Comment.created_at,
+        models.Comment.user_id,
+        models.Comment.discussion_id,
+        models.User.username
+    ).outerjoin(models.User, models.User.id == models.Comment.user_id) \
+     .filter(models.Comment.discussion_id == discussion_id)
+
+def get_comments(db: Session, discussion_id: int, cursor: str = None, limit: int = 100):
+    return paginate(_comments_query(db, discussion_id), models.Comment, cursor, limit)
+
+def get_comments_after(db: Session, discussion_id: int, after_id: int, limit: int = 500):
+    # 实时流重连时补发：id 大于客户端最后收到的评论
+    return _comments_query(db, discussion_id).filter(models.Comment.id > after_id) \
+             .order_by(models.Comment.id).limit(limit).all()
+
+def check_discussion_member(db: Session, discussion_id: int, user_id: int):
+    """Return the discussion's group id; 404 if the discussion does not exist, 403 for non-members."""
+    is_member = _membership_exists(models.Discussion.group_id, user_id).label("is_member")
+    discussion = db.query(models.Discussion.group_id, is_member).filter(models.Discussion.id == discussion_id).first()
+    if discussion is None:
+        raise HTTPException(status_code=404, detail="Discussion not found")
+    if not discussion.is_member:
+        raise HTTPException(status_code=403, detail="User is not a member of this group")
+    return discussion.group_id
 
 def delete_discussion(db: Session, discussion_id: int, current_user_id: int):
-    discussion = db.query(models.Discussion).options(joinedload(models.Discussion.comments)).filter(models.Discussion.id == discussion_id).first()
+    discussion = db.query(models.Discussion.user_id).filter(models.Discussion.id == discussion_id).first()
     
     if not discussion:
         raise HTTPException(status_code=404, detail="Discussion not found")
@@ -438,11 +877,11 @@ def delete_discussion(db: Session, discussion_id: int, current_user_id: int):
     if discussion.user_id != current_user_id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this discussion")
     
-    # 删除相关的评论
-    for comment in discussion.comments:
-        db.delete(comment)
-    
-    db.delete(discussion)
+    # 删除相关的动态和评论
+    delete_where(db, models.Activity, models.Activity.discussion_id == discussion_id)
+    delete_where(db, models.Comment, models.Comment.discussion_id == discussion_id)
+    delete_where(db, models.Discussion, models.Discussion.id == discussion_id)
+    versions.bump(db, versions.discussion(discussion_id))
     db.commit()
     
-    return {"message": "Discussion and related comments deleted successfully"}
\ No newline at end of file
+    return {"message": "Discussion and related comments deleted successfully"}
@@ -0,0 +1,59 @@
+"""Async variants of the crud functions used by `async def` routes.
+
+Each one runs the matching function from `crud` through `database.run_db`,
+so it works with both an AsyncSession (async driver) and a plain Session
+(threadpool), depending on DATABASE_URL.
+"""
+from datetime import timedelta
+from typing import List
+from . import crud, schemas, passwords
+from .database import run_db, close_db
+
+async def get_user(db, username: str):
+    return await run_db(db, crud.get_user, username)
+
+async def get_user_cached(db, username: str, user_id: int = None):
+    # 缓存命中时不经过线程池/数据库
+    return crud.cached_user(username, user_id) or await run_db(db, crud.load_user, username, user_id)
+
+async def authenticate_user(db, username: str, password: str):
+    user = await get_user(db, username)
+    # bcrypt 校验在独立进程池中执行，等待期间不占用连接池中的连接
+    await close_db(db)
+    if not user or not await passwords.verify_password(password, user.hashed_password):
+        return False
+    return user
+
+async def create_user(db, user: schemas.UserCreate, hashed_password: str):
+    return await run_db(db, crud.create_user, user, hashed_password)
+
+#------------------------------------------------------------------------------------------------
+
+async def get_bangumi_subject(db, bangumi_id: int, max_age: timedelta):
+    return await run_db(db, crud.get_bangumi_subject, bangumi_id, max_age)
+
+async def get_bangumi_subjects(db, bangumi_ids: List[int], max_age: timedelta):
+    return await run_db(db, crud.get_bangumi_subjects, bangumi_ids, max_age)
+
+async def save_bangumi_subject(db, subject: dict):
+    return await run_db(db, crud.save_bangumi_subject, subject)
+
+#------------------------------------------------------------------------------------------------
+
+async def create_user_media(db, user_id: int, media: schemas.UserMediaCreate):
+    return await run_db(db, crud.create_user_media, user_id, media)
+
+async def bulk_create_user_media(db, user_id: int, media: List[schemas.UserMediaCreate]):
+    return await run_db(db, crud.bulk_create_user_media, user_id, media)
+
+async def get_user_media(db, user_id: int, **filters):
+    return await run_db(db, crud.get_user_media, user_id, **filters)
+
+async def get_user_media_page(db, user_id: int, **filters):
+    return await run_db(db, crud.get_user_media_page, user_id, **filters)
+
+async def get_single_media(db, media_id: int):
+    return await run_db(db, crud.get_single_media, media_id)
+
+async def delete_user_media(db, user_id: int, media_id: int):
+    return await run_db(db, crud.delete_user_media, user_id, media_id)
@@ -1,6 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
 
@@ -10,14 +15,87 @@ load_dotenv()
 # 获取数据库URL
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
 
+# URL 使用异步驱动（如 sqlite+aiosqlite、postgresql+asyncpg）时启用异步模式
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+ASYNC_MODE = _url.get_dialect().is_async
+
+IS_SQLITE = _url.get_backend_name() == "sqlite"
+
+# 连接池按 worker 数划分：每个 uvicorn worker 进程各有一个池
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(max(5, DB_MAX_CONNECTIONS // (2 * WEB_CONCURRENCY)))))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", str(max(0, DB_MAX_CONNECTIONS // WEB_CONCURRENCY - DB_POOL_SIZE))))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# SQLite 每个连接建立时执行的 PRAGMA
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_PRAGMAS = [
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    f"cache_size=-{SQLITE_CACHE_SIZE_KB}",
+    f"mmap_size={SQLITE_MMAP_SIZE}",
+    f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    "foreign_keys=ON",
+    "temp_store=MEMORY",
+]
+
+def _engine_options(url, is_async=False):
+    pool_options = {
+        "poolclass": AsyncAdaptedQueuePool if is_async else QueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if IS_SQLITE:
+        options = {"connect_args": {"check_same_thread": False}}
+        # 内存数据库使用 SQLAlchemy 默认的单连接池
+        if url.database and url.database != ":memory:":
+            options.update(pool_options)
+        return options
+    return dict(pool_options, pool_pre_ping=True)
+
+def _on_sqlite_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+# 异步驱动对应的同步驱动；只换驱动会落到方言默认的驱动上（PostgreSQL 是未安装的 psycopg2）
+SYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite+pysqlite",
+    "postgresql+asyncpg": "postgresql+psycopg",
+    "postgresql+psycopg_async": "postgresql+psycopg",
+}
+
+def _sync_url_for(url):
+    # DATABASE_SYNC_URL 可显式指定同步引擎的 URL
+    override = os.getenv("DATABASE_SYNC_URL")
+    if override:
+        return make_url(override)
+    if url.drivername not in SYNC_DRIVERS:
+        raise RuntimeError(f"No sync driver known for {url.drivername}; set DATABASE_SYNC_URL")
+    return url.set(drivername=SYNC_DRIVERS[url.drivername])
+
+# 同步引擎始终存在：建表和同步路由（线程池中运行）使用它
+_sync_url = _sync_url_for(_url) if ASYNC_MODE else _url
+
 # 创建 SQLAlchemy 引擎
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = create_engine(_sync_url, **_engine_options(_sync_url))
 
 # 创建 SessionLocal 类
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(_url, **_engine_options(_url, is_async=True)) if ASYNC_MODE else None
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) if ASYNC_MODE else None
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _on_sqlite_connect)
+    if async_engine is not None:
+        event.listen(async_engine.sync_engine, "connect", _on_sqlite_connect)
+
 # 创建 Base 类
 Base = declarative_base()
 
@@ -27,4 +105,57 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@asynccontextmanager
+async def async_session_scope():
+    """Open an AsyncSession in async mode, otherwise a plain Session."""
+    if ASYNC_MODE:
+        async with AsyncSessionLocal() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+# 供 async 路由使用的依赖项
+async def get_async_db():
+    async with async_session_scope() as db:
+        yield db
+
+async def run_db(db, fn, *args, **kwargs):
+    """Run sync crud function `fn(db, ...)` without blocking the event loop.
+
+    With an AsyncSession it runs through `run_sync` on the async driver,
+    otherwise in the threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def close_db(db):
+    """Release the session's connection, e.g. before a long await."""
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        await run_in_threadpool(db.close)
+
+async def stream_partitions(statement, batch_size: int = 500):
+    """Yield the ORM rows of `statement` in lists of up to `batch_size`.
+
+    Rows come from a server-side cursor (`yield_per`), so only one batch is
+    held in memory at a time. The generator opens its own session because it
+    outlives the request's dependencies.
+    """
+    statement = statement.execution_options(yield_per=batch_size)
+    async with async_session_scope() as db:
+        if isinstance(db, AsyncSession):
+            result = await db.stream_scalars(statement)
+            async for batch in result.partitions():
+                yield batch
+        else:
+            result = await run_in_threadpool(db.scalars, statement)
+            async for batch in iterate_in_threadpool(result.partitions()):
+                yield batch
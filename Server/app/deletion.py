@@ -0,0 +1,58 @@
+"""Background deletion of large groups.
+
+`crud.delete_group` removes small groups in one transaction. Larger groups
+are marked deleted and purged here in batches of `GROUP_DELETE_BATCH` rows,
+each batch in its own short transaction, so other writers are never blocked
+for the whole deletion. Groups left marked by a restart are purged again at
+startup.
+"""
+from sqlalchemy import select
+from . import crud, models
+from .database import SessionLocal
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+GROUP_DELETE_BATCH = int(os.getenv("GROUP_DELETE_BATCH", "1000"))
+
+_stopping = threading.Event()
+
+def purge_group(group_id: int):
+    """Delete a group marked by `crud.delete_group` and everything in it, batch by batch."""
+    with SessionLocal() as db:
+        catalog_ids = crud.group_manual_catalog_ids(db, group_id)
+    for model, condition in crud.group_contents(group_id):
+        while True:
+            if _stopping.is_set():
+                # 已提交的批次不会回滚，下次启动时从剩余的行继续
+                return
+            with SessionLocal() as db:
+                batch = select(model.id).where(condition).limit(GROUP_DELETE_BATCH)
+                deleted = crud.delete_where(db, model, model.id.in_(batch)).rowcount
+                db.commit()
+            if deleted < GROUP_DELETE_BATCH:
+                break
+    with SessionLocal() as db:
+        crud.prune_catalog(db, catalog_ids)
+        # 成员关系通常已由 crud.delete_group 删除，这里再删一次，保证重复执行也安全
+        db.execute(models.group_members.delete().where(models.group_members.c.group_id == group_id))
+        crud.delete_where(db, models.Group, models.Group.id == group_id)
+        db.commit()
+    logger.info("Purged group %d", group_id)
+
+def purge_deleted_groups():
+    with SessionLocal() as db:
+        group_ids = db.scalars(select(models.Group.id).where(models.Group.deleted_at.is_not(None))).all()
+    for group_id in group_ids:
+        purge_group(group_id)
+
+def start():
+    """Resume purges interrupted by a restart, in a daemon thread."""
+    _stopping.clear()
+    threading.Thread(target=purge_deleted_groups, name="group-purge", daemon=True).start()
+
+def stop():
+    # 当前批次完成后退出
+    _stopping.set()
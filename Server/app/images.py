@@ -0,0 +1,145 @@
+"""On-disk cache of cover images and the thumbnails served from it.
+
+Covers are downloaded once through the shared Bangumi client. Each source URL
+gets a directory named after its SHA-256, holding the original file and one
+JPEG per thumbnail size. A Bangumi image URL never changes content, so the
+served files are immutable and browsers may cache them for a year. Resizing
+needs Pillow; without it the cached original is served for every size.
+"""
+from fastapi import HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from importlib.util import find_spec
+from pathlib import Path
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from .concurrency import SingleFlight
+from . import bangumi_api, metrics
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+load_dotenv()
+
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR", "image_cache"))
+# 只代理这些主机的图片，防止被用来请求任意地址；其他主机的 URL 返回 400
+IMAGE_ALLOWED_HOSTS = {host.strip() for host in os.getenv("IMAGE_ALLOWED_HOSTS", "lain.bgm.tv").split(",") if host.strip()}
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+# 设置后由 nginx 发送文件（X-Accel-Redirect，内部 location 指向 IMAGE_CACHE_DIR），例如 /_image_cache/
+IMAGE_ACCEL_REDIRECT_PREFIX = os.getenv("IMAGE_ACCEL_REDIRECT_PREFIX", "")
+
+# 各尺寸的宽度（像素），高度按比例缩放
+THUMBNAIL_WIDTHS = {"small": 160, "medium": 320, "large": 640}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+HAS_PILLOW = find_spec("PIL") is not None
+
+# 同一图片的并发请求只下载、缩放一次
+_flights = SingleFlight("images.flight")
+
+def is_cacheable(src: str) -> bool:
+    parts = urlsplit(src)
+    return parts.scheme in ("http", "https") and parts.hostname in IMAGE_ALLOWED_HOSTS
+
+def _key(src: str) -> str:
+    return hashlib.sha256(src.encode()).hexdigest()
+
+def etag(src: str, size: str) -> str:
+    return f'"{_key(src)}-{size}"'
+
+def _directory(src: str) -> Path:
+    key = _key(src)
+    return IMAGE_CACHE_DIR / key[:2] / key
+
+def _find_original(directory: Path):
+    return next(directory.glob("original.*"), None)
+
+def _write_atomic(path: Path, write):
+    # 先写临时文件再改名，并发读者不会读到写了一半的文件
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+async def _download(src: str, directory: Path) -> Path:
+    content, content_type = await bangumi_api.fetch_image(src, allow=is_cacheable)
+    metrics.incr("images.downloads")
+    extension = mimetypes.guess_extension(content_type) or ".img"
+    path = directory / f"original{extension}"
+    await run_in_threadpool(_write_atomic, path, lambda file: file.write(content))
+    return path
+
+def _flatten(image):
+    from PIL import Image
+
+    # JPEG 没有透明通道；直接 convert("RGB") 会把透明部分变成黑色，先铺到白底上
+    if not image.has_transparency_data:
+        return image.convert("RGB")
+    image = image.convert("RGBA")
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+    return background
+
+def _resize(original: Path, target: Path, width: int):
+    from PIL import Image
+
+    with Image.open(original) as image:
+        # JPEG 解码时直接按缩小后的尺寸解码，省去大部分像素
+        image.draft("RGB", (width, image.height * width // max(image.width, 1)))
+        image = _flatten(image)
+        if image.width > width:
+            image.thumbnail((width, image.height * width // image.width or 1), Image.LANCZOS)
+        _write_atomic(target, lambda file: image.save(file, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True))
+
+async def _original(src: str) -> Path:
+    directory = _directory(src)
+    original = await run_in_threadpool(_find_original, directory)
+    if original is None:
+        original = await _flights.do((src, "original"), lambda: _download(src, directory))
+    return original
+
+async def _generate(src: str, size: str, target: Path) -> Path:
+    from PIL import Image
+
+    original = await _original(src)
+    try:
+        await run_in_threadpool(_resize, original, target, THUMBNAIL_WIDTHS[size])
+    except (OSError, Image.DecompressionBombError):
+        # 上游声明是图片但无法解码（UnidentifiedImageError 是 OSError 的子类）：
+        # 删除缓存的原图，下次请求重新下载，而不是一直失败
+        metrics.incr("images.decode_errors")
+        await run_in_threadpool(original.unlink, missing_ok=True)
+        raise HTTPException(status_code=502, detail="Upstream image could not be decoded")
+    return target
+
+async def get_thumbnail(src: str, size: str) -> Path:
+    """Path of the `size` thumbnail of `src`, downloading and resizing it on first use.
+
+    Raises HTTPException (502) when the image cannot be fetched.
+    """
+    if not HAS_PILLOW:
+        return await _original(src)
+    target = _directory(src) / f"{size}.jpg"
+    if target.exists():
+        metrics.incr("images.hits")
+        return target
+    metrics.incr("images.misses")
+    return await _flights.do((src, size), lambda: _generate(src, size, target))
+
+def file_response(path: Path, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if IMAGE_ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = IMAGE_ACCEL_REDIRECT_PREFIX + path.relative_to(IMAGE_CACHE_DIR).as_posix()
+        return Response(headers=headers, media_type=mimetypes.guess_type(path.name)[0])
+    # 服务器支持 http.response.pathsend 扩展时由服务器直接发送文件
+    return FileResponse(path, headers=headers)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL})
@@ -1,17 +1,37 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine
-from . import models
-from .routers import users, media, reviews, bangumi, group, discussion
+from .database import engine, async_engine
+from . import models, metrics, bangumi_api, passwords, migrations, querycount, search, deletion, pubsub
+from .pagination import NEXT_CURSOR_HEADER
+from .responses import DefaultJSONResponse, CompressionMiddleware
+from .routers import users, media, reviews, bangumi, group, discussion, images
+from .routers import search as search_router
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import uvicorn
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
 
-models.Base.metadata.create_all(bind=engine)
+# 建表和迁移持有跨进程锁，多个 worker 同时启动时依次执行；
+# 也可以设 MIGRATE_ON_STARTUP=0，改为部署时单独执行一次 python -m app.migrations
+if migrations.MIGRATE_ON_STARTUP:
+    migrations.upgrade(engine)
+search.install(engine)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    deletion.start()
+    await pubsub.start()
+    yield
+    await pubsub.stop()
+    deletion.stop()
+    await bangumi_api.close_client()
+    passwords.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=DefaultJSONResponse)
 
 origins = [
     "https://kksk.yukinolov.com",
@@ -31,20 +51,46 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"]
 )
 
+# 超过 GZIP_MINIMUM_SIZE 的响应（主要是列表）gzip 压缩，SSE 流和图片除外
+app.add_middleware(CompressionMiddleware)
+
+# 设置 SQL_STATEMENT_BUDGET 后统计每个请求的 SQL 语句数，用于发现 N+1 查询
+if querycount.SQL_STATEMENT_BUDGET:
+    querycount.track_statements(engine)
+    if async_engine is not None:
+        querycount.track_statements(async_engine.sync_engine)
+    app.add_middleware(querycount.StatementBudgetMiddleware, budget=querycount.SQL_STATEMENT_BUDGET)
+
 app.include_router(users.router)
 app.include_router(reviews.router, prefix="/reviews", tags=["reviews"])
 app.include_router(bangumi.router, prefix="/bangumi", tags=["bangumi"])
 app.include_router(media.router, prefix="/media", tags=["media"])
 app.include_router(group.router, prefix="/groups", tags=["groups"])
 app.include_router(discussion.router, prefix="/discussions", tags=["discussions"])
+app.include_router(search_router.router, prefix="/search", tags=["search"])
+app.include_router(images.router, prefix="/images", tags=["images"])
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Anime Review API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: str | None = Header(None)):
+    # 计数器会泄露流量和用户规模，只对持有 METRICS_TOKEN 的监控开放
+    if not metrics.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not metrics.authorized(authorization):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return metrics.snapshot()
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,40 @@
+from collections import defaultdict
+from threading import Lock
+from dotenv import load_dotenv
+import hmac
+import os
+
+load_dotenv()
+
+# 读取 /metrics 需要的令牌（Authorization: Bearer <token>）；未设置时接口关闭
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# 进程内计数器，通过 GET /metrics 暴露
+_counters = defaultdict(int)
+_lock = Lock()
+# 派生指标：名称 -> (分子计数器, 分母计数器)，snapshot 中以百分比给出
+_ratios = {}
+
+def incr(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+def get(name: str) -> int:
+    return _counters.get(name, 0)
+
+def register_ratio(name: str, numerator: str, denominator: str):
+    _ratios[name] = (numerator, denominator)
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+    for name, (numerator, denominator) in _ratios.items():
+        if counters.get(denominator):
+            counters[name] = round(100 * counters.get(numerator, 0) / counters[denominator], 1)
+    return counters
+
+def authorized(authorization: str | None) -> bool:
+    """Whether the Authorization header carries METRICS_TOKEN."""
+    if not METRICS_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
@@ -0,0 +1,222 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from sqlalchemy import inspect, text, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from .database import Base
+from .models import RATING_BUCKETS, rating_bucket, MediaCatalog
+from . import search
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# 已被更完整的复合索引取代的旧索引
+OBSOLETE_INDEXES = {
+    "reviews": ["ix_reviews_media_id", "ix_reviews_user_id"],
+    "group_reviews": ["ix_group_reviews_media_id"],
+    "discussions": ["ix_discussions_group_media"],
+    "comments": ["ix_comments_discussion_id"],
+    "user_media": ["ix_user_media_user_id"],
+    "group_media": ["ix_group_media_group_id", "ix_group_media_bangumi_id"],
+}
+
+# 评分汇总列所在的媒体表 -> 对应的评论表
+RATING_AGGREGATE_TABLES = {"user_media": "reviews", "group_media": "group_reviews"}
+
+# 图片和简介已移到共享的 media_catalog；这些表的旧列在全部行关联到目录后删除
+CATALOG_TABLES = ("user_media", "group_media")
+CATALOG_LEGACY_COLUMNS = ("image", "summary")
+CATALOG_FIELDS = ("bangumi_id", "title", "media_type", "image", "summary")
+# 回填分批提交，每批只短暂持有写锁；中断后下次启动从尚未关联的行继续
+CATALOG_BACKFILL_BATCH = int(os.getenv("CATALOG_BACKFILL_BATCH", "2000"))
+
+# 等待其他进程完成迁移的最长时间（秒）；回填大表可能需要几分钟
+MIGRATION_LOCK_TIMEOUT = float(os.getenv("MIGRATION_LOCK_TIMEOUT", "600"))
+# PostgreSQL advisory lock 的键，任意固定值
+MIGRATION_LOCK_KEY = 0x6B6B736B
+
+# 是否在应用启动时迁移；设为 0 时由部署流程执行 python -m app.migrations
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    """Cross-process lock around the upgrade, so concurrently starting workers run it one at a time."""
+    url = engine.url
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    elif engine.dialect.name == "sqlite" and url.database and url.database != ":memory:":
+        # 在旁边的锁文件上持有排他事务：跨平台，进程退出时自动释放
+        lock = sqlite3.connect(url.database + ".migrate-lock", timeout=MIGRATION_LOCK_TIMEOUT, isolation_level=None)
+        try:
+            lock.execute("BEGIN EXCLUSIVE")
+            yield
+        finally:
+            lock.close()
+    else:
+        yield
+
+def upgrade(engine: Engine):
+    """Create missing tables and bring existing ones up to the current schema.
+
+    Idempotent; a process that waited for the lock finds nothing left to do.
+    """
+    with _migration_lock(engine):
+        Base.metadata.create_all(bind=engine)
+        _upgrade(engine)
+
+# create_all 只会建新表，不会给已有的表补列和索引；在这里补齐
+def _upgrade(engine: Engine):
+    with engine.begin() as conn:
+        existing = {
+            table: {index["name"] for index in inspect(conn).get_indexes(table)}
+            for table in inspect(conn).get_table_names()
+        }
+        for table in Base.metadata.sorted_tables:
+            if table.name in existing:
+                added = _add_missing_columns(conn, table)
+                if "review_count" in added and table.name in RATING_AGGREGATE_TABLES:
+                    _backfill_rating_aggregates(conn, table.name, RATING_AGGREGATE_TABLES[table.name])
+        if "uq_group_members_group_user" not in existing.get("group_members", set()):
+            _dedupe_group_members(conn)
+        for table_name, index_names in OBSOLETE_INDEXES.items():
+            for index_name in index_names:
+                if index_name in existing.get(table_name, set()):
+                    conn.execute(text(f"DROP INDEX {index_name}"))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing.get(table.name, set()):
+                    index.create(bind=conn)
+    _move_media_to_catalog(engine)
+
+def _dedupe_group_members(conn):
+    # 建唯一索引前删除重复的成员关系。表中只有这两列，重复行完全相同：删掉重复键的所有行再各插回一行，
+    # 不依赖 rowid/ctid 等方言特有的行标识，所有数据库都适用
+    duplicates = conn.execute(text(
+        "SELECT group_id, user_id FROM group_members GROUP BY group_id, user_id HAVING COUNT(*) > 1"
+    )).mappings().all()
+    if not duplicates:
+        return
+    conn.execute(text("DELETE FROM group_members WHERE group_id = :group_id AND user_id = :user_id"), duplicates)
+    conn.execute(text("INSERT INTO group_members (group_id, user_id) VALUES (:group_id, :user_id)"), duplicates)
+
+def _add_missing_columns(conn, table):
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}"
+        if column.server_default is not None:
+            ddl += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+        conn.execute(text(ddl))
+        added.append(column.name)
+    return added
+
+def _backfill_rating_aggregates(conn, media_table: str, review_table: str):
+    # 一次性从已有评论计算汇总；分桶规则与 models.rating_bucket 一致，所以在 Python 中计算
+    totals = defaultdict(lambda: {"review_count": 0, "rating_sum": 0.0, **{f"rating_{b}": 0 for b in range(RATING_BUCKETS)}})
+    for media_id, rating in conn.execute(text(f"SELECT media_id, rating FROM {review_table} WHERE rating IS NOT NULL")):
+        row = totals[media_id]
+        row["review_count"] += 1
+        row["rating_sum"] += rating
+        row[f"rating_{rating_bucket(rating)}"] += 1
+    if not totals:
+        return
+    columns = ", ".join(f"{name} = :{name}" for name in next(iter(totals.values())))
+    conn.execute(
+        text(f"UPDATE {media_table} SET {columns} WHERE id = :media_id"),
+        [dict(values, media_id=media_id) for media_id, values in totals.items()],
+    )
+
+def _move_media_to_catalog(engine: Engine):
+    with engine.connect() as conn:
+        legacy = [
+            table for table in CATALOG_TABLES
+            if set(CATALOG_LEGACY_COLUMNS) <= {column["name"] for column in inspect(conn).get_columns(table)}
+        ]
+        if not legacy:
+            return
+        # 手动条目没有 bangumi_id，内容完全相同的（如同步到小组的副本）共用一行
+        manual = {
+            tuple(row[1:]): row[0]
+            for row in conn.execute(text("SELECT id, title, media_type, image, summary FROM media_catalog WHERE bangumi_id IS NULL"))
+        }
+    moved = 0
+    for table in legacy:
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(text(
+                    f"SELECT id, bangumi_id, title, media_type, image, summary FROM {table} "
+                    f"WHERE catalog_id IS NULL ORDER BY id LIMIT :limit"
+                ), {"limit": CATALOG_BACKFILL_BATCH}).all()
+                if not rows:
+                    break
+                catalog_ids = _catalog_ids(conn, rows, manual)
+                conn.execute(
+                    text(f"UPDATE {table} SET catalog_id = :catalog_id WHERE id = :id"),
+                    [{"id": row.id, "catalog_id": catalog_id} for row, catalog_id in zip(rows, catalog_ids)],
+                )
+            moved += len(rows)
+    try:
+        with engine.begin() as conn:
+            for table in legacy:
+                # 旧的全文索引建在这些列上，由 search.install 在 media_catalog 上重建
+                search.drop_fts5(conn, table)
+                for column in CATALOG_LEGACY_COLUMNS:
+                    conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+    except OperationalError:
+        # SQLite 3.35 之前不支持 DROP COLUMN；旧列可以为空，保留也不影响使用
+        logger.warning("Could not drop the legacy media columns; they are no longer used", exc_info=True)
+        return
+    logger.info("Moved %d media rows to media_catalog; run VACUUM to return the freed pages to the OS", moved)
+
+def _catalog_ids(conn, rows, manual: dict):
+    catalog = MediaCatalog.__table__
+    columns = select(catalog.c.bangumi_id, catalog.c.id, catalog.c.title, catalog.c.image, catalog.c.summary)
+    bangumi_ids = {row.bangumi_id for row in rows if row.bangumi_id is not None}
+    shared = {}
+    if bangumi_ids:
+        shared = {entry.bangumi_id: entry for entry in conn.execute(columns.where(catalog.c.bangumi_id.in_(bangumi_ids)))}
+    # 缺少的 Bangumi 条目以最早添加的那一行建共享行
+    new_shared = {}
+    for row in rows:
+        if row.bangumi_id is not None and row.bangumi_id not in shared:
+            new_shared.setdefault(row.bangumi_id, {field: row._mapping[field] for field in CATALOG_FIELDS})
+    if new_shared:
+        conn.execute(catalog.insert(), list(new_shared.values()))
+        shared.update((entry.bangumi_id, entry) for entry in conn.execute(columns.where(catalog.c.bangumi_id.in_(new_shared))))
+
+    def shares_row(row):
+        entry = shared.get(row.bangumi_id)
+        # 全文索引建在目录的标题上：标题不同的条目不能共用一行，否则搜不到自己的标题
+        return entry is not None and (entry.title, entry.image, entry.summary) == (row.title, row.image, row.summary)
+
+    def content(row):
+        return (row.title, row.media_type, row.image, row.summary)
+
+    # 手动条目和标题/图片/简介与共享行不同的条目各按内容建行，不丢弃任何一行的内容；内容完全相同的（如同步到小组的副本）共用一行
+    new_manual = {}
+    for row in rows:
+        if not shares_row(row) and content(row) not in manual:
+            new_manual.setdefault(content(row), dict(zip(CATALOG_FIELDS, (None,) + content(row))))
+    if new_manual:
+        # 需要按顺序对应新行，逐行插入（通常很少）
+        created = conn.execute(
+            catalog.insert().returning(catalog.c.id, sort_by_parameter_order=True), list(new_manual.values())
+        ).scalars().all()
+        manual.update(zip(new_manual, created))
+    return [shared[row.bangumi_id].id if shares_row(row) else manual[content(row)] for row in rows]
+
+if __name__ == "__main__":
+    from .database import engine
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
@@ -1,12 +1,88 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import select, Column, Integer, Float, String, ForeignKey, DateTime, Text, Table, Index
+from sqlalchemy.orm import relationship, declared_attr, column_property
 from sqlalchemy.sql import func
 from .database import Base
 from sqlalchemy.ext.hybrid import hybrid_property
+from operator import attrgetter, itemgetter
+
+# 评分 0-10，直方图按整数部分分为 11 个桶
+RATING_BUCKETS = 11
+
+def rating_bucket(rating) -> int:
+    return min(max(int(rating), 0), RATING_BUCKETS - 1)
+
+class RatingAggregates:
+    """Review count, rating sum and rating histogram of a media item.
+
+    Maintained incrementally by the review crud functions, so list endpoints
+    can return averages without touching the review tables.
+    """
+    review_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Float, nullable=False, default=0, server_default="0")
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.review_count if self.review_count else None
+
+    @property
+    def rating_histogram(self):
+        try:
+            # 已加载的列值就在实例 __dict__ 中，绕过逐列的属性描述符
+            counts = _histogram_items(self.__dict__)
+        except KeyError:
+            # 有列已过期（如提交之后），走属性访问以便重新加载
+            counts = _histogram_getter(self)
+        return [count or 0 for count in counts]
+
+# 直方图每个桶一列（rating_0 ... rating_10），增减都是单条 UPDATE col = col + n
+for _bucket in range(RATING_BUCKETS):
+    setattr(RatingAggregates, f"rating_{_bucket}", Column(Integer, nullable=False, default=0, server_default="0"))
+
+# 列表序列化时每行都要取一次直方图，一次取出所有桶
+_HISTOGRAM_COLUMNS = tuple(f"rating_{bucket}" for bucket in range(RATING_BUCKETS))
+_histogram_items = itemgetter(*_HISTOGRAM_COLUMNS)
+_histogram_getter = attrgetter(*_HISTOGRAM_COLUMNS)
+
+class MediaCatalog(Base):
+    """Shared image and summary of a title, stored once however many libraries and groups hold it.
+
+    Bangumi subjects have one row per `bangumi_id`; manual entries get their own row.
+    """
+    __tablename__ = "media_catalog"
+
+    id = Column(Integer, primary_key=True, index=True)
+    bangumi_id = Column(Integer, unique=True, nullable=True)
+    title = Column(String)
+    media_type = Column(Integer)
+    image = Column(String)
+    summary = Column(String)
+
+class CatalogEntry:
+    """Library or group row that takes its image and summary from `media_catalog`.
+
+    `title` and `media_type` stay on the row: they are the filter and sort keys
+    of the (owner, title, id) index.
+    """
+    # 迁移时先加列再回填，所以列本身允许为空；新行总是带 catalog_id
+    @declared_attr
+    def catalog_id(cls):
+        return Column(Integer, ForeignKey("media_catalog.id"))
+
+    # 以关联子查询映射为普通列：列表查询只多两列，不必为每行再构造一个目录对象
+    @declared_attr
+    def image(cls):
+        return column_property(select(MediaCatalog.image).where(MediaCatalog.id == cls.catalog_id).scalar_subquery())
+
+    @declared_attr
+    def summary(cls):
+        return column_property(select(MediaCatalog.summary).where(MediaCatalog.id == cls.catalog_id).scalar_subquery())
 
 group_members = Table('group_members', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id')),
-    Column('group_id', Integer, ForeignKey('groups.id'))
+    Column('group_id', Integer, ForeignKey('groups.id')),
+    # 成员关系唯一；(user_id, group_id) 用于“我的小组”查询
+    Index('uq_group_members_group_user', 'group_id', 'user_id', unique=True),
+    Index('ix_group_members_user_group', 'user_id', 'group_id')
 )
 
 class Group(Base):
@@ -17,6 +93,8 @@ class Group(Base):
     description = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # 大小组删除时先打上标记，内容由后台任务分批清理（见 deletion.py）
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
 
     owner = relationship("User", back_populates="owned_groups")
     members = relationship("User", secondary=group_members, back_populates="groups")
@@ -27,18 +105,22 @@ class Group(Base):
     def owner_name(self):
         return self.owner.username if self.owner else None
 
-class GroupMedia(Base):
+class GroupMedia(CatalogEntry, RatingAggregates, Base):
     __tablename__ = "group_media"
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    image = Column(String)
-    summary = Column(String)
-    bangumi_id = Column(Integer, index=True, nullable=True)
+    bangumi_id = Column(Integer, nullable=True)
     media_type = Column(Integer)
     group_id = Column(Integer, ForeignKey("groups.id"))
     added_by_id = Column(Integer, ForeignKey("users.id"))
 
+    __table_args__ = (
+        Index("ix_group_media_group_title", "group_id", "title", "id"),
+        Index("ix_group_media_catalog_group", "catalog_id", "group_id"),
+        Index("ix_group_media_bangumi_group", "bangumi_id", "group_id"),
+    )
+
     group = relationship("Group", back_populates="media")
     added_by = relationship("User")
     reviews = relationship("GroupReview", back_populates="media")
@@ -54,6 +136,10 @@ class GroupReview(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     username = Column(String)
 
+    __table_args__ = (
+        Index("ix_group_reviews_media_created", "media_id", "created_at", "id"),
+    )
+
     user = relationship("User", back_populates="group_reviews")
     media = relationship("GroupMedia", back_populates="reviews")
 
@@ -66,7 +152,11 @@ class Discussion(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     user_id = Column(Integer, ForeignKey("users.id"))
     group_id = Column(Integer, ForeignKey("groups.id"))
-    media_id = Column(Integer, ForeignKey("group_media.id"))
+    media_id = Column(Integer, ForeignKey("group_media.id"), index=True)
+
+    __table_args__ = (
+        Index("ix_discussions_group_media_created", "group_id", "media_id", "created_at", "id"),
+    )
 
     user = relationship("User", back_populates="discussions")
     group = relationship("Group", back_populates="discussions")
@@ -86,6 +176,10 @@ class Comment(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     discussion_id = Column(Integer, ForeignKey("discussions.id"))
 
+    __table_args__ = (
+        Index("ix_comments_discussion_created", "discussion_id", "created_at", "id"),
+    )
+
     user = relationship("User", back_populates="comments")
     discussion = relationship("Discussion", back_populates="comments")
 
@@ -93,6 +187,50 @@ class Comment(Base):
     def username(self):
         return self.user.username if self.user else None
 
+class Activity(Base):
+    """One event in a group's activity feed.
+
+    Written in the same transaction as the change it describes, with title and
+    excerpt copied in, so reading a feed never joins the content tables.
+    """
+    __tablename__ = "activities"
+
+    id = Column(Integer, primary_key=True)
+    # media_added、media_synced、review_added、discussion_created、comment_created
+    kind = Column(String, nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
+    actor_id = Column(Integer, ForeignKey("users.id"))
+    media_id = Column(Integer, ForeignKey("group_media.id"), index=True)
+    discussion_id = Column(Integer, ForeignKey("discussions.id"), index=True)
+    # 评论/评价的 id，随 kind 而定
+    target_id = Column(Integer)
+    title = Column(String)
+    excerpt = Column(String)
+    # media_synced：本次同步的条目数
+    item_count = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_activities_group_id", "group_id", "id"),
+    )
+
+class TimelineEntry(Base):
+    """An activity copied into one member's timeline (fan-out on write).
+
+    `id` is the activity id, so a user's feed is a single range scan of the
+    primary key ordered by activity.
+    """
+    __tablename__ = "timeline_entries"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    id = Column("activity_id", Integer, ForeignKey("activities.id", ondelete="CASCADE"), primary_key=True)
+    group_id = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        # 删除活动时级联删除依赖按 activity_id 查找
+        Index("ix_timeline_entries_activity", "activity_id"),
+    )
+
 class User(Base):
     __tablename__ = "users"
 
@@ -109,7 +247,7 @@ class User(Base):
     discussions = relationship("Discussion", back_populates="user")
     comments = relationship("Comment", back_populates="user")
 
-class UserMedia(Base):
+class UserMedia(CatalogEntry, RatingAggregates, Base):
     __tablename__ = "user_media"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -117,8 +255,11 @@ class UserMedia(Base):
     bangumi_id = Column(Integer, index=True, nullable=True)
     title = Column(String, index=True)
     media_type = Column(Integer)  # 1=book, 2=anime, 3=music, 4=game, 6=real
-    image = Column(String)
-    summary = Column(String)
+
+    __table_args__ = (
+        Index("ix_user_media_user_title", "user_id", "title", "id"),
+        Index("ix_user_media_catalog_user", "catalog_id", "user_id"),
+    )
 
     user = relationship("User", back_populates="media")
     reviews = relationship("Review", back_populates="media")
@@ -133,6 +274,29 @@ class Review(Base):
     media_id = Column(Integer, ForeignKey("user_media.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_reviews_media_created", "media_id", "created_at", "id"),
+        Index("ix_reviews_user_created", "user_id", "created_at", "id"),
+    )
+
     user = relationship("User", back_populates="reviews")
     media = relationship("UserMedia", back_populates="reviews")
 
+
+class ResourceVersion(Base):
+    """Version counter of a cacheable resource, bumped by every write that changes it (see versions.py)."""
+    __tablename__ = "resource_versions"
+
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+
+class BangumiSubject(Base):
+    __tablename__ = "bangumi_subjects"
+
+    bangumi_id = Column(Integer, primary_key=True)
+    name = Column(String)
+    name_cn = Column(String)
+    media_type = Column(Integer)
+    image = Column(String)
+    summary = Column(String)
+    fetched_at = Column(DateTime, nullable=False)
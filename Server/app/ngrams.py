@@ -0,0 +1,128 @@
+"""N-gram tokens for CJK-aware title matching.
+
+Default full-text tokenizers keep a run of CJK characters as a single token,
+so a search for part of a Chinese or Japanese title never matches. Titles are
+split into CJK runs and other words. A CJK run contributes its characters and
+bigrams, and a word contributes itself plus its trigrams for fuzzy matching.
+`_`-prefixed tokens mark where a title starts, so prefix matches rank first.
+
+`title_grams` runs in the application, which writes its output to the title
+index (see search.refresh_title_indexes).
+"""
+from functools import lru_cache
+import re
+import unicodedata
+
+# 平假名、片假名、CJK 统一汉字（含扩展 A、兼容汉字）、谚文、半角片假名
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff66-\uff9f"
+_SEGMENT = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_CHAR = re.compile(rf"[{_CJK}]")
+
+START = "_"
+
+def normalize(text: str) -> str:
+    # NFKC 统一全角/半角，casefold 忽略大小写
+    return unicodedata.normalize("NFKC", text or "").casefold()
+
+def segments(text: str) -> list:
+    return _SEGMENT.findall(normalize(text))
+
+def _is_cjk(segment: str) -> bool:
+    return bool(_CJK_CHAR.match(segment))
+
+def _grams(segment: str) -> list:
+    if _is_cjk(segment):
+        return list(segment) + [segment[i:i + 2] for i in range(len(segment) - 1)]
+    if len(segment) >= 4:
+        return [segment] + [segment[i:i + 3] for i in range(len(segment) - 2)]
+    return [segment]
+
+def _start_tokens(first: str) -> list:
+    if _is_cjk(first):
+        return [START + first[:1]] + ([START + first[:2]] if len(first) > 1 else [])
+    return [START + first]
+
+def title_grams(*titles) -> str:
+    """Space-separated index tokens for one or more titles (e.g. name and aliases)."""
+    tokens = []
+    for title in titles:
+        parts = segments(title)
+        if not parts:
+            continue
+        tokens += _start_tokens(parts[0])
+        for segment in parts:
+            tokens += _grams(segment)
+    return " ".join(dict.fromkeys(tokens))
+
+#------------------------------------------------------------------------------------------------
+
+def _quote(token: str) -> str:
+    return f'"{token}"'
+
+def _query_terms(parts: list) -> list:
+    # CJK 段取二元组（单字时取单字），单词原样，最后一个单词按前缀匹配
+    terms = []
+    for i, segment in enumerate(parts):
+        last = i == len(parts) - 1
+        if _is_cjk(segment):
+            terms += [_quote(g) for g in ([segment] if len(segment) == 1 else [segment[j:j + 2] for j in range(len(segment) - 1)])]
+        else:
+            terms.append(_quote(segment) + ("*" if last else ""))
+    return terms
+
+def match_queries(query: str) -> dict:
+    """FTS5 MATCH expressions for `query`: `prefix` and `substring`, strictest first.
+
+    `fuzzy` is the list of n-gram tokens for an OR query; the caller picks
+    which of them to use. All tokens are quoted when joined, so user input
+    cannot inject FTS5 syntax. Returns an empty dict when the query has no
+    searchable characters.
+    """
+    parts = segments(query)
+    if not parts:
+        return {}
+    terms = _query_terms(parts)
+    first = parts[0]
+    if _is_cjk(first):
+        start = _quote(START + first[:2])
+    else:
+        start = _quote(START + first) + ("*" if len(parts) == 1 else "")
+    fuzzy = []
+    for segment in parts:
+        grams = [g for g in _grams(segment) if len(g) > 1 or not _is_cjk(segment)]
+        fuzzy += grams or [segment]
+    return {
+        "prefix": " AND ".join([start] + terms),
+        "substring": " AND ".join(terms),
+        "fuzzy": list(dict.fromkeys(fuzzy)),
+    }
+
+def any_of(groups: list) -> str:
+    """FTS5 query matching any of `groups`; each group is a tuple of tokens that must all match."""
+    return " OR ".join("(" + " AND ".join(_quote(token) for token in group) + ")" for group in groups)
+
+# 一次联想会对同一查询和常见标题反复计算，缓存规范化结果
+@lru_cache(maxsize=4096)
+def _normalized(text: str):
+    # 字符二元组；CJK 再加单字，替换一个汉字会破坏两个二元组，单字仍能对上
+    joined = " ".join(segments(text))
+    grams = {joined[i:i + 2] for i in range(len(joined) - 1)} | set(_CJK_CHAR.findall(joined))
+    return joined, frozenset(grams) or frozenset([joined])
+
+def similarity(query: str, title: str) -> float:
+    """Ranking score of `title` for `query`, plus prefix/substring bonuses.
+
+    The base score averages the share of the query's grams found in the title
+    and their Dice coefficient: a partial query that matches part of a long
+    title still scores well, and shorter titles rank first among equal matches.
+    """
+    (q, a), (t, b) = _normalized(query), _normalized(title)
+    if not q or not t:
+        return 0.0
+    common = len(a & b)
+    score = (common / len(a) + 2 * common / (len(a) + len(b))) / 2
+    if t.startswith(q):
+        score += 1.0
+    elif q in t:
+        score += 0.5
+    return score
@@ -0,0 +1,91 @@
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, select, tuple_, func
+from datetime import datetime
+from .database import stream_partitions
+import base64
+import binascii
+import json
+
+# 基于 (排序列, id) 的游标分页，默认排序列为 created_at，游标对客户端不透明
+
+def sort_keys(model, sort_column=None):
+    sort_column = model.created_at if sort_column is None else sort_column
+    return [model.id] if sort_column is model.id else [sort_column, model.id]
+
+def order_by_keys(model, sort_column=None, descending: bool = False):
+    return [key.desc() if descending else key for key in sort_keys(model, sort_column)]
+
+def _encode(values: list) -> str:
+    payload = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def _decode(cursor: str):
+    return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+
+def encode_cursor(row, keys) -> str:
+    return _encode([getattr(row, key.key) for key in keys])
+
+def decode_cursor(cursor: str, keys):
+    try:
+        values = _decode(cursor)
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        *values, last_id = values
+        values = [
+            datetime.fromisoformat(value) if value is not None and isinstance(key.type, DateTime) else value
+            for key, value in zip(keys, values)
+        ]
+        return values, int(last_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# 按相关度排序的结果（如搜索）没有稳定的键，游标中只保存偏移量
+def encode_offset_cursor(offset: int) -> str:
+    return _encode(["offset", offset])
+
+def decode_offset_cursor(cursor: str | None) -> int:
+    if not cursor:
+        return 0
+    try:
+        tag, offset = _decode(cursor)
+        if tag != "offset" or not isinstance(offset, int) or offset < 0:
+            raise ValueError(cursor)
+        return offset
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def paginate(query, model, cursor: str | None, limit: int, sort_column=None, descending: bool = False):
+    """Keyset-paginate `query` on `(sort_column, model.id)`, `sort_column` defaulting to `model.created_at`.
+
+    Returns `(rows, next_cursor)`; `next_cursor` is None on the last page.
+    """
+    keys = sort_keys(model, sort_column)
+    query = query.order_by(*order_by_keys(model, sort_column, descending))
+    if cursor:
+        values, last_id = decode_cursor(cursor, keys)
+        # 以游标所指行在库中的原值比较（SQLite 中的时间格式与绑定参数不同），该行已删除时退回游标中的值
+        bounds = [
+            func.coalesce(select(key).where(model.id == last_id).scalar_subquery(), value)
+            for key, value in zip(keys, values)
+        ] + [last_id]
+        row, bound = tuple_(*keys), tuple_(*bounds)
+        query = query.filter(row < bound if descending else row > bound)
+    rows = query.limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1], keys)
+    return rows, None
+
+# 列表接口的响应体保持为数组，下一页游标通过响应头返回
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def set_next_cursor(response, next_cursor: str | None):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+def ndjson_response(statement, schema, batch_size: int = 500) -> StreamingResponse:
+    """Stream the rows of `statement` as NDJSON, one `schema` object per line, a batch per chunk."""
+    async def lines():
+        async for batch in stream_partitions(statement, batch_size):
+            yield "".join(schema.model_validate(row, from_attributes=True).model_dump_json() + "\n" for row in batch)
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
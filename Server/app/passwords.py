@@ -0,0 +1,85 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+from threading import Lock
+import asyncio
+import logging
+import multiprocessing
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# bcrypt 成本因子，每加 1 计算量翻倍
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# 排队中的哈希任务上限，超出直接返回 503 而不是无限堆积
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor: ProcessPoolExecutor | None = None
+_pending = 0
+_lock = Lock()
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    # 只丢弃出错的那个池；并发请求可能已经换上了新池
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def _run(fn, *args):
+    global _pending
+    with _lock:
+        if _pending >= PASSWORD_QUEUE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+    try:
+        # 工作进程异常退出（如被 OOM 杀死）后整个池不再可用：换一个新池重试一次
+        for _ in range(2):
+            executor = _get_executor()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                logger.warning("Password worker pool broke; starting a new one")
+                _discard_executor(executor)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication workers are restarting, please retry",
+            headers={"Retry-After": "1"},
+        )
+    finally:
+        with _lock:
+            _pending -= 1
+
+async def hash_password(password: str) -> str:
+    return await _run(_hash, password)
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await _run(_verify, password, hashed_password)
@@ -0,0 +1,14 @@
+from fastapi import Depends
+from sqlalchemy.orm import Session
+from . import crud, models
+from .database import get_db
+from .auth import get_current_user
+
+# 小组成员校验：一次 EXISTS 查询，不加载成员列表。
+# FastAPI 会在同一请求内缓存依赖结果，多个地方声明也只查询一次。
+def require_group_member(
+    group_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return crud.check_group_member(db, group_id, current_user.id)
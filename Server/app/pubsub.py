@@ -0,0 +1,283 @@
+"""Publish/subscribe for live updates, streamed as server-sent events.
+
+Writers call `publish` after they commit. An event is encoded once as an SSE
+frame and queued to every subscriber of its channel, so an open stream does
+not query the database again. The default broker only reaches subscribers in
+the same process. When `PUBSUB_URL` is set (redis://...), events go through
+Redis pub/sub and reach subscribers in every worker.
+
+Besides SSE streams, code can register a handler for a channel with
+`add_handler`; it runs for every event published on that channel in every
+worker the broker reaches (used to invalidate per-process caches).
+"""
+from collections import defaultdict
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from . import metrics
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_URL = os.getenv("PUBSUB_URL", "")
+PUBSUB_CHANNEL_PREFIX = os.getenv("PUBSUB_CHANNEL_PREFIX", "kksk:")
+# 每个订阅者最多积压的事件数；超出时断开该连接，客户端带 Last-Event-ID 重连补齐
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "256"))
+# 空闲时发送注释行，防止代理断开连接，也让服务端及时发现客户端已断开
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+# 用户缓存失效通知，数据为需要失效的用户 id 列表（见 crud.update_user）
+USER_CACHE_CHANNEL = "user_cache"
+
+def discussion_channel(discussion_id: int) -> str:
+    return f"discussion:{discussion_id}"
+
+def group_media_channel(group_id: int, media_id: int) -> str:
+    return f"group_media:{group_id}:{media_id}"
+
+def sse_frame(event: str, data, event_id: int = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+def _frame_id(frame: str):
+    if frame.startswith("id: "):
+        return int(frame[4:frame.index("\n")])
+    return None
+
+def _frame_event(frame: str):
+    event, data = None, None
+    for line in frame.splitlines():
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            data = json.loads(line[6:])
+    return event, data
+
+class Subscription:
+    """Queue of SSE frames for one stream; `None` in the queue ends the stream."""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.queue = asyncio.Queue(PUBSUB_QUEUE_SIZE)
+        self.closed = False
+
+    def put(self, frame: str):
+        if self.closed:
+            return
+        if self.queue.full():
+            # 客户端跟不上：丢弃积压，结束这个流
+            metrics.incr("pubsub.overflows")
+            self.close()
+            return
+        self.queue.put_nowait(frame)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class Broker:
+    """Delivers events to the subscribers in this process."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._handlers = defaultdict(list)
+        self._loop = None
+
+    def add_handler(self, channel: str, handler):
+        """Call `handler(event, data)` for every event published on `channel`."""
+        self._handlers[channel].append(handler)
+
+    def subscribe(self, channel: str) -> Subscription:
+        # 在事件循环中调用；发布方可能在线程池中，投递时切回这个循环
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(channel)
+        self._subscribers[channel].add(subscription)
+        metrics.incr("pubsub.subscribers")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.channel)
+        if subscribers is not None and subscription in subscribers:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+            metrics.incr("pubsub.subscribers", -1)
+
+    def publish(self, channel: str, event: str, data, event_id: int = None):
+        """Send an event to the channel's subscribers. Callable from any thread; never blocks."""
+        self._handle(channel, event, data)
+        # 没有订阅者时连编码都省掉
+        if channel not in self._subscribers:
+            return
+        self._dispatch(channel, sse_frame(event, data, event_id))
+
+    def _dispatch(self, channel: str, frame: str):
+        self._call_on_loop(self._deliver, channel, frame)
+
+    def _call_on_loop(self, callback, *args):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            if asyncio.get_running_loop() is loop:
+                callback(*args)
+                return
+        except RuntimeError:
+            pass
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # 事件循环已关闭（进程退出中）
+            pass
+
+    def _deliver(self, channel: str, frame: str):
+        subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(frame)
+        metrics.incr("pubsub.delivered", len(subscribers))
+
+    def _handle(self, channel: str, event: str, data):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(event, data)
+            except Exception:
+                logger.warning("Handler for %s failed", channel, exc_info=True)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        for subscribers in list(self._subscribers.values()):
+            for subscription in list(subscribers):
+                subscription.close()
+
+class RedisBroker(Broker):
+    """Relays events through Redis pub/sub, so subscribers in every worker receive them.
+
+    `publish` only queues the frame; a task on the event loop sends it with
+    `redis.asyncio`, so request handlers never wait on the network.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        # 仅在配置了 PUBSUB_URL 时需要 redis 包
+        import redis.asyncio
+        self._url = url
+        self._publisher = redis.asyncio.Redis.from_url(url)
+        self._outbox = asyncio.Queue(PUBSUB_QUEUE_SIZE)
+        self._tasks = []
+
+    def publish(self, channel: str, event: str, data, event_id: int = None):
+        # 订阅者可能在其他 worker，总是发出；可以在线程池中调用，经事件循环排队发送
+        self._call_on_loop(self._enqueue, channel, sse_frame(event, data, event_id))
+
+    def _enqueue(self, channel: str, frame: str):
+        if self._outbox.full():
+            # Redis 跟不上或不可用：丢弃事件，客户端重连时带 Last-Event-ID 补齐
+            metrics.incr("pubsub.publish_dropped")
+            return
+        self._outbox.put_nowait((channel, frame))
+
+    async def _send(self):
+        while True:
+            channel, frame = await self._outbox.get()
+            # 发布失败不影响已提交的写入
+            try:
+                await self._publisher.publish(PUBSUB_CHANNEL_PREFIX + channel, frame)
+            except Exception:
+                logger.warning("Failed to publish to %s", channel, exc_info=True)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._send())]
+
+    async def _listen(self):
+        import redis.asyncio
+        while True:
+            client = redis.asyncio.Redis.from_url(self._url)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.psubscribe(PUBSUB_CHANNEL_PREFIX + "*")
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        channel = message["channel"].decode()[len(PUBSUB_CHANNEL_PREFIX):]
+                        frame = message["data"].decode()
+                        # 处理函数在每个 worker（包括发布者自己）的监听循环中执行
+                        if channel in self._handlers:
+                            self._handle(channel, *_frame_event(frame))
+                        self._deliver(channel, frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Redis pub/sub connection lost, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+    async def stop(self):
+        await super().stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._publisher.aclose()
+
+broker = RedisBroker(PUBSUB_URL) if PUBSUB_URL else Broker()
+
+def publish(channel: str, event: str, data, event_id: int = None):
+    broker.publish(channel, event, data, event_id)
+
+def add_handler(channel: str, handler):
+    broker.add_handler(channel, handler)
+
+def subscribe(channel: str) -> Subscription:
+    return broker.subscribe(channel)
+
+def unsubscribe(subscription: Subscription):
+    broker.unsubscribe(subscription)
+
+async def start():
+    await broker.start()
+
+async def stop():
+    await broker.stop()
+
+async def _events(subscription: Subscription, replay: list, after: int = None):
+    try:
+        for frame in replay:
+            yield frame
+        while True:
+            try:
+                frame = await asyncio.wait_for(subscription.queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if frame is None:
+                return
+            # 订阅之后、补发查询之前提交的事件会在补发中出现一次，这里跳过
+            if after is not None and (_frame_id(frame) or 0) <= after:
+                continue
+            yield frame
+    finally:
+        broker.unsubscribe(subscription)
+
+def sse_response(subscription: Subscription, replay: list = (), after: int = None) -> StreamingResponse:
+    """Stream `replay` frames, then the subscription's live events, as `text/event-stream`.
+
+    Live events with an id up to `after` are skipped, since the replay already
+    covered them. The subscription is released when the client disconnects.
+    """
+    return StreamingResponse(
+        _events(subscription, list(replay), after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
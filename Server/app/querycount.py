@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from dotenv import load_dotenv
+from . import metrics
+import logging
+import os
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 每个请求允许执行的 SQL 语句数，0 表示不统计；超出时记录日志并计入 /metrics
+SQL_STATEMENT_BUDGET = int(os.getenv("SQL_STATEMENT_BUDGET", "0"))
+STATEMENT_COUNT_HEADER = "X-SQL-Statements"
+
+# 当前请求的计数器；线程池和 run_sync 会复制 context，所以用可变的 list 在其中累加
+_counter: ContextVar[list | None] = ContextVar("sql_statement_counter", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+def track_statements(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+
+def untrack_statements(engine):
+    event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+@contextmanager
+def count_statements():
+    """Count the SQL statements executed in this context; yields a one-item list holding the count."""
+    counter = [0]
+    token = _counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _counter.reset(token)
+
+class StatementBudgetMiddleware:
+    """ASGI middleware that counts SQL statements per request against `budget`.
+
+    The count is returned in the `X-SQL-Statements` header; requests over the
+    budget are logged and counted as `db.statement_budget_exceeded`.
+    """
+
+    def __init__(self, app, budget: int):
+        self.app = app
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        with count_statements() as counter:
+            async def send_with_count(message):
+                if message["type"] == "http.response.start":
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (STATEMENT_COUNT_HEADER.lower().encode(), str(counter[0]).encode())
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
+
+        metrics.incr("db.statements", counter[0])
+        if counter[0] > self.budget:
+            metrics.incr("db.statement_budget_exceeded")
+            logger.warning("%s %s executed %d SQL statements (budget %d)",
+                           scope["method"], scope["path"], counter[0], self.budget)
@@ -0,0 +1,84 @@
+"""JSON response helpers that serialize each payload only once.
+
+A route that returns ORM objects or Pydantic models makes FastAPI dump them
+to dicts, validate those against `response_model` and encode the result
+again. `model_response` validates the data once with a cached `TypeAdapter`
+and serializes it in pydantic-core. It returns a ready `Response`, which
+FastAPI passes through without re-validating. `response_model` stays on the
+route for the OpenAPI schema.
+"""
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+from functools import lru_cache
+from importlib.util import find_spec
+from pydantic import TypeAdapter
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# 小于该字节数的响应不压缩
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+GZIP_COMPRESS_LEVEL = int(os.getenv("GZIP_COMPRESS_LEVEL", "6"))
+
+# 其余路由的默认响应类：装了 orjson 时用它编码，否则退回标准库 json
+if find_spec("orjson") is not None:
+    from fastapi.responses import ORJSONResponse as DefaultJSONResponse
+else:
+    DefaultJSONResponse = JSONResponse
+
+@lru_cache(maxsize=None)
+def _adapter(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+def model_response(schema, data, response: Response = None, exclude_unset: bool = False) -> Response:
+    """Serialize `data` (ORM objects, result rows or dicts) as `schema`, e.g. `List[schemas.GroupMedia]`.
+
+    Headers already set on the route's injected `response` (cursor, ETag) are
+    copied over, since FastAPI does not merge them into a returned Response.
+    With `exclude_unset`, fields missing from `data` are left out of the body.
+    """
+    adapter = _adapter(schema)
+    body = adapter.dump_json(adapter.validate_python(data, from_attributes=True), exclude_unset=exclude_unset)
+    result = Response(body, media_type="application/json")
+    if response is not None:
+        result.headers.raw.extend(response.headers.raw)
+    return result
+
+# 图片已经压缩过，再 gzip 只会浪费 CPU，也会挡住文件响应的 pathsend
+UNCOMPRESSED_PATH_PREFIXES = ("/images/",)
+
+class CompressionMiddleware:
+    """GZip for responses over `GZIP_MINIMUM_SIZE` bytes, except server-sent event streams and images.
+
+    GZipMiddleware buffers output inside the compressor, which would hold SSE
+    events back until the buffer fills, so `/events` streams pass through
+    uncompressed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not _is_event_stream(scope) and not scope["path"].startswith(UNCOMPRESSED_PATH_PREFIXES):
+            return await self.gzip(scope, receive, _vary_on_encoding(send))
+        return await self.app(scope, receive, send)
+
+def _vary_on_encoding(send):
+    # 是否压缩取决于 Accept-Encoding：未压缩的小响应和 304 也要带 Vary，缓存才不会把一种编码发给另一种客户端
+    async def send_with_vary(message):
+        if message["type"] == "http.response.start":
+            headers = MutableHeaders(scope=message)
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+        await send(message)
+    return send_with_vary
+
+def _is_event_stream(scope) -> bool:
+    if scope["path"].endswith("/events"):
+        return True
+    accept = dict(scope["headers"]).get(b"accept", b"")
+    return b"text/event-stream" in accept
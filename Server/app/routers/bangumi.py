@@ -1,59 +1,86 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from .. import crud, models, schemas
-from ..database import get_db
+from .. import crud, crud_async, models, schemas, bangumi_api
+from ..database import get_db, get_async_db, async_session_scope
 from ..auth import get_current_user
-import httpx
+from pydantic import conlist
+import json
+import logging
 
 router = APIRouter()
 
-BANGUMI_API_URL = "https://api.bgm.tv/search/subject/{}"
+logger = logging.getLogger(__name__)
 
 @router.get("/search/{media_type}/{query}", response_model=list[schemas.BangumiSearchResult])
 async def search_bangumi(media_type: int, query: str):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(BANGUMI_API_URL.format(query), params={"type": media_type, "responseGroup": "medium"})
-    
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="Failed to fetch data from Bangumi API")
-    
-    data = response.json()
-    return [schemas.BangumiSearchResult(
-        id=item['id'],
-        title=item['name'],
-        image=item.get('images', {}).get('large', ''),
-        summary=item.get('summary', ''),
-        type=item['type']
-    ) for item in data['list']]
+    results = await bangumi_api.search_subjects(query, media_type)
+    return [schemas.BangumiSearchResult(**item) for item in results]
 
 @router.post("/add/{bangumi_id}", response_model=schemas.UserMedia)
-def add_to_user_list(
+async def add_to_user_list(
     bangumi_id: int, 
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
-    # 首先，从 Bangumi API 获取详细信息
-    response = httpx.get(f"https://api.bgm.tv/subject/{bangumi_id}")
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="Failed to fetch data from Bangumi API")
-    
-    bangumi_data = response.json()
+    # 首先，获取条目详细信息（本地缓存未过期时不访问 Bangumi API）
+    subject = await bangumi_api.get_subject(db, bangumi_id)
     
     # 创建新的 UserMedia 条目
-    new_media = crud.create_user_media(
+    new_media = await crud_async.create_user_media(
         db=db,
         user_id=current_user.id,
         media=schemas.UserMediaCreate(
             bangumi_id=bangumi_id,
-            title=bangumi_data['name'],
-            media_type=bangumi_data['type'],
-            image=bangumi_data.get('images', {}).get('large', ''),
-            summary=bangumi_data.get('summary', '')
+            title=subject.name,
+            media_type=subject.media_type,
+            image=subject.image,
+            summary=subject.summary
         )
     )
     
     return new_media
 
+@router.post("/add-batch")
+async def add_batch_to_user_list(
+    bangumi_ids: conlist(int, max_length=bangumi_api.BANGUMI_BATCH_MAX_IDS),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    user_id = current_user.id
+    bangumi_ids = list(dict.fromkeys(bangumi_ids))
+
+    # 以 NDJSON 逐条返回进度，最后一次性批量写入
+    async def progress():
+        media = []
+        async for bangumi_id, subject, error in bangumi_api.iter_subjects(bangumi_ids):
+            if error is not None:
+                yield json.dumps({"bangumi_id": bangumi_id, "status": "error", "detail": error}, ensure_ascii=False) + "\n"
+                continue
+            media.append(schemas.UserMediaCreate(
+                bangumi_id=bangumi_id,
+                title=subject.name,
+                media_type=subject.media_type,
+                image=subject.image,
+                summary=subject.summary
+            ))
+            yield json.dumps({"bangumi_id": bangumi_id, "status": "fetched"}) + "\n"
+
+        # 按请求中的顺序写入
+        position = {bangumi_id: i for i, bangumi_id in enumerate(bangumi_ids)}
+        media.sort(key=lambda item: position[item.bangumi_id])
+        # 响应头已经发出，写入失败时只能在流中报告，客户端据此区分失败与断线
+        try:
+            async with async_session_scope() as db:
+                created = await crud_async.bulk_create_user_media(db, user_id, media)
+                result = [schemas.UserMedia.model_validate(item, from_attributes=True).model_dump() for item in created]
+        except Exception:
+            logger.exception("Batch import failed for user %s", user_id)
+            yield json.dumps({"status": "error", "detail": "Failed to save media"}) + "\n"
+            return
+        yield json.dumps({"status": "done", "added": len(result), "media": result}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
 @router.delete("/delete/{media_id}")
 def delete_media(
     media_id: int,
@@ -1,18 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from typing import List
-from .. import crud, models, schemas
-from ..database import get_db
+from typing import List, Optional
+from .. import crud, models, pubsub, schemas, versions
+from ..database import get_db, get_async_db, run_db, close_db
 from ..auth import get_current_user
+from ..pagination import set_next_cursor
+from ..responses import model_response
 
 router = APIRouter()
 
 @router.get("/{discussion_id}", response_model=schemas.DiscussionWithComments)
 def read_discussion(
     discussion_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    etag = crud.get_discussion_etag(db, discussion_id)
+    if versions.is_fresh(request, etag):
+        return versions.not_modified(etag)
+    versions.set_etag(response, etag)
     discussion = crud.get_discussion(db, discussion_id=discussion_id)
     if discussion is None:
         raise HTTPException(status_code=404, detail="Discussion not found")
@@ -31,13 +39,48 @@ def create_comment(
 @router.get("/{discussion_id}/comments/", response_model=List[schemas.Comment])
 def read_comments(
     discussion_id: int,
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    comments = crud.get_comments(db, discussion_id=discussion_id, skip=skip, limit=limit)
-    return comments@router.get("/{discussion_id}", response_model=schemas.DiscussionWithComments)
+    etag = crud.get_discussion_etag(db, discussion_id)
+    if versions.is_fresh(request, etag):
+        return versions.not_modified(etag)
+    versions.set_etag(response, etag)
+    comments, next_cursor = crud.get_comments(db, discussion_id=discussion_id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.Comment], comments, response)
+
+@router.get("/{discussion_id}/events")
+async def discussion_events(
+    discussion_id: int,
+    after: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None),
+    db = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # 新评论的 SSE 流（event: comment，id 为评论 id）。
+    # 带 after（客户端已有的最后一条评论），或断线重连时浏览器自动带上 Last-Event-ID，先补发之后的评论
+    await run_db(db, crud.check_discussion_member, discussion_id, current_user.id)
+    # 先订阅再查询补发，两者之间提交的评论不会丢失
+    subscription = pubsub.subscribe(pubsub.discussion_channel(discussion_id))
+    after = last_event_id if last_event_id is not None else after
+    replay = []
+    if after is not None:
+        try:
+            comments = await run_db(db, crud.get_comments_after, discussion_id, after)
+        except BaseException:
+            pubsub.unsubscribe(subscription)
+            raise
+        replay = [pubsub.sse_frame("comment", schemas.Comment(**comment._mapping), comment.id) for comment in comments]
+        if comments:
+            after = comments[-1].id
+    # 流可能持续很久，不占用数据库连接
+    await close_db(db)
+    return pubsub.sse_response(subscription, replay, after)
 
 @router.delete("/{discussion_id}", response_model=dict)
 def delete_discussion(
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
-from typing import List
-from .. import crud, models, schemas
+from typing import List, Optional
+from .. import crud, deletion, models, pubsub, schemas, versions
 from ..database import get_db
 from ..auth import get_current_user
-from fastapi.encoders import jsonable_encoder
+from ..permissions import require_group_member
+from ..pagination import set_next_cursor, ndjson_response
+from ..responses import model_response
 
 router = APIRouter()
 
@@ -14,17 +16,8 @@ def create_group(group: schemas.GroupCreate, db: Session = Depends(get_db), curr
 
 @router.get("/get", response_model=List[schemas.Group])
 def get_user_groups(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    groups = crud.get_user_groups(db=db, user_id=current_user.id)
-    return [
-        schemas.Group(
-            id=group.id,
-            name=group.name,
-            description=group.description,
-            owner_id=group.owner_id,
-            created_at=group.created_at,
-            owner_name=group.owner.username if group.owner else None
-        ) for group in groups
-    ]
+    # owner_name 取自预加载的 owner
+    return model_response(List[schemas.Group], crud.get_user_groups(db=db, user_id=current_user.id))
 
 @router.post("/{group_id}/invite", response_model=schemas.Group)
 def invite_user_to_group(
@@ -44,12 +37,10 @@ def remove_group_member(
     group_id: int,
     member_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    access = Depends(require_group_member)
 ):
-    group = crud.get_group(db, group_id)
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if current_user.id != group.owner_id:
+    if current_user.id != access.owner_id:
         raise HTTPException(status_code=403, detail="Only the group owner can remove members")
     updated_group = crud.remove_group_member(db, group_id, member_id)
     return schemas.Group(**updated_group)
@@ -92,7 +83,7 @@ def add_review_to_group_media(
     return schemas.GroupReview.from_orm(db_review)
 
 @router.post("/{group_id}/media/{media_id}/discussion", response_model=schemas.Discussion)
-def create_discussion(group_id: int, media_id: int, discussion: schemas.DiscussionCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_discussion(group_id: int, media_id: int, discussion: schemas.DiscussionCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user), access = Depends(require_group_member)):
     return crud.create_discussion(db=db, group_id=group_id, media_id=media_id, discussion=discussion, user_id=current_user.id)
 
 @router.post("/discussion/{discussion_id}/comment", response_model=schemas.Comment)
@@ -104,12 +95,8 @@ def sync_media_to_group(group_id: int, media_ids: List[int], db: Session = Depen
     return crud.sync_media_to_group(db=db, group_id=group_id, media_ids=media_ids, user_id=current_user.id)
 
 @router.get("/{group_id}", response_model=schemas.Group)
-def get_group(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_group(group_id: int, db: Session = Depends(get_db), access = Depends(require_group_member)):
     group = crud.get_group(db, group_id)
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if current_user.id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
     group_data = {
         "id": group.id,
         "name": group.name,
@@ -121,77 +108,145 @@ def get_group(group_id: int, db: Session = Depends(get_db), current_user: models
     return schemas.Group(**group_data)
 
 @router.get("/{group_id}/media", response_model=List[schemas.GroupMedia])
-def get_group_media(group_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    group = crud.get_group(db, group_id)
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if current_user.id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    return group.media
+def get_group_media(
+    group_id: int,
+    request: Request,
+    response: Response,
+    media_type: Optional[int] = None,
+    title_prefix: Optional[str] = None,
+    sort: schemas.MediaSort = "id",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    stream: bool = False,
+    db: Session = Depends(get_db),
+    access = Depends(require_group_member)
+):
+    # 列表未变化时只查版本号，直接返回 304
+    etag = versions.current_etag(db, versions.group(group_id), versions.group_media(group_id))
+    if versions.is_fresh(request, etag):
+        return versions.not_modified(etag)
+    # 与 /media/getAll 相同：默认整个列表，limit/cursor 分页，stream=true 输出 NDJSON
+    filters = {"media_type": media_type, "title_prefix": title_prefix, "sort": sort}
+    if stream:
+        streaming = ndjson_response(crud.group_media_statement(group_id, **filters), schemas.GroupMedia)
+        versions.set_etag(streaming, etag)
+        return streaming
+    versions.set_etag(response, etag)
+    if limit is None and cursor is None:
+        return model_response(List[schemas.GroupMedia], crud.get_group_media(db, group_id, **filters), response)
+    media, next_cursor = crud.get_group_media_page(db, group_id, cursor=cursor, limit=limit or 100, **filters)
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.GroupMedia], media, response)
 
 @router.get("/{group_id}/media/{media_id}/reviews", response_model=List[schemas.GroupReview])
 def get_group_media_reviews(
     group_id: int, 
     media_id: int, 
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+    access = Depends(require_group_member)
 ):
-    reviews = crud.get_group_media_reviews(db, group_id, media_id)
-    return [schemas.GroupReview.model_validate(jsonable_encoder(review)) for review in reviews]
+    etag = versions.current_etag(db, versions.group(group_id), versions.group_reviews(media_id))
+    if versions.is_fresh(request, etag):
+        return versions.not_modified(etag)
+    versions.set_etag(response, etag)
+    reviews, next_cursor = crud.get_group_media_reviews(db, group_id, media_id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.GroupReview], reviews, response)
 
 @router.get("/{group_id}/media/{media_id}/discussions", response_model=List[schemas.Discussion])
-def get_group_media_discussions(group_id: int, media_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    discussions = crud.get_group_media_discussions(db, group_id, media_id)
-    if not discussions:
+def get_group_media_discussions(
+    group_id: int,
+    media_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+    access = Depends(require_group_member)
+):
+    discussions, next_cursor = crud.get_discussions(db, group_id=group_id, media_id=media_id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    if not discussions and not cursor:
         raise HTTPException(status_code=404, detail="Media or discussions not found")
-    group = crud.get_group(db, group_id)
-    if current_user.id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    return discussions
+    return model_response(List[schemas.Discussion], discussions, response)
+
+@router.get("/{group_id}/media/{media_id}/page", response_model=schemas.GroupMediaPage, response_model_exclude_unset=True)
+def get_group_media_detail_page(
+    group_id: int,
+    media_id: int,
+    fields: List[schemas.GroupMediaPageField] = Query(["media", "reviews", "discussions"]),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+    access = Depends(require_group_member)
+):
+    # 详情页一次请求：只校验一次成员身份，按 fields 返回媒体、评价和讨论的首页；后续页用各自的列表接口和游标
+    page = crud.get_group_media_detail_page(db, group_id, media_id, set(fields), limit=limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return model_response(schemas.GroupMediaPage, page, exclude_unset=True)
+
+@router.get("/{group_id}/media/{media_id}/events")
+async def group_media_events(
+    group_id: int,
+    media_id: int,
+    access = Depends(require_group_member)
+):
+    # 该媒体下新讨论（event: discussion）和新评价（event: review）的 SSE 流
+    return pubsub.sse_response(pubsub.subscribe(pubsub.group_media_channel(group_id, media_id)))
+
+@router.get("/{group_id}/activity", response_model=List[schemas.Activity])
+def get_group_activity(
+    group_id: int,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    access = Depends(require_group_member)
+):
+    activities, next_cursor = crud.get_group_activity(db, group_id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.Activity], activities, response)
 
 @router.get("/{group_id}/members", response_model=List[schemas.User])
 def get_group_members(
     group_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    access = Depends(require_group_member)
 ):
-    group = crud.get_group(db, group_id)
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if current_user.id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
-    members = [member for member in group.members if member.id != group.owner_id]
-    return members
+    return crud.get_group_members(db, group_id, exclude_user_id=access.owner_id)
 
 @router.delete("/{group_id}", response_model=schemas.Message)
 def delete_group(
     group_id: int,
+    response: Response,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    access = Depends(require_group_member)
 ):
-    group = crud.get_group(db, group_id)
-    if not group:
-        raise HTTPException(status_code=404, detail="Group not found")
-    if group.owner_id != current_user.id:
+    if access.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Only the group owner can delete the group")
     
-    crud.delete_group(db, group_id, current_user.id)
-    return {"message": "Group deleted successfully"}
+    if crud.delete_group(db, group_id, current_user.id):
+        return {"message": "Group deleted successfully"}
+    # 大小组：已对所有人不可见，内容在响应之后分批删除
+    background_tasks.add_task(deletion.purge_group, group_id)
+    response.status_code = status.HTTP_202_ACCEPTED
+    return {"message": "Group deletion scheduled"}
 
 @router.get("/{group_id}/media/{media_id}", response_model=schemas.GroupMedia)
 def get_group_media_detail(
     group_id: int, 
     media_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    access = Depends(require_group_member)
 ):
     media = crud.get_group_media_detail(db, group_id, media_id)
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
-    group = crud.get_group(db, group_id)
-    if current_user.id not in [member.id for member in group.members]:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
     return media
 
 @router.put("/{group_id}/reviews/update/{review_id}", response_model=schemas.GroupReview)
@@ -200,7 +255,8 @@ def update_group_review(
     review_id: int, 
     review: schemas.GroupReviewUpdate, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    access = Depends(require_group_member)
 ):
     updated_review = crud.update_group_review(db, group_id, review_id, review, current_user.id)
     if not updated_review:
@@ -212,7 +268,8 @@ def delete_group_review(
     group_id: int, 
     review_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    access = Depends(require_group_member)
 ):
     result = crud.delete_group_review(db, group_id, review_id, current_user.id)
     if not result:
@@ -224,7 +281,8 @@ def delete_group_media(
     group_id: int, 
     media_id: int, 
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    access = Depends(require_group_member)
 ):
     result = crud.delete_group_media(db, group_id, media_id, current_user.id)
     if result["status"] == "error":
@@ -237,7 +295,8 @@ def create_discussion(
     media_id: int,
     discussion: schemas.DiscussionCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: models.User = Depends(get_current_user),
+    access = Depends(require_group_member)
 ):
     discussion_data = crud.create_discussion(db=db, discussion=discussion, user_id=current_user.id, group_id=group_id, media_id=media_id)
     return schemas.Discussion(**discussion_data)
@@ -246,21 +305,12 @@ def create_discussion(
 def read_discussions(
     group_id: int,
     media_id: int,
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    access = Depends(require_group_member)
 ):
-    discussions = crud.get_discussions(db, group_id=group_id, media_id=media_id, skip=skip, limit=limit)
-    discussions_data =[ {
-            "id": discussion.id,
-            "title": discussion.title,
-            "content": discussion.content,
-            "created_at": discussion.created_at,
-            "user_id": discussion.user_id,
-            "group_id": discussion.group_id,
-            "media_id": discussion.media_id,
-            "username": discussion.user.username if discussion.user else None
-        } for discussion in discussions
-    ]
-    return discussions_data
\ No newline at end of file
+    discussions, next_cursor = crud.get_discussions(db, group_id=group_id, media_id=media_id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.Discussion], discussions, response)
\ No newline at end of file
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse
+from .. import images, schemas, versions
+
+router = APIRouter()
+
+@router.get("/{size}")
+async def get_image(
+    size: schemas.ImageSize,
+    request: Request,
+    src: str = Query(..., max_length=2048)
+):
+    # 公开接口（<img> 不带令牌）；src 为媒体的 image 字段，只接受 IMAGE_ALLOWED_HOSTS 中的主机
+    if not images.is_cacheable(src):
+        raise HTTPException(status_code=400, detail="Image host is not allowed")
+    etag = images.etag(src, size)
+    # 单独计数，不混入 API 资源的 304 比例
+    if versions.is_fresh(request, etag, metric="images.etag"):
+        return images.not_modified(etag)
+    try:
+        path = await images.get_thumbnail(src, size)
+    except HTTPException:
+        # 上游暂时取不到时让浏览器直接加载原图（主机已在允许列表中），下次请求再重试
+        return RedirectResponse(src)
+    return images.file_response(path, etag)
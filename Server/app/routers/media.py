@@ -1,27 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from .. import crud, schemas, models
-from ..database import get_db
+from .. import crud, crud_async, schemas, models
+from ..database import get_db, get_async_db
 from ..auth import get_current_user
-from typing import List
+from ..pagination import set_next_cursor, ndjson_response
+from ..responses import model_response
+from typing import List, Optional
 
 router = APIRouter()
 
 @router.get("/getAll", response_model=List[schemas.UserMedia])
 async def read_user_media(
+    response: Response,
+    media_type: Optional[int] = None,
+    title_prefix: Optional[str] = None,
+    sort: schemas.MediaSort = "id",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    stream: bool = False,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_async_db)
 ):
-    return crud.get_user_media(db, user_id=current_user.id)
+    # 不带 limit/cursor 时返回整个列表（兼容现有客户端）；stream=true 时以 NDJSON 逐批输出
+    filters = {"media_type": media_type, "title_prefix": title_prefix, "sort": sort}
+    if stream:
+        return ndjson_response(crud.user_media_statement(current_user.id, **filters), schemas.UserMedia)
+    if limit is None and cursor is None:
+        return model_response(List[schemas.UserMedia], await crud_async.get_user_media(db, user_id=current_user.id, **filters))
+    media, next_cursor = await crud_async.get_user_media_page(
+        db, user_id=current_user.id, cursor=cursor, limit=limit or 100, **filters
+    )
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.UserMedia], media, response)
 
 
 @router.delete("/delete/{media_id}")
 async def delete_media(
     media_id: int,
     current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_async_db)
 ):
-    result = crud.delete_user_media(db, user_id=current_user.id, media_id=media_id)
+    result = await crud_async.delete_user_media(db, user_id=current_user.id, media_id=media_id)
     if result is None:
         raise HTTPException(status_code=404, detail="Media not found")
     return {"message": "Media deleted successfully"}
@@ -29,9 +48,9 @@ async def delete_media(
 @router.get("/get/{media_id}", response_model=list[schemas.UserMedia])
 async def get_media(
     media_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_async_db)
 ):
-    return crud.get_single_media(db, media_id=media_id)
+    return await crud_async.get_single_media(db, media_id=media_id)
   
 @router.post("/add-manual", response_model=schemas.UserMedia)
 def add_manual_media(
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from .. import crud, schemas, models
+from .. import crud, schemas, models, versions
 from ..database import get_db
 from ..auth import get_current_user
+from ..pagination import set_next_cursor
+from ..responses import model_response
+from typing import Optional
 import logging
 
 router = APIRouter()
@@ -44,17 +47,28 @@ def delete_review(
 @router.get("/media/{media_id}", response_model=list[schemas.Review])
 def read_media_reviews(
     media_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db)
 ):
-    reviews = crud.get_media_reviews(db, media_id=media_id)
-    return reviews
+    etag = versions.current_etag(db, versions.media_reviews(media_id))
+    if versions.is_fresh(request, etag):
+        return versions.not_modified(etag)
+    versions.set_etag(response, etag)
+    reviews, next_cursor = crud.get_media_reviews(db, media_id=media_id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(list[schemas.Review], reviews, response)
 
 @router.get("/users/me", response_model=list[schemas.Review])
 def read_user_reviews(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    reviews = crud.get_user_reviews(db, user_id=current_user.id, skip=skip, limit=limit)
-    return reviews
\ No newline at end of file
+    reviews, next_cursor = crud.get_user_reviews(db, user_id=current_user.id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(list[schemas.Review], reviews, response)
\ No newline at end of file
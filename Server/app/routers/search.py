@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from .. import crud, search, models, schemas
+from ..database import get_db
+from ..auth import get_current_user
+from ..pagination import set_next_cursor, encode_offset_cursor, decode_offset_cursor
+from ..responses import model_response
+
+router = APIRouter()
+
+@router.get("/typeahead", response_model=List[schemas.TypeaheadSuggestion])
+def typeahead(
+    q: str = Query(..., min_length=1, max_length=100),
+    media_type: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=20),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # 本地标题联想（含中日文部分匹配和模糊匹配），供搜索框在请求 Bangumi 之前使用
+    return search.typeahead(db, current_user.id, q, media_type=media_type, limit=limit)
+
+@router.get("/", response_model=List[schemas.SearchResult])
+def search_local(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[List[schemas.SearchKind]] = Query(None),
+    group_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # 在自己的库、评论和所在小组的数据中搜索；指定 group_id 时只搜该小组
+    if group_id is not None:
+        crud.check_group_member(db, group_id, current_user.id)
+    offset = decode_offset_cursor(cursor)
+    rows, has_more = search.search(db, current_user.id, q, kinds=kind, group_id=group_id, offset=offset, limit=limit)
+    if has_more:
+        set_next_cursor(response, encode_offset_cursor(offset + limit))
+    return model_response(List[schemas.SearchResult], rows, response)
@@ -1,32 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from .. import crud, models, schemas, auth
-from ..database import get_db
+from .. import crud, crud_async, models, schemas, auth, passwords
+from ..database import get_db, get_async_db, close_db
 from pydantic import BaseModel
 from .. auth import get_current_user
+from ..pagination import set_next_cursor
+from ..responses import model_response
+from typing import List, Optional
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 @router.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, username=user.username)
+async def register(user: schemas.UserCreate, db: Session = Depends(get_async_db)):
+    db_user = await crud_async.get_user(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    await close_db(db)
+    hashed_password = await passwords.hash_password(user.password)
+    return await crud_async.create_user(db, user=user, hashed_password=hashed_password)
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_async_db)):
+    user = await crud_async.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(data={"sub": user.username})
+    access_token = auth.create_access_token(data={"sub": user.username, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/token/refresh", response_model=schemas.Token)
@@ -45,13 +50,26 @@ def refresh_token(token: str = Depends(auth.oauth2_scheme), db: Session = Depend
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(data={"sub": user.username})
+    access_token = auth.create_access_token(data={"sub": user.username, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/info", response_model=schemas.User)
 def get_user_info(current_user: schemas.User = Depends(get_current_user)):
     return current_user
 
+@router.get("/activity", response_model=List[schemas.Activity])
+def get_activity_timeline(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: schemas.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # 所在各小组的动态合并为一条时间线，写入时已分发到每个成员
+    activities, next_cursor = crud.get_user_timeline(db, current_user.id, cursor=cursor, limit=limit)
+    set_next_cursor(response, next_cursor)
+    return model_response(List[schemas.Activity], activities, response)
+
 @router.put("/update", response_model=schemas.User)
 def update_username(
     user_update: schemas.UserUpdate,
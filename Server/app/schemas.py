@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import Optional
+from typing import Optional, Literal
 from datetime import datetime
 from typing import List
 
@@ -28,6 +28,7 @@ class TokenPair(Token):
 
 class TokenData(BaseModel):
     username: str | None = None
+    user_id: int | None = None
 
 class BangumiSearchResult(BaseModel):
     id: int
@@ -36,6 +37,16 @@ class BangumiSearchResult(BaseModel):
     summary: str
     type: int
 
+class BangumiSubject(BaseModel):
+    bangumi_id: int
+    name: str
+    name_cn: Optional[str] = None
+    media_type: int
+    image: str
+    summary: str
+
+    model_config = ConfigDict(from_attributes=True)
+
 class UserMediaBase(BaseModel):
     bangumi_id: Optional[int] = None
     title: str
@@ -53,7 +64,16 @@ class ManualMediaCreate(BaseModel):
     summary: str = ""
     bangumi_id: Optional[int] = None
 
-class UserMedia(UserMediaBase):
+# 媒体列表排序：添加顺序或标题，"-" 前缀表示倒序
+MediaSort = Literal["id", "-id", "title", "-title"]
+
+class RatingSummary(BaseModel):
+    review_count: int = 0
+    average_rating: Optional[float] = None
+    # 下标为评分的整数部分（0-10）
+    rating_histogram: List[int] = []
+
+class UserMedia(UserMediaBase, RatingSummary):
     id: int
     user_id: int
 
@@ -120,7 +140,7 @@ class ManualGroupMediaCreate(BaseModel):
     summary: str = ""
     bangumi_id: Optional[int] = None
     
-class GroupMedia(GroupMediaBase):
+class GroupMedia(GroupMediaBase, RatingSummary):
     id: int
     group_id: int
     added_by_id: int
@@ -239,6 +259,17 @@ class Discussion(DiscussionBase):
     class Config:
         orm_mode = True
 
+# 小组媒体详情页的数据块，见 GET /groups/{group_id}/media/{media_id}/page
+GroupMediaPageField = Literal["media", "reviews", "discussions"]
+
+class GroupMediaPage(BaseModel):
+    """Everything the group media detail page renders; only the requested fields are present."""
+    media: Optional[GroupMedia] = None
+    reviews: Optional[List[GroupReview]] = None
+    reviews_next_cursor: Optional[str] = None
+    discussions: Optional[List[Discussion]] = None
+    discussions_next_cursor: Optional[str] = None
+
 class DiscussionWithComments(DiscussionBase):
     id: int
     created_at: datetime
@@ -248,4 +279,52 @@ class DiscussionWithComments(DiscussionBase):
     username: str
     comments: List[Comment]
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+# 封面缩略图尺寸，见 images.THUMBNAIL_WIDTHS
+ImageSize = Literal["small", "medium", "large"]
+
+# 搜索结果类型，见 search.SOURCES
+SearchKind = Literal["user_media", "review", "group_media", "group_review", "discussion", "comment"]
+
+class SearchResult(BaseModel):
+    kind: SearchKind
+    id: int
+    group_id: Optional[int] = None
+    media_id: Optional[int] = None
+    discussion_id: Optional[int] = None
+    title: Optional[str] = None
+    # 匹配片段，命中的词用 [ ] 标出
+    snippet: str
+    # 越小越相关
+    score: float
+
+# 动态类型，见 crud.record_activity 的调用处
+ActivityKind = Literal["media_added", "media_synced", "review_added", "discussion_created", "comment_created"]
+
+class Activity(BaseModel):
+    id: int
+    kind: ActivityKind
+    group_id: int
+    actor_id: Optional[int] = None
+    username: Optional[str] = None
+    media_id: Optional[int] = None
+    discussion_id: Optional[int] = None
+    # 评论、评价或讨论的 id
+    target_id: Optional[int] = None
+    # 媒体或讨论的标题（写入时的快照）
+    title: Optional[str] = None
+    excerpt: Optional[str] = None
+    item_count: Optional[int] = None
+    created_at: datetime
+
+class TypeaheadSuggestion(BaseModel):
+    # library：自己的库；group：所在小组；bangumi：本地缓存的 Bangumi 条目
+    source: Literal["library", "group", "bangumi"]
+    media_id: Optional[int] = None
+    group_id: Optional[int] = None
+    bangumi_id: Optional[int] = None
+    title: str
+    media_type: Optional[int] = None
+    image: Optional[str] = None
+    score: float
@@ -0,0 +1,452 @@
+"""Local full-text search over libraries, group media, reviews and discussions.
+
+SQLite uses one FTS5 external-content table per indexed table (`fts_<table>`),
+kept in sync by triggers, so every write path including bulk deletes updates
+the index. Library and group media are searched through the shared
+`media_catalog` index. PostgreSQL uses GIN expression indexes over `to_tsvector`;
+that backend is experimental and not covered by the test suite. Other
+databases, or SQLite builds without FTS5, fall back to LIKE.
+
+Title typeahead uses a separate n-gram index (`title_grams_<table>`, see
+ngrams.py) over media titles and the cached Bangumi names, so partial CJK
+titles, prefixes and near misses match. The n-grams are computed in Python:
+triggers queue new and renamed rows, and `refresh_title_indexes` indexes
+them before each typeahead query.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from . import ngrams
+from itertools import combinations
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 搜索后端，由 install() 根据数据库确定
+BACKEND = "like"
+
+_MEMBER_GROUPS = "SELECT group_id FROM group_members WHERE user_id = :user_id"
+
+# 每种结果的来源表、索引列、关联表、返回字段和可见范围；t 为来源表别名
+# group 为所属小组的列，None 表示个人数据（不在小组内搜索时才包含）
+# 索引列不在来源表上时，index 为被索引的表（别名 c），index_key 为来源表中指向它的列
+SOURCES = {
+    "user_media": {
+        "table": "user_media",
+        "index": "media_catalog",
+        "index_key": "catalog_id",
+        "columns": ("title", "summary"),
+        "joins": "",
+        "fields": {"group_id": "NULL", "media_id": "t.id", "discussion_id": "NULL", "title": "t.title"},
+        "scope": "t.user_id = :user_id",
+        "group": None,
+    },
+    "review": {
+        "table": "reviews",
+        "columns": ("text",),
+        "joins": "LEFT JOIN user_media m ON m.id = t.media_id",
+        "fields": {"group_id": "NULL", "media_id": "t.media_id", "discussion_id": "NULL", "title": "m.title"},
+        # 自己写的评论，以及别人对自己库中条目的评论
+        "scope": "(t.user_id = :user_id OR m.user_id = :user_id)",
+        "group": None,
+    },
+    "group_media": {
+        "table": "group_media",
+        "index": "media_catalog",
+        "index_key": "catalog_id",
+        "columns": ("title", "summary"),
+        "joins": "",
+        "fields": {"group_id": "t.group_id", "media_id": "t.id", "discussion_id": "NULL", "title": "t.title"},
+        "scope": f"t.group_id IN ({_MEMBER_GROUPS})",
+        "group": "t.group_id",
+    },
+    "group_review": {
+        "table": "group_reviews",
+        "columns": ("text",),
+        "joins": "JOIN group_media m ON m.id = t.media_id",
+        "fields": {"group_id": "m.group_id", "media_id": "t.media_id", "discussion_id": "NULL", "title": "m.title"},
+        "scope": f"m.group_id IN ({_MEMBER_GROUPS})",
+        "group": "m.group_id",
+    },
+    "discussion": {
+        "table": "discussions",
+        "columns": ("title", "content"),
+        "joins": "",
+        "fields": {"group_id": "t.group_id", "media_id": "t.media_id", "discussion_id": "t.id", "title": "t.title"},
+        "scope": f"t.group_id IN ({_MEMBER_GROUPS})",
+        "group": "t.group_id",
+    },
+    "comment": {
+        "table": "comments",
+        "columns": ("content",),
+        "joins": "JOIN discussions d ON d.id = t.discussion_id",
+        "fields": {"group_id": "d.group_id", "media_id": "d.media_id", "discussion_id": "t.discussion_id", "title": "d.title"},
+        "scope": f"d.group_id IN ({_MEMBER_GROUPS})",
+        "group": "d.group_id",
+    },
+}
+
+SNIPPET_TOKENS = 16
+
+def _index_table(source: dict) -> str:
+    return source.get("index", source["table"])
+
+def _indexed_tables() -> dict:
+    # 多个来源可以共用同一个被索引的表（如 media_catalog）
+    return {_index_table(source): source["columns"] for source in SOURCES.values()}
+
+#------------------------------------------------------------------------------------------------
+
+def install(engine: Engine):
+    """Create the search index for the connected database and select the backend."""
+    global BACKEND
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite" and _has_fts5(conn):
+            for table, columns in _indexed_tables().items():
+                _install_fts5(conn, table, columns)
+            for source in TITLE_SOURCES.values():
+                _install_title_index(conn, source["table"], source["key"], source["titles"])
+            BACKEND = "fts5"
+        elif conn.dialect.name == "postgresql":
+            # 实验性：测试只在 SQLite 上运行，这条路径没有经过测试
+            logger.warning("PostgreSQL search backend is experimental and untested")
+            for table, columns in _indexed_tables().items():
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} "
+                    f"USING GIN (to_tsvector('simple', {_document(columns, '')}))"
+                ))
+            BACKEND = "postgresql"
+        else:
+            BACKEND = "like"
+    logger.info("Search backend: %s", BACKEND)
+
+def _has_fts5(conn) -> bool:
+    try:
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)"))
+        conn.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except OperationalError:
+        return False
+
+def _install_fts5(conn, table: str, columns: tuple):
+    fts = f"fts_{table}"
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": fts}).first()
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); END"
+    ))
+    # 只在被索引的列变化时更新索引，评分汇总等列的更新不触发
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END"
+    ))
+    if not exists:
+        # 首次创建时索引已有数据
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+def drop_fts5(conn, table: str):
+    """Drop the FTS5 index of `table` and its triggers, e.g. before the indexed columns are dropped."""
+    fts = f"fts_{table}"
+    for suffix in ("ai", "ad", "au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {fts}_{suffix}"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {fts}"))
+
+def _document(columns: tuple, alias: str = "t.") -> str:
+    return " || ' ' || ".join(f"coalesce({alias}{c}, '')" for c in columns)
+
+#------------------------------------------------------------------------------------------------
+
+def _fts5_query(query: str):
+    # 把输入拆成词并逐个加引号，避免 FTS5 语法错误；各词之间为 AND
+    terms = re.findall(r"\w+", query)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms)
+
+def _like_pattern(query: str):
+    escaped = query.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%" if escaped else None
+
+def _select(kind: str, source: dict, group_filter: bool) -> str:
+    table, index = source["table"], _index_table(source)
+    fields = ", ".join(f"{expr} AS {name}" for name, expr in source["fields"].items())
+    where = [source["scope"]]
+    if group_filter:
+        where.append(f"{source['group']} = :group_id")
+    key = source.get("index_key", "id")
+    document = _document(source["columns"], "t." if index == table else "c.")
+    table_from = f"{table} t" if index == table else f"{table} t JOIN {index} c ON c.id = t.{key}"
+
+    if BACKEND == "fts5":
+        fts = f"fts_{index}"
+        # CROSS JOIN 固定由全文索引驱动连接，否则 SQLite 可能从来源表出发逐行执行 MATCH
+        source_from = f"{fts} CROSS JOIN {table} t ON t.{key} = {fts}.rowid"
+        where.append(f"{fts} MATCH :match")
+        snippet = f"snippet({fts}, -1, '[', ']', '…', {SNIPPET_TOKENS})"
+        score = f"bm25({fts})"
+    elif BACKEND == "postgresql":
+        source_from = table_from
+        vector = f"to_tsvector('simple', {document})"
+        tsquery = "plainto_tsquery('simple', :match)"
+        where.append(f"{vector} @@ {tsquery}")
+        snippet = f"ts_headline('simple', {document}, {tsquery}, 'StartSel=[, StopSel=], MaxWords={SNIPPET_TOKENS}, MinWords=4')"
+        # 统一按分数升序排列
+        score = f"-ts_rank({vector}, {tsquery})"
+    else:
+        source_from = table_from
+        where.append(f"({document}) LIKE :match ESCAPE '\\'")
+        snippet = f"substr({document}, 1, 200)"
+        score = "0.0"
+
+    return (
+        f"SELECT '{kind}' AS kind, t.id AS id, {fields}, {snippet} AS snippet, {score} AS score "
+        f"FROM {source_from} {source['joins']} WHERE {' AND '.join(where)}"
+    )
+
+def search(db: Session, user_id: int, query: str, kinds=None, group_id: int = None, offset: int = 0, limit: int = 20):
+    """Ranked search over the data visible to `user_id`.
+
+    With `group_id` only that group's data is searched (membership is checked
+    by the caller). Returns `(rows, has_more)`.
+    """
+    match = {"fts5": _fts5_query, "postgresql": str.strip}.get(BACKEND, _like_pattern)(query)
+    selected = [
+        kind for kind, source in SOURCES.items()
+        if (kinds is None or kind in kinds) and (group_id is None or source["group"] is not None)
+    ]
+    if not match or not selected:
+        return [], False
+    union = " UNION ALL ".join(_select(kind, SOURCES[kind], group_id is not None) for kind in selected)
+    rows = db.execute(
+        text(f"SELECT * FROM ({union}) AS results ORDER BY score, kind, id LIMIT :limit OFFSET :offset"),
+        {"match": match, "user_id": user_id, "group_id": group_id, "limit": limit + 1, "offset": offset},
+    ).all()
+    return rows[:limit], len(rows) > limit
+
+#------------------------------------------------------------------------------------------------
+
+# 标题联想的来源：key 为索引 rowid 对应的列，titles 为参与索引的标题/别名列
+TITLE_SOURCES = {
+    "library": {
+        "table": "user_media",
+        "key": "id",
+        "titles": ("title",),
+        "joins": "JOIN media_catalog c ON c.id = t.catalog_id",
+        "fields": {
+            "media_id": "t.id", "group_id": "NULL", "bangumi_id": "t.bangumi_id", "title": "t.title",
+            "alias": "NULL", "alias_cn": "NULL", "image": "c.image",
+        },
+        "scope": "t.user_id = :user_id",
+    },
+    "group": {
+        "table": "group_media",
+        "key": "id",
+        "titles": ("title",),
+        "joins": "JOIN media_catalog c ON c.id = t.catalog_id",
+        "fields": {
+            "media_id": "t.id", "group_id": "t.group_id", "bangumi_id": "t.bangumi_id", "title": "t.title",
+            "alias": "NULL", "alias_cn": "NULL", "image": "c.image",
+        },
+        "scope": f"t.group_id IN ({_MEMBER_GROUPS})",
+    },
+    # 已缓存的 Bangumi 条目：中文名和原名互为别名；已在自己库中的条目标记 media_id
+    "bangumi": {
+        "table": "bangumi_subjects",
+        "key": "bangumi_id",
+        "titles": ("name_cn", "name"),
+        "joins": "LEFT JOIN user_media m ON m.bangumi_id = t.bangumi_id AND m.user_id = :user_id",
+        "fields": {
+            "media_id": "m.id", "group_id": "NULL", "bangumi_id": "t.bangumi_id",
+            "title": "coalesce(m.title, nullif(t.name_cn, ''), t.name)", "alias": "t.name", "alias_cn": "t.name_cn",
+            "image": "t.image",
+        },
+        "scope": "1 = 1",
+    },
+}
+
+# 每个来源每个匹配阶段最多取的候选数，候选在 Python 中按相似度重新排序
+TYPEAHEAD_CANDIDATES = 50
+# 模糊匹配阶段的最低相似度
+TYPEAHEAD_MIN_SIMILARITY = 0.3
+# 模糊匹配只用少见的 n-gram 及其两两组合，命中文档数（估计）合计不超过该值；
+# 候选都要按 bm25 排序，排序成本与命中文档数成正比
+TYPEAHEAD_FUZZY_MAX_DOCS = 2000
+_SOURCE_PRIORITY = {"library": 0, "group": 1, "bangumi": 2}
+# 标题索引每批补算的行数
+TITLE_REFRESH_BATCH = 5000
+
+def _install_title_index(conn, table: str, key: str, titles: tuple):
+    index = f"title_grams_{table}"
+    pending = f"{index}_pending"
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": index}).first()
+    # detail=none：只按词项匹配，不需要位置信息，索引更小
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(grams, detail=none, prefix='3', "
+        f"tokenize=\"unicode61 tokenchars '{ngrams.START}'\")"
+    ))
+    # 词项文档频率，模糊匹配时用来挑选少见的 n-gram
+    conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {index}_vocab USING fts5vocab({index}, 'row')"))
+    # n-gram 在 Python 中计算（ngrams.title_grams）。触发器只用纯 SQL：删除旧条目，把新增或改名的行
+    # 记入 pending 表，由 refresh_title_indexes 补算。这样 sqlite3 命令行、备份恢复脚本等
+    # 不经过应用的写入也不会因缺少自定义函数而失败，索引在下次联想查询时补齐。
+    # 旧版本的触发器调用已不再注册的 title_grams(...)，先删除再重建
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {pending} (id INTEGER PRIMARY KEY)"))
+    for suffix in ("ai", "ad", "au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {index}_{suffix}"))
+    conn.execute(text(
+        f"CREATE TRIGGER {index}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT OR IGNORE INTO {pending}(id) VALUES (new.{key}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER {index}_ad AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {index} WHERE rowid = old.{key}; DELETE FROM {pending} WHERE id = old.{key}; END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER {index}_au AFTER UPDATE OF {', '.join(titles)} ON {table} BEGIN "
+        f"DELETE FROM {index} WHERE rowid = old.{key}; "
+        f"INSERT OR IGNORE INTO {pending}(id) VALUES (new.{key}); END"
+    ))
+    if not exists:
+        conn.execute(text(f"INSERT OR IGNORE INTO {pending}(id) SELECT {key} FROM {table}"))
+        _refresh_title_index(conn, table, key, titles)
+
+def _refresh_title_index(conn, table: str, key: str, titles: tuple) -> int:
+    # 分批计算 pending 中各行的 n-gram 并写入索引；先删除同 rowid 的旧条目，重复执行也不会插入两次
+    index, pending = f"title_grams_{table}", f"title_grams_{table}_pending"
+    refreshed = 0
+    while True:
+        rows = conn.execute(text(
+            f"SELECT p.id, {', '.join('t.' + c for c in titles)} FROM {pending} p "
+            f"LEFT JOIN {table} t ON t.{key} = p.id LIMIT {TITLE_REFRESH_BATCH}"
+        )).all()
+        if not rows:
+            return refreshed
+        ids = [{"id": row[0]} for row in rows]
+        conn.execute(text(f"DELETE FROM {index} WHERE rowid = :id"), ids)
+        # 行在补算前已被删除时（LEFT JOIN 为空）只清除 pending
+        grams = [{"id": row[0], "grams": ngrams.title_grams(*row[1:])} for row in rows if any(row[1:])]
+        if grams:
+            conn.execute(text(f"INSERT INTO {index}(rowid, grams) VALUES (:id, :grams)"), grams)
+        conn.execute(text(f"DELETE FROM {pending} WHERE id = :id"), ids)
+        refreshed += len(rows)
+
+def refresh_title_indexes(db: Session) -> int:
+    """Index the titles written since the last refresh; returns the number of rows processed.
+
+    Runs before every typeahead query, and commits only when rows were pending.
+    """
+    if BACKEND != "fts5":
+        return 0
+    pending = [
+        source for source in TITLE_SOURCES.values()
+        if db.execute(text(f"SELECT 1 FROM title_grams_{source['table']}_pending LIMIT 1")).first()
+    ]
+    if not pending:
+        return 0
+    try:
+        refreshed = sum(_refresh_title_index(db.connection(), s["table"], s["key"], s["titles"]) for s in pending)
+        db.commit()
+    except OperationalError:
+        # 另一个 worker 正在补算同一批行（SQLite 写锁）：用现有索引查询，下次再补
+        db.rollback()
+        logger.debug("Title index refresh skipped", exc_info=True)
+        return 0
+    return refreshed
+
+def _title_select(name: str, source: dict, media_type_filter: bool, ranked: bool) -> str:
+    table = source["table"]
+    fields = ", ".join(f"{expr} AS {field}" for field, expr in source["fields"].items())
+    where = [source["scope"]]
+    if media_type_filter:
+        where.append("t.media_type = :media_type")
+    order = ""
+    if BACKEND == "fts5":
+        index = f"title_grams_{table}"
+        source_from = f"{index} CROSS JOIN {table} t ON t.{source['key']} = {index}.rowid"
+        where.append(f"{index} MATCH :match")
+        if ranked:
+            order = f"ORDER BY {index}.rank"
+    else:
+        source_from = f"{table} t"
+        where.append("(" + " OR ".join(f"lower(t.{c}) LIKE :match ESCAPE '\\'" for c in source["titles"]) + ")")
+    return (
+        f"SELECT '{name}' AS source, {fields}, t.media_type AS media_type "
+        f"FROM {source_from} {source['joins']} WHERE {' AND '.join(where)} {order} LIMIT {TYPEAHEAD_CANDIDATES}"
+    )
+
+def _title_stages(query: str) -> list:
+    if BACKEND == "fts5":
+        stages = ngrams.match_queries(query)
+        return [(stage, stages[stage]) for stage in ("prefix", "substring", "fuzzy") if stage in stages]
+    pattern = _like_pattern(query.lower())
+    return [("substring", pattern)] if pattern else []
+
+def _fuzzy_match(db: Session, table: str, tokens: list):
+    vocab = f"title_grams_{table}_vocab"
+    params = {f"t{i}": token for i, token in enumerate(tokens)}
+    frequencies = dict(db.execute(
+        text(f"SELECT term, doc FROM {vocab} WHERE term IN ({', '.join(':' + name for name in params)})"), params
+    ).all())
+    # 两个 n-gram 同时命中比单个精确得多，先选组合（命中数不超过较少见的那个），再选单个；
+    # 各自按文档频率从低到高，放不进上限的跳过
+    pairs = [((a, b), min(frequencies[a], frequencies[b])) for a, b in combinations(sorted(frequencies), 2)]
+    singles = [((term,), doc) for term, doc in frequencies.items()]
+    chosen, total = [], 0
+    for group, doc in sorted(pairs, key=lambda item: item[1]) + sorted(singles, key=lambda item: item[1]):
+        if total + doc <= TYPEAHEAD_FUZZY_MAX_DOCS:
+            chosen.append(group)
+            total += doc
+    return ngrams.any_of(chosen) if chosen else None
+
+def typeahead(db: Session, user_id: int, query: str, media_type: int = None, limit: int = 10):
+    """Title suggestions for `query` from the caller's library, their groups and cached Bangumi subjects.
+
+    Tries prefix, then substring, then fuzzy n-gram matching, stopping once
+    enough candidates are found, and ranks them with `ngrams.similarity`.
+    The same Bangumi subject is suggested once, preferring the library entry.
+    """
+    refresh_title_indexes(db)
+    candidates = {}
+    for stage, match in _title_stages(query):
+        # 每个来源单独查询，避免 UNION 之后 LIMIT 只落在某一个来源上
+        for name, source in TITLE_SOURCES.items():
+            source_match = _fuzzy_match(db, source["table"], match) if stage == "fuzzy" else match
+            if source_match is None:
+                continue
+            rows = db.execute(
+                # 前缀/子串阶段的候选都包含全部查询词，取前几条即可；模糊阶段按命中的 n-gram 排序取最接近的
+                text(_title_select(name, source, media_type is not None, ranked=stage == "fuzzy")),
+                {"match": source_match, "user_id": user_id, "media_type": media_type},
+            ).all()
+            for row in rows:
+                score = max(ngrams.similarity(query, title or "") for title in (row.title, row.alias, row.alias_cn))
+                if stage == "fuzzy" and score < TYPEAHEAD_MIN_SIMILARITY:
+                    continue
+                source_name = "library" if row.source == "bangumi" and row.media_id else row.source
+                item = dict(row._mapping, source=source_name, score=score)
+                del item["alias"], item["alias_cn"]
+                key = ("bangumi", row.bangumi_id) if row.bangumi_id else (source_name, row.media_id)
+                current = candidates.get(key)
+                if current is not None:
+                    # 同一条目保留优先级最高的来源，分数取各来源中最高的
+                    item = min(current, item, key=lambda c: _SOURCE_PRIORITY[c["source"]])
+                    item["score"] = max(score, current["score"])
+                candidates[key] = item
+        if len(candidates) >= limit:
+            break
+    ranked = sorted(candidates.values(), key=lambda item: (-item["score"], _SOURCE_PRIORITY[item["source"]]))
+    return ranked[:limit]
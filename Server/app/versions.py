@@ -0,0 +1,83 @@
+"""Version counters and weak ETags for read endpoints.
+
+Every crud write that changes what a read endpoint returns calls `bump` for
+that resource's keys, in the same transaction. The endpoint's ETag is built
+from the current versions, so answering `If-None-Match` with 304 takes one
+primary-key lookup and never loads the rows themselves.
+"""
+from fastapi import Request, Response
+from sqlalchemy import select, update, insert, exists
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from . import metrics, models
+
+# 所有 ETag 接口的请求中返回 304 的百分比
+metrics.register_ratio("etag.not_modified_pct", "etag.not_modified", "etag.requests")
+
+# 用户名出现在讨论和评论中，改名时所有讨论的版本一起失效
+USERS = "users"
+
+def group(group_id: int) -> str:
+    # 创建和删除小组时递增，小组 id 被复用时旧的 ETag 也不会命中
+    return f"group:{group_id}"
+
+def group_media(group_id: int) -> str:
+    return f"group_media:{group_id}"
+
+def group_reviews(media_id: int) -> str:
+    return f"group_reviews:{media_id}"
+
+def media_reviews(media_id: int) -> str:
+    return f"reviews:{media_id}"
+
+def discussion(discussion_id: int) -> str:
+    return f"discussion:{discussion_id}"
+
+def bump(db: Session, *keys: str):
+    """Increment the versions of `keys` in the caller's transaction, creating missing ones at 1."""
+    table = models.ResourceVersion.__table__
+    rows = [{"key": key, "version": 1} for key in dict.fromkeys(keys)]
+    dialect_insert = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        statement = dialect_insert(table)
+        db.execute(statement.on_conflict_do_update(index_elements=["key"], set_={"version": table.c.version + 1}), rows)
+        return
+    for row in rows:
+        if not db.execute(update(table).where(table.c.key == row["key"]).values(version=table.c.version + 1)).rowcount:
+            db.execute(insert(table).values(**row))
+
+def current_etag(db: Session, *keys: str, exists_clause=None):
+    """Weak ETag of the current versions of `keys`.
+
+    Returns None when `exists_clause` is given and false, i.e. the resource is
+    gone; the endpoint then answers as usual (typically 404).
+    """
+    versions = dict(db.execute(
+        select(models.ResourceVersion.key, models.ResourceVersion.version).where(models.ResourceVersion.key.in_(keys))
+    ).all())
+    if exists_clause is not None and not db.scalar(select(exists_clause)):
+        return None
+    # 没有记录的键版本为 0。用弱 ETag：同一版本有 gzip 和未压缩两种表示，强 ETag 必须区分编码
+    return 'W/"' + "-".join(str(versions.get(key, 0)) for key in keys) + '"'
+
+def is_fresh(request: Request, etag, metric: str = "etag") -> bool:
+    """Whether the request's If-None-Match already names `etag`; counts the request under `metric` in the metrics."""
+    metrics.incr(f"{metric}.requests")
+    header = request.headers.get("if-none-match")
+    if etag is None or not header:
+        return False
+    # If-None-Match 按弱比较：忽略两边的 W/ 前缀
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if etag.removeprefix("W/") in candidates or "*" in candidates:
+        metrics.incr(f"{metric}.not_modified")
+        return True
+    return False
+
+def set_etag(response: Response, etag):
+    if etag is not None:
+        response.headers["ETag"] = etag
+        # 带认证的私有数据：浏览器可缓存，但每次使用前都要带 If-None-Match 重新验证
+        response.headers["Cache-Control"] = "private, no-cache"
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
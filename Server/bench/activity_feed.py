@@ -0,0 +1,81 @@
+"""Activity feeds with fan-out on write.
+
+Seeds 200 groups of 30 members (1,000 users in 6 groups each), 1,000
+activities per group and their 6M timeline rows, then times one page of 50:
+a user's timeline, the same page computed on read from the user's groups, and
+a group feed. Also times recording one event, fan-out and commit included.
+"""
+from bench import common
+from app.main import app  # noqa: F401  建表并执行迁移
+from app.database import SessionLocal
+from app import crud, models
+from sqlalchemy import insert, select, text
+import random
+
+GROUPS = 200
+MEMBERS = 30
+USERS = 1_000
+ACTIVITIES_PER_GROUP = 1_000
+PAGE = 50
+BATCH = 50_000
+
+def seed(db):
+    db.execute(insert(models.User.__table__), [
+        {"id": i + 1, "username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": "x"}
+        for i in range(USERS)
+    ])
+    db.execute(insert(models.Group.__table__), [
+        {"id": i + 1, "name": f"group {i}", "description": "d", "owner_id": (i * MEMBERS) % USERS + 1}
+        for i in range(GROUPS)
+    ])
+    # 每个小组 30 个连续编号的成员，每个用户恰好在 6 个小组中
+    db.execute(models.group_members.insert(), [
+        {"group_id": group + 1, "user_id": (group * MEMBERS + member) % USERS + 1}
+        for group in range(GROUPS) for member in range(MEMBERS)
+    ])
+    random.seed(1)
+    # 各小组的动态交错写入，与真实的时间顺序一致
+    rows = [
+        {"kind": "review_added", "group_id": random.randrange(GROUPS) + 1, "actor_id": random.randrange(USERS) + 1,
+         "target_id": i, "title": f"title {i}", "excerpt": "excerpt " * 10}
+        for i in range(GROUPS * ACTIVITIES_PER_GROUP)
+    ]
+    for start in range(0, len(rows), BATCH):
+        db.execute(insert(models.Activity.__table__), rows[start:start + BATCH])
+    db.execute(text(
+        "INSERT INTO timeline_entries (user_id, activity_id, group_id) "
+        "SELECT group_members.user_id, activities.id, activities.group_id "
+        "FROM activities JOIN group_members ON group_members.group_id = activities.group_id"
+    ))
+    db.commit()
+    db.execute(text("ANALYZE"))
+    print(f"seeded {db.scalar(text('SELECT count(*) FROM timeline_entries')):,} timeline rows")
+
+def fan_out_on_read(db, user_id: int):
+    # 对照：不保存时间线，读取时从用户所在的各小组取最近的动态
+    groups = select(models.group_members.c.group_id).where(models.group_members.c.user_id == user_id)
+    return crud._activity_query(db).filter(models.Activity.group_id.in_(groups)) \
+        .order_by(models.Activity.id.desc()).limit(PAGE).all()
+
+def main():
+    db = SessionLocal()
+    seed(db)
+    users = iter(range(1, USERS + 1))
+    groups = iter(range(1, GROUPS + 1))
+    results = {
+        "timeline page": common.per_call_ms(lambda: crud.get_user_timeline(db, next(users), limit=PAGE), 200),
+        "fan-out on read": common.per_call_ms(lambda: fan_out_on_read(db, next(users)), 200),
+        "group feed page": common.per_call_ms(lambda: crud.get_group_activity(db, next(groups), limit=PAGE), 150),
+    }
+
+    targets = iter(range(1, GROUPS + 1))
+    def record():
+        crud.record_activity(db, "review_added", next(targets), 1, target_id=0, title="title", excerpt="excerpt")
+        db.commit()
+    results["record event"] = common.per_call_ms(record, 150)
+    for name, ms in results.items():
+        print(f"{name}: {ms:.2f} ms")
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Storage and list latency before and after moving image and summary to media_catalog.
+
+Seeds the pre-catalog layout: 2,000 users x 200 titles and 200 groups x 500
+titles (500k rows, 5,000 distinct Bangumi subjects, ~1 KB summaries), in
+shuffled order so a list's rows are spread over the file. Then measures,
+VACUUMs and prints the database size, runs `migrations.upgrade`, and
+measures again.
+
+Latency is the same list query on both layouts, written in SQL: before it
+reads image and summary from the row, after through the correlated
+subqueries that the CatalogEntry column properties generate.
+"""
+from bench import common
+from sqlalchemy import Column, Index, MetaData, String, Table, text
+from app.database import Base, engine
+from app import migrations
+import itertools
+import os
+import random
+import time
+
+USERS, USER_TITLES = 2_000, 200
+GROUPS, GROUP_TITLES = 200, 500
+SUBJECTS = 5_000
+SUMMARY_BYTES = 1_000
+BATCH = 10_000
+
+LEGACY_COLUMNS = "image, summary"
+CATALOG_COLUMNS = ("(SELECT image FROM media_catalog WHERE media_catalog.id = t.catalog_id) AS image, "
+                   "(SELECT summary FROM media_catalog WHERE media_catalog.id = t.catalog_id) AS summary")
+QUERIES = {
+    "user list page (100 rows, by title)": ("user_media", "user_id", USERS, "LIMIT 100"),
+    f"full user list ({USER_TITLES} rows)": ("user_media", "user_id", USERS, ""),
+    f"full group list ({GROUP_TITLES} rows)": ("group_media", "group_id", GROUPS, ""),
+}
+
+def legacy_table(table: Table, metadata: MetaData) -> Table:
+    """`table` as it was before media_catalog: no catalog_id, image and summary on the row."""
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+               server_default=column.server_default.arg if column.server_default is not None else None)
+        for column in table.columns if column.name != "catalog_id"
+    ]
+    indexes = [
+        Index(index.name, *[column.name for column in index.columns])
+        for index in table.indexes if "catalog_id" not in index.columns
+    ]
+    return Table(table.name, metadata, *columns, Column("image", String), Column("summary", String), *indexes)
+
+def create_legacy_schema():
+    current = [table for table in Base.metadata.sorted_tables if table.name not in migrations.CATALOG_TABLES]
+    Base.metadata.create_all(engine, tables=current)
+    legacy = MetaData()
+    for name in migrations.CATALOG_TABLES:
+        legacy_table(Base.metadata.tables[name], legacy)
+    legacy.create_all(engine)
+
+def populate():
+    random.seed(1)
+    subjects = {
+        i: {"bangumi_id": i, "title": f"title {i:05d}", "media_type": 2,
+            "image": f"https://lain.bgm.tv/pic/cover/l/{i}.jpg", "summary": (f"summary of {i} " * 80)[:SUMMARY_BYTES]}
+        for i in range(1, SUBJECTS + 1)
+    }
+    rows = [("user_media", "user_id", owner, subject) for owner in range(1, USERS + 1)
+            for subject in random.sample(range(1, SUBJECTS + 1), USER_TITLES)]
+    rows += [("group_media", "group_id", owner, subject) for owner in range(1, GROUPS + 1)
+             for subject in random.sample(range(1, SUBJECTS + 1), GROUP_TITLES)]
+    random.shuffle(rows)
+    for start in range(0, len(rows), BATCH):
+        with engine.begin() as conn:
+            for table, owner_column in (("user_media", "user_id"), ("group_media", "group_id")):
+                batch = [{**subjects[subject], "owner": owner} for name, _, owner, subject in rows[start:start + BATCH] if name == table]
+                conn.execute(text(
+                    f"INSERT INTO {table} ({owner_column}, bangumi_id, title, media_type, image, summary) "
+                    f"VALUES (:owner, :bangumi_id, :title, :media_type, :image, :summary)"
+                ), batch)
+    return len(rows)
+
+def database_mb() -> float:
+    # VACUUM 本身写 WAL，写回主文件后只计主文件大小
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(engine.url.database) / 1e6
+
+def report(label, columns):
+    print(f"{label}: {database_mb():.0f} MB")
+    owners = itertools.count()
+    with engine.connect() as conn:
+        for name, (table, owner_column, owners_total, limit) in QUERIES.items():
+            query = text(f"SELECT t.id, t.title, t.bangumi_id, t.media_type, {columns} FROM {table} t "
+                         f"WHERE t.{owner_column} = :owner ORDER BY t.title, t.id {limit}")
+            ms = common.per_call_ms(lambda: conn.execute(query, {"owner": next(owners) % owners_total + 1}).all(), 500)
+            print(f"  {name}: {ms:.2f} ms")
+
+def main():
+    create_legacy_schema()
+    start = time.perf_counter()
+    rows = populate()
+    print(f"seeded {rows} rows in {time.perf_counter() - start:.0f} s")
+    report("before", LEGACY_COLUMNS)
+    start = time.perf_counter()
+    migrations.upgrade(engine)
+    print(f"migrations.upgrade: {time.perf_counter() - start:.0f} s")
+    report("after", CATALOG_COLUMNS)
+
+if __name__ == "__main__":
+    main()
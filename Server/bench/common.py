@@ -0,0 +1,60 @@
+"""Shared setup of the benchmark scripts.
+
+Import this module before `app`: it points the application at a fresh
+SQLite file in a temporary directory, so a run never touches sql_app.db.
+Run the scripts from Server/, e.g. `python -m bench.keyset_pages`; to
+compare two revisions, run the same script in a checkout of each.
+"""
+from contextlib import contextmanager
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 应用在导入时读取环境变量：必须在导入 app 之前设置
+TMP_DIR = tempfile.mkdtemp(prefix="kksk-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{TMP_DIR}/bench.db"
+os.environ["IMAGE_CACHE_DIR"] = f"{TMP_DIR}/image_cache"
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+def per_call_ms(fn, n: int, clock=time.perf_counter) -> float:
+    """Median milliseconds of `n` calls of `fn`, after one warm-up call."""
+    fn()
+    times = []
+    for _ in range(n):
+        start = clock()
+        fn()
+        times.append((clock() - start) * 1000)
+    return statistics.median(times)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@contextmanager
+def serve(**env):
+    """Runs `uvicorn app.main:app` against the benchmark database and yields its base URL."""
+    import httpx
+
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(300):
+            try:
+                httpx.get(url + "/docs")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
@@ -0,0 +1,111 @@
+"""Latency of deleting a large group.
+
+Seeds a group with 2,000 manual media, 20,000 reviews, 2,000 discussions and
+50,000 comments, then deletes it through `crud.delete_group`: once on the
+synchronous path (threshold raised), once on the background path, where the
+call only marks the group and `deletion.purge_group` removes the contents
+batch by batch. Revisions without `deletion.py` only run the first part.
+"""
+from bench import common
+from app.main import app  # noqa: F401  建表并执行迁移
+from app.database import SessionLocal
+from app import crud, models
+from sqlalchemy import func, insert, select
+import statistics
+import time
+
+MEDIA = 2_000
+REVIEWS_PER_MEDIA = 10
+COMMENTS_PER_DISCUSSION = 25
+BATCH = 10_000
+
+def _insert(db, model, rows):
+    for start in range(0, len(rows), BATCH):
+        db.execute(insert(model.__table__), rows[start:start + BATCH])
+
+def _next_id(db, model):
+    return (db.scalar(select(func.max(model.id))) or 0) + 1
+
+def seed(name: str):
+    """Creates a group of two members and its contents; returns `(group_id, owner_id)`."""
+    db = SessionLocal()
+    owner, member = (models.User(username=f"{name}-{role}", email=f"{name}-{role}@example.com", hashed_password="x")
+                     for role in ("owner", "member"))
+    group = models.Group(name=name, description="d", owner=owner, members=[owner, member])
+    db.add(group)
+    db.flush()
+    catalog_start = _next_id(db, models.MediaCatalog)
+    _insert(db, models.MediaCatalog, [
+        {"id": catalog_start + i, "title": f"{name} {i}", "media_type": 2, "image": "", "summary": "s" * 200}
+        for i in range(MEDIA)
+    ])
+    media_start = _next_id(db, models.GroupMedia)
+    _insert(db, models.GroupMedia, [
+        {"id": media_start + i, "title": f"{name} {i}", "media_type": 2, "group_id": group.id,
+         "added_by_id": owner.id, "catalog_id": catalog_start + i}
+        for i in range(MEDIA)
+    ])
+    _insert(db, models.GroupReview, [
+        {"media_id": media_start + i, "user_id": member.id, "username": member.username, "text": "review text", "rating": 7}
+        for i in range(MEDIA) for _ in range(REVIEWS_PER_MEDIA)
+    ])
+    discussion_start = _next_id(db, models.Discussion)
+    _insert(db, models.Discussion, [
+        {"id": discussion_start + i, "title": "discussion", "content": "c", "user_id": owner.id,
+         "group_id": group.id, "media_id": media_start + i}
+        for i in range(MEDIA)
+    ])
+    _insert(db, models.Comment, [
+        {"discussion_id": discussion_start + i, "user_id": member.id, "content": "comment text"}
+        for i in range(MEDIA) for _ in range(COMMENTS_PER_DISCUSSION)
+    ])
+    db.commit()
+    ids = group.id, owner.id
+    db.close()
+    return ids
+
+def synchronous():
+    group_id, owner_id = seed("sync")
+    crud.GROUP_DELETE_BACKGROUND_ROWS = 10 ** 9
+    db = SessionLocal()
+    start = time.perf_counter()
+    crud.delete_group(db, group_id, owner_id)
+    elapsed = time.perf_counter() - start
+    db.close()
+    print(f"synchronous delete: {elapsed * 1000:.0f} ms")
+
+def background():
+    try:
+        from app import deletion
+    except ImportError:
+        return
+    group_id, owner_id = seed("background")
+    crud.GROUP_DELETE_BACKGROUND_ROWS = 2_000
+    db = SessionLocal()
+    start = time.perf_counter()
+    assert crud.delete_group(db, group_id, owner_id) is False
+    print(f"background path, request: {(time.perf_counter() - start) * 1000:.1f} ms")
+    db.close()
+
+    # 每批一条 DELETE 加一次提交；包装 delete_where 计时单批 DELETE
+    batches = []
+    delete_where = crud.delete_where
+    def timed(*args, **kwargs):
+        batch_start = time.perf_counter()
+        result = delete_where(*args, **kwargs)
+        batches.append((time.perf_counter() - batch_start) * 1000)
+        return result
+    crud.delete_where = timed
+    start = time.perf_counter()
+    deletion.purge_group(group_id)
+    elapsed = time.perf_counter() - start
+    crud.delete_where = delete_where
+    print(f"background purge: {elapsed * 1000:.0f} ms in {len(batches)} batches, "
+          f"median {statistics.median(batches):.1f} ms, longest {max(batches):.1f} ms")
+
+def main():
+    synchronous()
+    background()
+
+if __name__ == "__main__":
+    main()
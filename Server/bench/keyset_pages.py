@@ -0,0 +1,47 @@
+"""OFFSET versus keyset pages of one long comment thread.
+
+200,000 comments, 100,000 of them in discussion 1, pages of 50. The OFFSET
+variant runs the same query as `crud.get_comments` with `.offset()`, as the
+comment list did before it switched to cursors.
+"""
+from bench import common
+from sqlalchemy import insert
+from app.main import app  # noqa: F401  建表并执行迁移
+from app.database import engine, SessionLocal
+from app import crud, models
+
+COMMENTS = 200_000
+THREAD = 100_000
+PAGE = 50
+
+def populate():
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [dict(username=f"u{i}", email=f"u{i}@example.com", hashed_password="x") for i in range(1, 101)])
+        conn.execute(insert(models.Group), [dict(name="group", owner_id=1)])
+        conn.execute(insert(models.Discussion), [dict(title=f"d{i}", content="c", user_id=1, group_id=1) for i in range(1, 3)])
+        conn.execute(insert(models.Comment), [
+            dict(content="comment text " * 5, user_id=i % 100 + 1, discussion_id=1 if i < THREAD else 2)
+            for i in range(COMMENTS)
+        ])
+
+def main():
+    populate()
+    db = SessionLocal()
+    for offset in (0, THREAD // 2, THREAD - PAGE):
+        query = crud._comments_query(db, 1).order_by(models.Comment.created_at, models.Comment.id)
+        ms = common.per_call_ms(lambda: query.offset(offset).limit(PAGE).all(), 50)
+        print(f"OFFSET {offset:>6}: {ms:6.2f} ms/page")
+
+    cursors, cursor = [], None
+    while True:
+        cursors.append(cursor)
+        _, cursor = crud.get_comments(db, 1, cursor=cursor, limit=PAGE)
+        if cursor is None:
+            break
+    for index in (0, len(cursors) // 2, len(cursors) - 1):
+        ms = common.per_call_ms(lambda: crud.get_comments(db, 1, cursor=cursors[index], limit=PAGE), 50)
+        print(f"keyset page {index + 1:>4}/{len(cursors)}: {ms:6.2f} ms/page")
+    db.close()
+
+if __name__ == "__main__":
+    main()
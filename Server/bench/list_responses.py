@@ -0,0 +1,77 @@
+"""CPU cost of the list endpoints with 500 rows each.
+
+Requests go through TestClient in-process, so the figures are server CPU
+time (time.process_time) per request, median of 40. Each URL is measured
+uncompressed and, to show the cost of compression, with gzip.
+"""
+from bench import common
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+from app.main import app
+from app.database import engine
+from app import models
+import time
+
+ROWS = 500
+GROUPS = 50
+
+def populate(client):
+    credentials = {"username": "bench", "password": "password"}
+    client.post("/register", json={**credentials, "email": "bench@example.com"})
+    token = client.post("/token", data=credentials).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/info", headers=headers).json()["id"]
+    group_ids = [
+        client.post("/groups/create", json={"name": f"group {i}", "description": "d" * 50}, headers=headers).json()["id"]
+        for i in range(GROUPS)
+    ]
+    group_id = group_ids[0]
+    entry = {"title": "title", "media_type": 2, "image": "https://lain.bgm.tv/pic/1.jpg", "summary": "s" * 200}
+    media = client.post(f"/groups/{group_id}/media/add-manual", json=entry, headers=headers).json()
+    library = client.post("/media/add-manual", json=entry, headers=headers).json()
+    with engine.begin() as conn:
+        # 批量插入的行共用第一行的目录行（图片和简介）
+        media["catalog_id"] = conn.execute(select(models.GroupMedia.catalog_id).where(models.GroupMedia.id == media["id"])).scalar()
+        library["catalog_id"] = conn.execute(select(models.UserMedia.catalog_id).where(models.UserMedia.id == library["id"])).scalar()
+        conn.execute(insert(models.GroupMedia), [
+            dict(title=f"title {i}", media_type=2, group_id=group_id, added_by_id=user_id, catalog_id=media["catalog_id"])
+            for i in range(ROWS - 1)
+        ])
+        conn.execute(insert(models.GroupReview), [
+            dict(text="review text " * 10, rating=7, user_id=user_id, username="bench", media_id=media["id"]) for _ in range(ROWS)
+        ])
+        discussion_ids = conn.execute(insert(models.Discussion).returning(models.Discussion.id), [
+            dict(title="discussion", content="content " * 20, user_id=user_id, group_id=group_id, media_id=media["id"])
+            for _ in range(ROWS)
+        ]).scalars().all()
+        conn.execute(insert(models.Comment), [
+            dict(content="comment " * 20, user_id=user_id, discussion_id=discussion_ids[0]) for _ in range(ROWS)
+        ])
+        conn.execute(insert(models.UserMedia), [
+            dict(title=f"title {i}", media_type=2, user_id=user_id, catalog_id=library["catalog_id"]) for i in range(ROWS - 1)
+        ])
+    urls = [
+        f"/groups/{group_id}/media",
+        f"/groups/{group_id}/media/{media['id']}/reviews?limit={ROWS}",
+        f"/groups/{group_id}/media/{media['id']}/discussions/?limit={ROWS}",
+        f"/discussions/{discussion_ids[0]}/comments/?limit={ROWS}",
+        "/media/getAll",
+        "/groups/get",
+    ]
+    return headers, urls
+
+def main():
+    with TestClient(app) as client:
+        headers, urls = populate(client)
+        for url in urls:
+            line = f"{url:45}"
+            for encoding in ("identity", "gzip"):
+                request_headers = {**headers, "Accept-Encoding": encoding}
+                response = client.get(url, headers=request_headers)
+                assert response.status_code == 200, (url, response.text[:200])
+                ms = common.per_call_ms(lambda: client.get(url, headers=request_headers), 40, clock=time.process_time)
+                line += f" {encoding} {ms:6.2f} ms"
+            print(f"{line}  rows {len(response.json())}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Concurrent logins at the default bcrypt cost.
+
+Runs uvicorn with BCRYPT_ROUNDS=12 and sends 64 concurrent POST /token
+while a probe polls GET /groups/get, to show whether password hashing
+holds up unrelated requests.
+"""
+from bench import common
+import asyncio
+import time
+
+LOGINS = 64
+PROBES = 20
+
+async def run(url):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+        credentials = {"username": "bench", "password": "password"}
+        await client.post("/register", json={**credentials, "email": "bench@example.com"})
+        token = (await client.post("/token", data=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        latencies = []
+
+        async def probe():
+            for _ in range(PROBES):
+                start = time.perf_counter()
+                await client.get("/groups/get", headers=headers)
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+        start = time.perf_counter()
+        *logins, _ = await asyncio.gather(*(client.post("/token", data=credentials) for _ in range(LOGINS)), probe())
+        elapsed = time.perf_counter() - start
+        statuses = sorted({response.status_code for response in logins})
+        failed = sum(response.status_code != 200 for response in logins)
+        latencies.sort()
+        print(f"{LOGINS} logins in {elapsed:.1f} s ({LOGINS / elapsed:.1f}/s), statuses {statuses}, {failed} failed")
+        print(f"probe p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms")
+
+def main():
+    with common.serve(BCRYPT_ROUNDS="12") as url:
+        asyncio.run(run(url))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Latency of the group media detail page: one bundle request versus separate requests.
+
+Seeds a group media item with 100 reviews and 100 discussions, then times
+through TestClient (wall clock, median of 100) the /page bundle and the
+separate media, reviews and discussions requests it replaces, both for the
+fields the detail page uses (media, reviews) and for all three.
+"""
+from bench import common
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from app.main import app
+from app.database import engine
+from app import models
+
+ROWS = 100
+
+def populate(client):
+    credentials = {"username": "bench", "password": "password"}
+    client.post("/register", json={**credentials, "email": "bench@example.com"})
+    token = client.post("/token", data=credentials).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/info", headers=headers).json()["id"]
+    group_id = client.post("/groups/create", json={"name": "group", "description": "d"}, headers=headers).json()["id"]
+    media_id = client.post(f"/groups/{group_id}/media/add-manual",
+                           json={"title": "title", "media_type": 2, "summary": "s" * 200}, headers=headers).json()["id"]
+    with engine.begin() as conn:
+        conn.execute(insert(models.GroupReview), [
+            dict(text="review text " * 10, rating=7, user_id=user_id, username="bench", media_id=media_id) for _ in range(ROWS)
+        ])
+        conn.execute(insert(models.Discussion), [
+            dict(title="discussion", content="content " * 20, user_id=user_id, group_id=group_id, media_id=media_id)
+            for _ in range(ROWS)
+        ])
+    return headers, f"/groups/{group_id}/media/{media_id}"
+
+def main():
+    with TestClient(app) as client:
+        headers, base = populate(client)
+
+        def get(*urls):
+            for url in urls:
+                response = client.get(url, headers=headers)
+                assert response.status_code == 200, (url, response.text[:200])
+
+        cases = [
+            ("media, reviews: bundle", [f"{base}/page?fields=media&fields=reviews"]),
+            ("media, reviews: separate", [base, f"{base}/reviews"]),
+            ("all three: bundle", [f"{base}/page"]),
+            ("all three: separate", [base, f"{base}/reviews", f"{base}/discussions/"]),
+        ]
+        for name, urls in cases:
+            print(f"{name:26} {common.per_call_ms(lambda: get(*urls), 100):.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Write throughput of the SQLite engine settings.
+
+Part one commits 2,000 single-row ORM inserts, one transaction each. Part
+two runs uvicorn and sends 1,500 requests from 32 concurrent clients,
+30% of them POST /reviews/add, the rest GET /reviews/media.
+"""
+from bench import common
+from app.main import app  # noqa: F401  建表并执行迁移
+from app.database import SessionLocal
+from app import models
+import asyncio
+import random
+import time
+
+COMMITS = 2_000
+REQUESTS = 1_500
+CONCURRENCY = 32
+WRITE_SHARE = 0.3
+
+def single_row_commits():
+    db = SessionLocal()
+    start = time.perf_counter()
+    for i in range(COMMITS):
+        db.add(models.User(username=f"writer{i}", email=f"writer{i}@example.com", hashed_password="x"))
+        db.commit()
+    elapsed = time.perf_counter() - start
+    db.close()
+    print(f"{COMMITS} single-row commits: {COMMITS / elapsed:.0f}/s")
+
+async def mixed_load(url):
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=httpx.Limits(max_connections=CONCURRENCY * 2)) as client:
+        await client.post("/register", json={"username": "bench", "email": "bench@example.com", "password": "password"})
+        token = (await client.post("/token", data={"username": "bench", "password": "password"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        media_id = (await client.post("/media/add-manual", headers=headers, json={"title": "title", "media_type": 2})).json()["id"]
+
+        random.seed(1)
+        writes = [random.random() < WRITE_SHARE for _ in range(REQUESTS)]
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        errors = 0
+
+        async def request(write):
+            nonlocal errors
+            async with semaphore:
+                if write:
+                    response = await client.post(f"/reviews/add/{media_id}", headers=headers, json={"text": "review", "rating": 5})
+                else:
+                    response = await client.get(f"/reviews/media/{media_id}", headers=headers)
+                errors += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(request(write) for write in writes))
+        elapsed = time.perf_counter() - start
+        print(f"{REQUESTS} requests, {WRITE_SHARE:.0%} writes, {CONCURRENCY} concurrent: {REQUESTS / elapsed:.0f} req/s, {errors} errors")
+
+def main():
+    single_row_commits()
+    with common.serve() as url:
+        asyncio.run(mixed_load(url))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Cost of polling a discussion versus pushing its comments over SSE.
+
+Polling: GET /discussions/{id} with 500 comments through TestClient,
+server CPU time per request (no If-None-Match, so the thread is rebuilt every
+time). Pushing: encoding one comment as an SSE frame, and delivery throughput
+of the in-process broker to 100 subscribers of one channel while another
+thread publishes, as the threadpool-bound crud code does.
+"""
+from bench import common
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from app.main import app
+from app.database import engine
+from app import models, pubsub
+import asyncio
+import time
+
+COMMENTS = 500
+SUBSCRIBERS = 100
+EVENTS = 2_000
+
+def populate(client):
+    credentials = {"username": "bench", "password": "password"}
+    client.post("/register", json={**credentials, "email": "bench@example.com"})
+    token = client.post("/token", data=credentials).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    user_id = client.get("/info", headers=headers).json()["id"]
+    group_id = client.post("/groups/create", json={"name": "group", "description": "d"}, headers=headers).json()["id"]
+    media_id = client.post(f"/groups/{group_id}/media/add-manual", json={"title": "title", "media_type": 2}, headers=headers).json()["id"]
+    discussion_id = client.post(f"/groups/{group_id}/media/{media_id}/discussions/",
+                                json={"title": "discussion", "content": "content " * 20}, headers=headers).json()["id"]
+    with engine.begin() as conn:
+        conn.execute(insert(models.Comment), [
+            dict(content="comment " * 20, user_id=user_id, discussion_id=discussion_id) for _ in range(COMMENTS)
+        ])
+    return headers, discussion_id
+
+async def delivery():
+    broker = pubsub.Broker()
+    subscriptions = [broker.subscribe("bench") for _ in range(SUBSCRIBERS)]
+    comment = {"id": 1, "content": "comment " * 20, "user_id": 1, "discussion_id": 1, "username": "bench"}
+
+    async def drain(subscription):
+        for _ in range(EVENTS):
+            await subscription.queue.get()
+
+    def publish():
+        for event_id in range(EVENTS):
+            broker.publish("bench", "comment", comment, event_id)
+
+    start = time.perf_counter()
+    # 队列上限足够大时不会断开；发布方在另一个线程中
+    await asyncio.gather(asyncio.to_thread(publish), *(drain(subscription) for subscription in subscriptions))
+    elapsed = time.perf_counter() - start
+    print(f"delivery to {SUBSCRIBERS} subscribers: {EVENTS / elapsed:,.0f} events/s, "
+          f"{EVENTS * SUBSCRIBERS / elapsed:,.0f} frames/s")
+
+def main():
+    with TestClient(app) as client:
+        headers, discussion_id = populate(client)
+        url = f"/discussions/{discussion_id}"
+        assert len(client.get(url, headers=headers).json()["comments"]) == COMMENTS
+        ms = common.per_call_ms(lambda: client.get(url, headers=headers), 40, clock=time.process_time)
+        print(f"poll GET {url} with {COMMENTS} comments: {ms:.2f} ms")
+
+    comment = {"id": 1, "content": "comment " * 20, "user_id": 1, "discussion_id": 1, "username": "bench",
+               "created_at": "2024-01-01T00:00:00"}
+    us = common.per_call_ms(lambda: pubsub.sse_frame("comment", comment, 1), 5_000) * 1000
+    print(f"encode one SSE frame: {us:.1f} us")
+
+    pubsub.PUBSUB_QUEUE_SIZE = EVENTS
+    asyncio.run(delivery())
+
+if __name__ == "__main__":
+    main()
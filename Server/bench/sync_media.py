@@ -0,0 +1,46 @@
+"""Syncing a whole library to a group, then syncing it again.
+
+A 5,000-item library of Bangumi subjects is synced to an empty group; the
+second sync adds nothing new. Prints wall time, SQL statements and the
+group's size after each sync.
+"""
+from bench import common
+from sqlalchemy import event, func
+from app.main import app  # noqa: F401  建表并执行迁移
+from app.database import engine, SessionLocal
+from app import crud, models, schemas
+import time
+
+LIBRARY = 5_000
+
+def main():
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    db = SessionLocal()
+    user = crud.create_user(db, schemas.UserCreate(username="bench", email="bench@example.com", password="password"), "x")
+    group = crud.create_group(db, schemas.GroupCreate(name="group"), user.id)
+    media = crud.bulk_create_user_media(db, user.id, [
+        schemas.UserMediaCreate(bangumi_id=i, title=f"title {i}", media_type=2, image=f"https://lain.bgm.tv/pic/{i}.jpg", summary="summary " * 50)
+        for i in range(1, LIBRARY + 1)
+    ])
+    media_ids, group_id, user_id = [m.id for m in media], group.id, user.id
+    db.close()
+
+    event.listen(engine, "before_cursor_execute", count)
+    for label in ("first sync", "second sync"):
+        db = SessionLocal()
+        statements[0] = 0
+        start = time.perf_counter()
+        crud.sync_media_to_group(db, group_id, media_ids, user_id)
+        elapsed = time.perf_counter() - start
+        ran = statements[0]
+        size = db.query(func.count(models.GroupMedia.id)).scalar()
+        print(f"{label}: {elapsed * 1000:7.0f} ms, {ran:6d} statements, group size {size}")
+        db.close()
+    event.remove(engine, "before_cursor_execute", count)
+
+if __name__ == "__main__":
+    main()
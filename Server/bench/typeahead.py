@@ -0,0 +1,101 @@
+"""Typeahead latency over 1M cached Bangumi subjects.
+
+Every subject has a CJK name_cn; half have a Latin name of 2-4 words drawn
+Zipf-like from a 30,000-word vocabulary, the rest a CJK name. For each
+kind of query, 100 different queries are built from real rows, and the
+script prints the time of `search.typeahead` and how often a suggestion
+contains the text the query was made from. For typos that is the
+original word, which many titles other than the source row may contain.
+"""
+from bench import common
+from app.database import engine, SessionLocal
+from app import migrations, models, ngrams, search
+from datetime import datetime
+import random
+import statistics
+import time
+
+SUBJECTS = 1_000_000
+BATCH = 50_000
+QUERIES = 100
+
+random.seed(7)
+_KANJI = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+_KANA = [chr(c) for c in range(0x30A1, 0x30F6)]
+_SYLLABLES = [c + v for c in "bdfghklmnprstvwyz" for v in "aeiou"] + ["sh", "ch", "th", "st", "n", "r"]
+_VOCABULARY = list(dict.fromkeys("".join(random.choices(_SYLLABLES, k=random.randint(2, 4))) for _ in range(40_000)))[:30_000]
+_WEIGHTS = [1 / (rank + 1) for rank in range(len(_VOCABULARY))]
+
+def cjk_name() -> str:
+    name = "".join(random.choices(_KANJI, k=random.randint(2, 6)))
+    if random.random() < 0.4:
+        name += "".join(random.choices(_KANA, k=random.randint(2, 5)))
+    return name
+
+def latin_name() -> str:
+    return " ".join(random.choices(_VOCABULARY, weights=_WEIGHTS, k=random.randint(2, 4))).title()
+
+def populate():
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"username": "bench", "email": "bench@example.com", "hashed_password": "x"}])
+    for start in range(0, SUBJECTS, BATCH):
+        with engine.begin() as conn:
+            conn.execute(models.BangumiSubject.__table__.insert(), [
+                {"bangumi_id": i, "name": latin_name() if i % 2 else cjk_name(), "name_cn": cjk_name(),
+                 "media_type": 2, "image": "", "summary": "", "fetched_at": now}
+                for i in range(start + 1, start + BATCH + 1)
+            ])
+
+def typo(word: str) -> str:
+    # 交换相邻两个字母
+    i = random.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def queries(db):
+    """`(query, intended text)` pairs of each kind."""
+    rows = db.query(models.BangumiSubject).filter(models.BangumiSubject.bangumi_id.in_(random.sample(range(1, SUBJECTS + 1), 4 * QUERIES))).all()
+    latin = [row for row in rows if row.bangumi_id % 2][:QUERIES]
+    cjk = [row for row in rows if len(row.name_cn) >= 4][:QUERIES]
+    long_words = lambda row: [word for word in row.name.split() if len(word) >= 5]
+    prefix = lambda row: row.name.split()[0] + " " + row.name.split()[1][:3]
+    return {
+        "Latin prefix": [(prefix(row), prefix(row)) for row in latin],
+        "Latin substring": [(row.name.split()[1], row.name.split()[1]) for row in latin],
+        "Latin fuzzy": [(typo(long_words(row)[0]), long_words(row)[0]) for row in latin if long_words(row)],
+        "CJK prefix": [(row.name_cn[:3], row.name_cn[:3]) for row in cjk],
+        "CJK substring": [(row.name_cn[1:4], row.name_cn[1:4]) for row in cjk],
+        "CJK fuzzy": [(row.name_cn[0] + random.choice(_KANJI) + row.name_cn[2:4], row.name_cn[2:4]) for row in cjk],
+    }
+
+def contains(db, suggestions, intended: str) -> bool:
+    intended = ngrams.normalize(intended)
+    for item in suggestions:
+        subject = db.get(models.BangumiSubject, item["bangumi_id"])
+        if intended in ngrams.normalize(f"{subject.name} {subject.name_cn}"):
+            return True
+    return False
+
+def main():
+    migrations.upgrade(engine)
+    search.install(engine)
+    start = time.perf_counter()
+    populate()
+    db = SessionLocal()
+    # 触发器只记录新行，n-gram 在这里一次补算完，不计入第一条查询
+    search.refresh_title_indexes(db)
+    print(f"seeded {SUBJECTS} subjects with their title index in {time.perf_counter() - start:.0f} s")
+    for label, cases in queries(db).items():
+        times, found = [], 0
+        for query, intended in cases:
+            search.typeahead(db, 1, query)
+            start = time.perf_counter()
+            suggestions = search.typeahead(db, 1, query)
+            times.append((time.perf_counter() - start) * 1000)
+            found += contains(db, suggestions, intended)
+        print(f"{label:16} median {statistics.median(times):5.1f} ms, p90 {statistics.quantiles(times, n=10)[-1]:5.1f} ms, "
+              f"intended text suggested {found}/{len(cases)}")
+    db.close()
+
+if __name__ == "__main__":
+    main()
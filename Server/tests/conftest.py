@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+# 应用在导入时读取环境变量：先指向临时数据库，不碰仓库里的 sql_app.db
+_tmp = tempfile.mkdtemp(prefix="kksk-tests-")
+# TEST_ASYNC_DB=1 时使用异步驱动，覆盖 AsyncSession/run_db 路径（见 test_async_mode.py）
+_driver = "sqlite+aiosqlite" if os.getenv("TEST_ASYNC_DB") else "sqlite"
+os.environ["DATABASE_URL"] = f"{_driver}:///{_tmp}/test.db"
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ["IMAGE_CACHE_DIR"] = f"{_tmp}/image_cache"
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.main import app
+from app.database import engine
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture(scope="session")
+def login(client):
+    def login(username: str) -> dict:
+        client.post("/register", json={"username": username, "email": f"{username}@example.com", "password": "password"})
+        token = client.post("/token", data={"username": username, "password": "password"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return login
+
+@pytest.fixture(scope="session")
+def seeded(client, login):
+    """A group with two members, library and group media, reviews, discussions and comments."""
+    owner, member = login("owner"), login("member")
+    group_id = client.post("/groups/create", json={"name": "group", "description": "d"}, headers=owner).json()["id"]
+    client.post(f"/groups/{group_id}/invite", json={"username": "member"}, headers=owner)
+    library = [
+        client.post("/media/add-manual", json={"title": f"title {i}", "media_type": 2, "image": "", "summary": "s"}, headers=owner).json()["id"]
+        for i in range(5)
+    ]
+    for media_id in library:
+        client.post(f"/reviews/add/{media_id}", json={"text": "review", "rating": 7}, headers=owner)
+    media_id = client.post(f"/groups/{group_id}/media/add-manual",
+                           json={"title": "group title", "media_type": 2, "image": "", "summary": "s"}, headers=owner).json()["id"]
+    for i in range(5):
+        client.post(f"/groups/{group_id}/media/{media_id}/review", json={"text": f"review {i}", "rating": i}, headers=member)
+        discussion_id = client.post(f"/groups/{group_id}/media/{media_id}/discussions/",
+                                    json={"title": f"discussion {i}", "content": "c"}, headers=owner).json()["id"]
+        for _ in range(3):
+            client.post(f"/discussions/{discussion_id}/comments/", json={"content": "comment"}, headers=member)
+    return {"owner": owner, "member": member, "group_id": group_id, "library": library,
+            "media_id": media_id, "discussion_id": discussion_id}
+
+@pytest.fixture
+def captured_sql():
+    """Collects `(statement, parameters)` of every SQL statement run while the test is active."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    yield statements
+    event.remove(engine, "before_cursor_execute", capture)
@@ -0,0 +1,58 @@
+"""Activity fan-out: every current member gets each event in their timeline, and only they do."""
+import pytest
+from sqlalchemy import select
+from app import crud, models
+from app.database import SessionLocal
+
+@pytest.fixture(scope="module")
+def group(client, login):
+    """A group of `owner`, `stays` and `leaves`; `outsider` owns a group of their own."""
+    users = {name: login(f"activity-{name}") for name in ("owner", "stays", "leaves", "outsider", "joins")}
+    group_id = client.post("/groups/create", json={"name": "activity", "description": "d"}, headers=users["owner"]).json()["id"]
+    for name in ("stays", "leaves"):
+        client.post(f"/groups/{group_id}/invite", json={"username": f"activity-{name}"}, headers=users["owner"])
+    client.post("/groups/create", json={"name": "elsewhere", "description": "d"}, headers=users["outsider"])
+    ids = {name: client.get("/info", headers=headers).json()["id"] for name, headers in users.items()}
+    return {"group_id": group_id, "headers": users, "ids": ids}
+
+def recipients(activity_id: int) -> set:
+    with SessionLocal() as db:
+        return set(db.scalars(select(models.TimelineEntry.user_id).where(models.TimelineEntry.id == activity_id)))
+
+def timeline(client, headers) -> list:
+    response = client.get("/activity", headers=headers)
+    assert response.status_code == 200
+    return [activity["id"] for activity in response.json()]
+
+def add_media(client, group, title: str, headers) -> int:
+    group_id = group["group_id"]
+    client.post(f"/groups/{group_id}/media/add-manual", json={"title": title, "media_type": 2}, headers=headers)
+    return client.get(f"/groups/{group_id}/activity", headers=headers).json()[0]["id"]
+
+def test_event_reaches_every_member_and_nobody_else(client, group):
+    ids, headers = group["ids"], group["headers"]
+    activity_id = add_media(client, group, "fan-out", headers["owner"])
+    assert recipients(activity_id) == {ids["owner"], ids["stays"], ids["leaves"]}
+    for name in ("owner", "stays", "leaves"):
+        assert timeline(client, headers[name])[0] == activity_id
+    assert activity_id not in timeline(client, headers["outsider"])
+
+def test_removed_member_stops_receiving_events(client, group):
+    ids, headers, group_id = group["ids"], group["headers"], group["group_id"]
+    before = add_media(client, group, "before leaving", headers["owner"])
+    response = client.delete(f"/groups/{group_id}/members/{ids['leaves']}", headers=headers["owner"])
+    assert response.status_code == 200
+    # 离开时清除该小组的全部条目，之后的动态不再分发给该用户
+    assert timeline(client, headers["leaves"]) == []
+    after = add_media(client, group, "after leaving", headers["stays"])
+    assert recipients(after) == {ids["owner"], ids["stays"]}
+    assert ids["leaves"] not in recipients(before)
+
+def test_new_member_gets_recent_events(client, group, monkeypatch):
+    headers, group_id = group["headers"], group["group_id"]
+    monkeypatch.setattr(crud, "TIMELINE_BACKFILL", 2)
+    latest = [activity["id"] for activity in client.get(f"/groups/{group_id}/activity", headers=headers["owner"]).json()]
+    client.post(f"/groups/{group_id}/invite", json={"username": "activity-joins"}, headers=headers["owner"])
+    assert timeline(client, headers["joins"]) == latest[:2]
+    activity_id = add_media(client, group, "after joining", headers["owner"])
+    assert group["ids"]["joins"] in recipients(activity_id)
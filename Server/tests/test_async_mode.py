@@ -0,0 +1,67 @@
+"""The async database mode (DATABASE_URL with an async driver).
+
+The mode is chosen when `app.database` is imported, so the suite runs in sync
+mode and `test_suite_in_async_mode` re-runs these tests and the media and
+auth routes in a subprocess with `TEST_ASYNC_DB=1`.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud, database
+
+ASYNC_SUITE = ["tests/test_async_mode.py", "tests/test_media_pages.py", "tests/test_bangumi_batch.py"]
+
+async_only = pytest.mark.skipif(not database.ASYNC_MODE, reason="runs in the TEST_ASYNC_DB=1 subprocess")
+
+@pytest.mark.skipif(database.ASYNC_MODE, reason="already in async mode")
+def test_suite_in_async_mode():
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", "-k", "not test_suite_in_async_mode", *ASYNC_SUITE],
+        cwd=Path(__file__).parent.parent, env=dict(os.environ, TEST_ASYNC_DB="1"),
+        capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout[-4000:] + result.stderr[-4000:]
+    # 异步专用的测试在子进程中确实执行了，没有被跳过
+    assert "skipped" not in result.stdout.splitlines()[-1], result.stdout[-2000:]
+
+@pytest.mark.parametrize("url, sync_url", [
+    ("sqlite+aiosqlite:///./app.db", "sqlite+pysqlite:///./app.db"),
+    ("postgresql+asyncpg://u:p@db/app", "postgresql+psycopg://u:p@db/app"),
+])
+def test_sync_url_for_async_drivers(monkeypatch, url, sync_url):
+    monkeypatch.delenv("DATABASE_SYNC_URL", raising=False)
+    assert database._sync_url_for(make_url(url)).render_as_string(hide_password=False) == sync_url
+
+def test_sync_url_override_and_unknown_driver(monkeypatch):
+    monkeypatch.setenv("DATABASE_SYNC_URL", "sqlite:///./other.db")
+    assert str(database._sync_url_for(make_url("mysql+aiomysql://db/app"))) == "sqlite:///./other.db"
+    monkeypatch.delenv("DATABASE_SYNC_URL")
+    with pytest.raises(RuntimeError, match="DATABASE_SYNC_URL"):
+        database._sync_url_for(make_url("mysql+aiomysql://db/app"))
+
+@async_only
+def test_sessions_are_async():
+    async def run():
+        async with database.async_session_scope() as db:
+            assert isinstance(db, AsyncSession)
+            # run_db 通过 run_sync 执行同步的 crud 函数
+            assert await database.run_db(db, crud.get_user, "nobody") is None
+            await database.close_db(db)
+            assert not db.in_transaction()
+    asyncio.run(run())
+    assert database.engine.url.drivername == "sqlite+pysqlite"
+
+@async_only
+def test_register_login_and_media_routes(client, login):
+    headers = login("async-mode")
+    assert client.get("/info", headers=headers).json()["username"] == "async-mode"
+    media_id = client.post("/media/add-manual", json={"title": "async", "media_type": 2}, headers=headers).json()["id"]
+    assert [item["id"] for item in client.get("/media/getAll", headers=headers).json()] == [media_id]
+    assert client.get(f"/media/get/{media_id}", headers=headers).json()[0]["title"] == "async"
+    assert client.delete(f"/media/delete/{media_id}", headers=headers).status_code == 200
+    assert client.get("/media/getAll", headers=headers).json() == []
@@ -0,0 +1,33 @@
+"""Batch import: the id cap, and a failed final write reported in the NDJSON stream."""
+from datetime import datetime
+import json
+from app import bangumi_api, crud_async, models
+from app.database import engine
+
+SUBJECTS = [{"bangumi_id": 910001 + i, "name": f"batch {i}", "name_cn": "", "media_type": 2, "image": "", "summary": ""}
+            for i in range(2)]
+
+def lines(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_too_many_ids_is_rejected(client, login):
+    ids = list(range(1, bangumi_api.BANGUMI_BATCH_MAX_IDS + 2))
+    response = client.post("/bangumi/add-batch", json=ids, headers=login("batch-cap"))
+    assert response.status_code == 422
+
+def test_failed_write_ends_with_an_error_line(client, login, monkeypatch):
+    # 条目已在本地表中，不访问 Bangumi
+    with engine.begin() as conn:
+        conn.execute(models.BangumiSubject.__table__.insert(), [dict(subject, fetched_at=datetime.utcnow()) for subject in SUBJECTS])
+    headers = login("batch-write")
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("database is gone")
+    monkeypatch.setattr(crud_async, "bulk_create_user_media", fail)
+    response = client.post("/bangumi/add-batch", json=[subject["bangumi_id"] for subject in SUBJECTS], headers=headers)
+    assert response.status_code == 200
+    assert [line["status"] for line in lines(response)] == ["fetched", "fetched", "error"]
+
+    monkeypatch.undo()
+    response = client.post("/bangumi/add-batch", json=[subject["bangumi_id"] for subject in SUBJECTS], headers=headers)
+    assert lines(response)[-1]["status"] == "done" and lines(response)[-1]["added"] == 2
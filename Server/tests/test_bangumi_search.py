@@ -0,0 +1,58 @@
+"""The Bangumi search cache: repeats are served locally until the TTL runs out."""
+from types import SimpleNamespace
+import httpx
+import pytest
+from app import bangumi_api, cache, metrics
+
+@pytest.fixture
+def upstream(monkeypatch):
+    # 本地替身：记录每次上游请求的 (关键词, 类型)，不访问网络
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        query, media_type = request.url.path.rsplit("/", 1)[-1], int(request.url.params["type"])
+        requested.append((query, media_type))
+        return httpx.Response(200, json={"list": [
+            {"id": len(requested), "name": f"{query} {media_type}", "type": media_type, "images": {"large": ""}, "summary": ""},
+        ]})
+
+    # 缓存的过期时间用假时钟；只替换 cache 模块引用的 time
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    bangumi_api.search_cache.clear()
+    bangumi_api.set_client(httpx.AsyncClient(base_url=bangumi_api.BANGUMI_BASE_URL, transport=httpx.MockTransport(handler)))
+    yield requested, clock
+    bangumi_api.set_client(None)
+    bangumi_api.search_cache.clear()
+
+def search(client, media_type: int, query: str) -> list:
+    response = client.get(f"/bangumi/search/{media_type}/{query}")
+    assert response.status_code == 200
+    return response.json()
+
+def test_repeat_query_is_served_from_the_cache(client, upstream):
+    requested, clock = upstream
+    hits, misses = metrics.get("bangumi.search.hits"), metrics.get("bangumi.search.misses")
+
+    first = search(client, 2, "mushishi")
+    assert search(client, 2, "mushishi") == first
+    assert requested == [("mushishi", 2)]
+    assert (metrics.get("bangumi.search.hits"), metrics.get("bangumi.search.misses")) == (hits + 1, misses + 1)
+
+    # 类型不同是另一个缓存项
+    assert search(client, 6, "mushishi")[0]["type"] == 6
+    assert requested == [("mushishi", 2), ("mushishi", 6)]
+
+    # 过期后重新请求上游
+    clock.now += bangumi_api.BANGUMI_SEARCH_CACHE_TTL + 1
+    assert search(client, 2, "mushishi")[0]["id"] == 3
+    assert requested[-1] == ("mushishi", 2)
+    assert metrics.get("bangumi.search.misses") == misses + 3
+
+def test_cache_metrics_are_exported(client, upstream, monkeypatch):
+    search(client, 2, "exported")
+    search(client, 2, "exported")
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "scrape-secret")
+    exported = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).json()
+    assert exported["bangumi.search.hits"] == metrics.get("bangumi.search.hits") >= 1
+    assert exported["bangumi.search.misses"] == metrics.get("bangumi.search.misses") >= 1
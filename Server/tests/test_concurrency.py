@@ -0,0 +1,86 @@
+"""SingleFlight coalescing and TokenBucket rate limiting."""
+import asyncio
+from types import SimpleNamespace
+import pytest
+from app import concurrency, metrics
+
+def test_concurrent_calls_share_one_result():
+    flight, calls = concurrency.SingleFlight("test.flight"), []
+    coalesced = metrics.get("test.flight.coalesced")
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": 1}
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", upstream) for _ in range(10)])
+
+    results = asyncio.run(run())
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert metrics.get("test.flight.coalesced") == coalesced + 9
+    # 结束后释放 key，下一次调用重新请求
+    asyncio.run(run())
+    assert calls == [1, 1]
+
+def test_concurrent_calls_share_one_exception():
+    flight, calls = concurrency.SingleFlight("test.flight"), []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", upstream) for _ in range(5)], return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert calls == [1]
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert not flight._inflight
+
+def test_cancelled_waiter_does_not_cancel_the_flight():
+    flight, finished = concurrency.SingleFlight("test.flight"), []
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "value"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("key", upstream))
+        second = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "value"
+    assert finished == [1]
+
+def test_token_bucket_holds_callers_to_the_rate(monkeypatch):
+    # 假时钟：sleep 只推进时间，立即返回
+    clock, real_sleep = [0.0], asyncio.sleep
+
+    async def sleep(seconds):
+        clock[0] += seconds
+        await real_sleep(0)
+
+    # 只替换 concurrency 模块引用的 time；改全局 time.monotonic 会让事件循环自己的计时失效
+    monkeypatch.setattr(concurrency, "time", SimpleNamespace(monotonic=lambda: clock[0]))
+    monkeypatch.setattr(concurrency.asyncio, "sleep", sleep)
+    # 间隔取 0.25 秒：浮点运算精确，假时钟不会因舍入停在差一点的位置
+    bucket = concurrency.TokenBucket(rate=4, capacity=2)
+
+    async def acquire():
+        await bucket.acquire()
+        return clock[0]
+
+    async def run():
+        return await asyncio.gather(*[acquire() for _ in range(12)])
+
+    times = sorted(asyncio.run(run()))
+    # 突发 2 个，之后每 0.25 秒一个
+    assert times == [0.0, 0.0] + [0.25 * i for i in range(1, 11)]
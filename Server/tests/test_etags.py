@@ -0,0 +1,26 @@
+"""Conditional GET of the versioned read endpoints.
+
+The gzip and identity representations share one ETag, so it must be weak,
+and every response (304 included) must vary on Accept-Encoding.
+"""
+import pytest
+
+@pytest.mark.parametrize("encoding", ["gzip", "identity"])
+def test_weak_etag_and_vary(client, seeded, encoding):
+    path = f"/groups/{seeded['group_id']}/media"
+    headers = {**seeded["owner"], "Accept-Encoding": encoding}
+    response = client.get(path, headers=headers)
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    assert response.headers["vary"] == "Accept-Encoding"
+
+    response = client.get(path, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.headers["vary"] == "Accept-Encoding"
+
+def test_strong_form_still_matches(client, seeded):
+    path = f"/groups/{seeded['group_id']}/media"
+    etag = client.get(path, headers=seeded["owner"]).headers["etag"]
+    response = client.get(path, headers={**seeded["owner"], "If-None-Match": etag.removeprefix("W/")})
+    assert response.status_code == 304
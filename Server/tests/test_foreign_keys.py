@@ -0,0 +1,17 @@
+"""With foreign_keys=ON, writes that reference a missing row return 404 instead of a database error."""
+
+def test_discussion_on_media_outside_the_group(client, login):
+    owner = login("fk-owner")
+    group_id = client.post("/groups/create", json={"name": "fk", "description": "d"}, headers=owner).json()["id"]
+    other_id = client.post("/groups/create", json={"name": "fk other", "description": "d"}, headers=owner).json()["id"]
+    media_id = client.post(f"/groups/{other_id}/media/add-manual", json={"title": "fk", "media_type": 2}, headers=owner).json()["id"]
+    for missing in (999999, media_id):
+        response = client.post(f"/groups/{group_id}/media/{missing}/discussions/",
+                               json={"title": "t", "content": "c"}, headers=owner)
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Media not found in this group"
+    assert client.get(f"/groups/{group_id}/activity", headers=owner).json() == []
+
+def test_review_on_missing_media(client, login):
+    response = client.post("/reviews/add/999999", json={"text": "t", "rating": 5}, headers=login("fk-reviewer"))
+    assert response.status_code == 404
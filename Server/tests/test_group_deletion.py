@@ -0,0 +1,89 @@
+"""Group deletion removes everything in the group, on both the synchronous and the background path."""
+from sqlalchemy import func, select
+from app import crud, deletion, models
+from app.database import SessionLocal
+
+def build_group(client, login, name: str) -> int:
+    """A group of two members with manual media, reviews, discussions, comments and their activities."""
+    owner, member = login(f"{name}-owner"), login(f"{name}-member")
+    group_id = client.post("/groups/create", json={"name": name, "description": "d"}, headers=owner).json()["id"]
+    client.post(f"/groups/{group_id}/invite", json={"username": f"{name}-member"}, headers=owner)
+    for i in range(3):
+        media_id = client.post(f"/groups/{group_id}/media/add-manual",
+                               json={"title": f"{name} {i}", "media_type": 2, "image": "", "summary": name}, headers=owner).json()["id"]
+        client.post(f"/groups/{group_id}/media/{media_id}/review", json={"text": "review", "rating": 6}, headers=member)
+        discussion_id = client.post(f"/groups/{group_id}/media/{media_id}/discussions/",
+                                    json={"title": "discussion", "content": "c"}, headers=owner).json()["id"]
+        for _ in range(2):
+            client.post(f"/discussions/{discussion_id}/comments/", json={"content": "comment"}, headers=member)
+    return group_id
+
+def counts(group_id: int) -> dict:
+    """Rows that belong to the group, plus rows anywhere whose parent no longer exists."""
+    media = select(models.GroupMedia.id).where(models.GroupMedia.group_id == group_id)
+    discussions = select(models.Discussion.id).where(models.Discussion.group_id == group_id)
+    queries = {
+        "media": select(func.count()).where(models.GroupMedia.group_id == group_id),
+        "reviews": select(func.count()).where(models.GroupReview.media_id.in_(media)),
+        "discussions": select(func.count()).where(models.Discussion.group_id == group_id),
+        "comments": select(func.count()).where(models.Comment.discussion_id.in_(discussions)),
+        "activities": select(func.count()).where(models.Activity.group_id == group_id),
+        "timeline": select(func.count()).where(models.TimelineEntry.group_id == group_id),
+        "members": select(func.count()).where(models.group_members.c.group_id == group_id),
+        "orphan reviews": select(func.count()).where(models.GroupReview.media_id.not_in(select(models.GroupMedia.id))),
+        "orphan comments": select(func.count()).where(models.Comment.discussion_id.not_in(select(models.Discussion.id))),
+        "orphan timeline": select(func.count()).where(models.TimelineEntry.id.not_in(select(models.Activity.id))),
+        "orphan catalog": select(func.count()).where(
+            models.MediaCatalog.bangumi_id.is_(None),
+            models.MediaCatalog.id.not_in(select(models.GroupMedia.catalog_id)),
+            models.MediaCatalog.id.not_in(select(models.UserMedia.catalog_id)),
+        ),
+    }
+    with SessionLocal() as db:
+        return {name: db.scalar(query) for name, query in queries.items()}
+
+EMPTY = dict.fromkeys([
+    "media", "reviews", "discussions", "comments", "activities", "timeline", "members",
+    "orphan reviews", "orphan comments", "orphan timeline", "orphan catalog",
+], 0)
+
+def group_row(group_id: int):
+    with SessionLocal() as db:
+        return db.get(models.Group, group_id)
+
+def test_small_group_is_deleted_at_once(client, login):
+    group_id = build_group(client, login, "delete-now")
+    before = counts(group_id)
+    assert before["media"] == 3 and before["reviews"] == 3 and before["comments"] == 6
+    assert before["activities"] > 0 and before["timeline"] > 0
+
+    owner = login("delete-now-owner")
+    assert client.delete(f"/groups/{group_id}", headers=login("delete-now-member")).status_code == 403
+    response = client.delete(f"/groups/{group_id}", headers=owner)
+    assert response.status_code == 200
+    assert counts(group_id) == EMPTY
+    assert group_row(group_id) is None
+
+def test_large_group_is_purged_in_the_background(client, login, monkeypatch):
+    group_id = build_group(client, login, "delete-later")
+    owner = login("delete-later-owner")
+    scheduled, purge_group = [], deletion.purge_group
+    monkeypatch.setattr(crud, "GROUP_DELETE_BACKGROUND_ROWS", 1)
+    monkeypatch.setattr(deletion, "GROUP_DELETE_BATCH", 2)
+    # 测试客户端在响应后同步执行后台任务；先拦下，检查中间状态
+    monkeypatch.setattr(deletion, "purge_group", scheduled.append)
+
+    response = client.delete(f"/groups/{group_id}", headers=owner)
+    assert response.status_code == 202
+    assert scheduled == [group_id]
+    assert group_row(group_id).deleted_at is not None
+    pending = counts(group_id)
+    assert pending["members"] == 0 and pending["media"] == 3 and pending["comments"] == 6
+    # 已标记删除的小组对所有人不可见
+    assert group_id not in {group["id"] for group in client.get("/groups/get", headers=owner).json()}
+
+    # 重启后 purge_deleted_groups 会接着删除所有已标记的小组
+    monkeypatch.setattr(deletion, "purge_group", purge_group)
+    deletion.purge_deleted_groups()
+    assert counts(group_id) == EMPTY
+    assert group_row(group_id) is None
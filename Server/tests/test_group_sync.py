@@ -0,0 +1,49 @@
+"""Syncing library media to a group: what is skipped, and what is returned."""
+from app import models
+from app.database import SessionLocal
+
+def group_media_ids(group_id: int) -> set:
+    with SessionLocal() as db:
+        return {media_id for media_id, in db.query(models.GroupMedia.id).filter(models.GroupMedia.group_id == group_id)}
+
+def test_sync_skips_what_the_group_has_and_returns_the_inserted_rows(client, login):
+    owner, other = login("sync-owner"), login("sync-other")
+    group_id = client.post("/groups/create", json={"name": "sync", "description": "d"}, headers=owner).json()["id"]
+
+    def add(title, headers=owner, **fields):
+        media = {"title": title, "media_type": 2, "image": "", "summary": "s", **fields}
+        return client.post("/media/add-manual", json=media, headers=headers).json()["id"]
+
+    library = {
+        "subject": add("subject", bangumi_id=930001),
+        "in group by subject": add("in group by subject", bangumi_id=930002),
+        "in group by catalog": add("in group by catalog"),
+        "twice 1": add("twice", bangumi_id=930003),
+        "twice 2": add("twice", bangumi_id=930003),
+        "manual": add("manual"),
+    }
+    not_mine = add("not mine", headers=other)
+
+    # 目录行相同：手动条目已经同步过一次
+    first = client.post(f"/groups/{group_id}/sync", json=[library["in group by catalog"]], headers=owner).json()
+    assert [media["title"] for media in first] == ["in group by catalog"]
+    # Bangumi 条目相同：小组里已有该条目（标题不同，所以目录行不同）
+    client.post(f"/groups/{group_id}/media", headers=owner, json={
+        "title": "added directly", "image": "", "summary": "s", "bangumi_id": 930002, "media_type": 2,
+    })
+
+    before = group_media_ids(group_id)
+    requested = list(library.values()) + [not_mine]
+    response = client.post(f"/groups/{group_id}/sync", json=requested, headers=owner)
+    assert response.status_code == 200
+    synced = response.json()
+    # 返回的恰好是新插入的行，按请求顺序；库中重复的同一条目只加一次，别人的条目不加
+    assert {media["id"] for media in synced} == group_media_ids(group_id) - before
+    assert [(media["title"], media["bangumi_id"]) for media in synced] == [
+        ("subject", 930001), ("twice", 930003), ("manual", None),
+    ]
+
+    # 再同步一次什么也不插入
+    after = group_media_ids(group_id)
+    assert client.post(f"/groups/{group_id}/sync", json=requested, headers=owner).json() == []
+    assert group_media_ids(group_id) == after
@@ -0,0 +1,95 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app import bangumi_api, images
+
+Image = pytest.importorskip("PIL.Image")
+
+COVER = "https://lain.bgm.tv/pic/cover/l/transparent.png"
+MOVED = "https://lain.bgm.tv/pic/cover/l/moved.jpg"
+GARBAGE = "https://lain.bgm.tv/pic/cover/l/garbage.jpg"
+LARGE = "https://lain.bgm.tv/pic/cover/l/large.jpg"
+CHUNKED = "https://lain.bgm.tv/pic/cover/l/chunked.jpg"
+
+
+def _png(mode: str, color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, (400, 200), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def upstream():
+    # 本地替身：记录请求过的 URL，不访问网络
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(str(request.url))
+        if str(request.url) == COVER:
+            return httpx.Response(200, content=_png("RGBA", (255, 0, 0, 0)), headers={"Content-Type": "image/png"})
+        if str(request.url) == MOVED:
+            return httpx.Response(302, headers={"Location": "http://169.254.169.254/latest/meta-data"})
+        if str(request.url) == GARBAGE:
+            return httpx.Response(200, content=b"not an image", headers={"Content-Type": "image/jpeg"})
+        if str(request.url) == LARGE:
+            return httpx.Response(200, content=b"x" * 4096, headers={"Content-Type": "image/jpeg"})
+        if str(request.url) == CHUNKED:
+            # 没有 Content-Length，只能边读边数
+            async def body():
+                for _ in range(4):
+                    yield b"x" * 1024
+            return httpx.Response(200, content=body(), headers={"Content-Type": "image/jpeg"})
+        return httpx.Response(404)
+
+    bangumi_api.set_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    yield requested
+    bangumi_api.set_client(None)
+
+
+def test_transparent_cover_is_flattened_onto_white(client, upstream):
+    response = client.get("/images/small", params={"src": COVER})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    thumbnail = Image.open(io.BytesIO(response.content))
+    assert thumbnail.size == (160, 80)
+    assert all(channel > 245 for channel in thumbnail.getpixel((80, 40)))
+
+    # 第二次从磁盘缓存读取，不再请求上游
+    assert client.get("/images/small", params={"src": COVER}).status_code == 200
+    assert upstream == [COVER]
+
+
+def test_redirect_to_disallowed_host_is_not_followed(client, upstream):
+    response = client.get("/images/small", params={"src": MOVED}, follow_redirects=False)
+    # 取不到缩略图时让浏览器加载原图，而不是代为请求重定向目标
+    assert response.status_code in (302, 307)
+    assert response.headers["location"] == MOVED
+    assert upstream == [MOVED]
+
+
+def test_disallowed_source_is_rejected(client, upstream):
+    response = client.get("/images/small", params={"src": "http://169.254.169.254/latest/meta-data"})
+    assert response.status_code == 400
+    assert upstream == []
+
+
+def test_undecodable_image_falls_back_and_is_not_cached(client, upstream):
+    for size in ("small", "medium"):
+        response = client.get(f"/images/{size}", params={"src": GARBAGE}, follow_redirects=False)
+        assert response.status_code in (302, 307)
+        assert response.headers["location"] == GARBAGE
+    # 坏的原图被删除，每次都重新下载
+    assert upstream == [GARBAGE, GARBAGE]
+    assert images._find_original(images._directory(GARBAGE)) is None
+
+
+@pytest.mark.parametrize("src", [LARGE, CHUNKED])
+def test_oversized_image_is_rejected(upstream, monkeypatch, src):
+    monkeypatch.setattr(bangumi_api, "BANGUMI_IMAGE_MAX_BYTES", 2048)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(bangumi_api.fetch_image(src, allow=images.is_cacheable))
+    assert error.value.status_code == 502
@@ -0,0 +1,75 @@
+"""Paging and streaming of GET /media/getAll."""
+import base64
+import json
+import pytest
+from app import crud, schemas
+from app.database import SessionLocal
+from app.pagination import NEXT_CURSOR_HEADER
+
+TITLES = ["beta", "alpha", "gamma", "alpha", "beta", "alpha", "gamma", "beta", "alpha", "beta", "gamma", "alpha"]
+
+@pytest.fixture(scope="module")
+def library(client, login):
+    """A library with repeated titles, so pages break inside a run of equal sort values."""
+    headers = login("pages")
+    items = [
+        client.post("/media/add-manual", json={"title": title, "media_type": 2}, headers=headers).json()
+        for title in TITLES
+    ]
+    return headers, items
+
+def pages(client, headers, limit: int = 5, **params) -> list:
+    """Every item of the paged endpoint, following the cursor to the last page."""
+    items, cursor = [], None
+    for _ in range(100):
+        response = client.get("/media/getAll", params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert response.status_code == 200
+        items += response.json()
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            # 最后一页不带游标
+            assert len(response.json()) <= limit
+            return items
+    raise AssertionError("cursor never ran out")
+
+@pytest.mark.parametrize("sort, key, reverse", [
+    (None, lambda item: item["id"], False),
+    ("-id", lambda item: item["id"], True),
+    ("title", lambda item: (item["title"], item["id"]), False),
+    ("-title", lambda item: (item["title"], item["id"]), True),
+])
+def test_walk_visits_every_row_once_in_order(client, library, sort, key, reverse):
+    headers, items = library
+    ids = [item["id"] for item in pages(client, headers, **({"sort": sort} if sort else {}))]
+    # 相同标题按 id 决胜，不跳过也不重复
+    assert ids == [item["id"] for item in sorted(items, key=key, reverse=reverse)]
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    base64.urlsafe_b64encode(b"{").decode(),
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    base64.urlsafe_b64encode(b'["alpha"]').decode(),
+    base64.urlsafe_b64encode(b'["alpha", "x"]').decode(),
+])
+def test_malformed_cursor_is_rejected(client, library, cursor):
+    headers, _ = library
+    response = client.get("/media/getAll", params={"sort": "title", "limit": 5, "cursor": cursor}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+def test_stream_matches_the_paged_endpoint(client, login):
+    headers = login("pages-stream")
+    user_id = client.get("/info", headers=headers).json()["id"]
+    # 超过 ndjson_response 的一批（500 行），覆盖跨批输出
+    media = [schemas.ManualMediaCreate(title=f"stream {i % 7}", media_type=2) for i in range(1200)]
+    with SessionLocal() as db:
+        crud.bulk_create_user_media(db, user_id, media)
+
+    for sort in ("id", "-title"):
+        response = client.get("/media/getAll", params={"stream": "true", "sort": sort}, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = response.text.splitlines()
+        streamed = [schemas.UserMedia.model_validate_json(line) for line in lines]
+        assert len(streamed) == 1200
+        assert [json.loads(line) for line in lines] == pages(client, headers, limit=500, sort=sort)
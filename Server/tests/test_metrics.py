@@ -0,0 +1,19 @@
+from app import metrics
+
+
+def test_metrics_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
+
+
+def test_metrics_requires_token(client, login, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    # 普通用户的访问令牌不能代替监控令牌
+    assert client.get("/metrics", headers=login("metrics")).status_code == 401
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert isinstance(response.json(), dict)
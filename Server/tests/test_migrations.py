@@ -0,0 +1,135 @@
+"""Upgrades of older databases: media moved to the shared catalog, rating aggregates backfilled, duplicate memberships removed."""
+import pytest
+from sqlalchemy import Column, Index, MetaData, String, Table, create_engine, inspect, text
+from app import migrations
+from app.database import Base
+
+def legacy_table(table: Table, metadata: MetaData) -> Table:
+    """`table` as it was before media_catalog: no catalog_id, image and summary on the row."""
+    columns = [
+        Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+               server_default=column.server_default.arg if column.server_default is not None else None)
+        for column in table.columns if column.name != "catalog_id"
+    ]
+    indexes = [
+        Index(index.name, *[column.name for column in index.columns])
+        for index in table.indexes if "catalog_id" not in index.columns
+    ]
+    return Table(table.name, metadata, *columns, Column("image", String), Column("summary", String), *indexes)
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    current = [table for table in Base.metadata.sorted_tables if table.name not in migrations.CATALOG_TABLES]
+    Base.metadata.create_all(engine, tables=current)
+    legacy = MetaData()
+    for name in migrations.CATALOG_TABLES:
+        legacy_table(Base.metadata.tables[name], legacy)
+    legacy.create_all(engine)
+    yield engine
+    engine.dispose()
+
+def media(bangumi_id, title, image, summary):
+    return {"bangumi_id": bangumi_id, "title": title, "media_type": 2, "image": image, "summary": summary}
+
+def test_upgrade_moves_media_to_catalog(legacy_engine):
+    user_media = [
+        media(1, "shared", "a.jpg", "same"),          # 1、2 和小组的 1 共用一行
+        media(1, "shared", "a.jpg", "same"),
+        media(1, "shared", "custom.jpg", "same"),     # 换了图片
+        media(2, "other", "b.jpg", "edited"),
+        media(None, "manual", "m.jpg", "notes"),
+    ]
+    group_media = [
+        media(1, "shared", "a.jpg", "same"),
+        media(2, "other", "b.jpg", "original"),       # 简介不同
+        media(None, "manual", "m.jpg", "notes"),      # 同步到小组的手动条目副本
+    ]
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO user_media (user_id, bangumi_id, title, media_type, image, summary) "
+                          "VALUES (1, :bangumi_id, :title, :media_type, :image, :summary)"), user_media)
+        conn.execute(text("INSERT INTO group_media (group_id, bangumi_id, title, media_type, image, summary) "
+                          "VALUES (1, :bangumi_id, :title, :media_type, :image, :summary)"), group_media)
+
+    migrations.upgrade(legacy_engine)
+
+    query = ("SELECT t.id, t.catalog_id, c.bangumi_id, c.image, c.summary "
+             "FROM {} t JOIN media_catalog c ON c.id = t.catalog_id ORDER BY t.id")
+    with legacy_engine.connect() as conn:
+        users = conn.execute(text(query.format("user_media"))).all()
+        groups = conn.execute(text(query.format("group_media"))).all()
+        catalog = conn.execute(text("SELECT COUNT(*) FROM media_catalog")).scalar()
+        for table in migrations.CATALOG_TABLES:
+            columns = {column["name"] for column in inspect(conn).get_columns(table)}
+            assert not columns & set(migrations.CATALOG_LEGACY_COLUMNS)
+
+    # 每行的图片和简介都不变
+    assert [(row.image, row.summary) for row in users] == [(m["image"], m["summary"]) for m in user_media]
+    assert [(row.image, row.summary) for row in groups] == [(m["image"], m["summary"]) for m in group_media]
+    # 同一 Bangumi 条目内容相同时共用带 bangumi_id 的行
+    assert users[0].catalog_id == users[1].catalog_id == groups[0].catalog_id
+    assert users[0].bangumi_id == 1
+    # 图片或简介不同的条目各有自己的行，不占用 bangumi_id
+    assert users[2].catalog_id not in (users[0].catalog_id, users[3].catalog_id)
+    assert users[2].bangumi_id is None
+    assert groups[1].catalog_id != users[3].catalog_id
+    # 内容相同的手动条目共用一行
+    assert users[4].catalog_id == groups[2].catalog_id
+    assert catalog == 5
+
+    # 再次升级不做任何改动
+    migrations.upgrade(legacy_engine)
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text(query.format("user_media"))).all() == users
+        assert conn.execute(text(query.format("group_media"))).all() == groups
+        assert conn.execute(text("SELECT COUNT(*) FROM media_catalog")).scalar() == catalog
+
+def test_upgrade_removes_duplicate_memberships(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/members.db")
+    members = Base.metadata.tables["group_members"]
+    Base.metadata.create_all(engine, tables=[table for table in Base.metadata.sorted_tables if table is not members])
+    # 唯一索引出现之前的成员表，可能有重复行
+    legacy = MetaData()
+    Table("group_members", legacy, *[Column(column.name, column.type) for column in members.columns])
+    legacy.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO group_members (group_id, user_id) VALUES (:g, :u)"),
+                     [{"g": 1, "u": 1}, {"g": 1, "u": 1}, {"g": 1, "u": 1}, {"g": 1, "u": 2}, {"g": 2, "u": 1}])
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT group_id, user_id FROM group_members ORDER BY group_id, user_id")).all()
+    assert rows == [(1, 1), (1, 2), (2, 1)]
+    assert "uq_group_members_group_user" in {index["name"] for index in inspect(engine).get_indexes("group_members")}
+    engine.dispose()
+
+def test_upgrade_backfills_rating_aggregates(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/ratings.db")
+    aggregate_tables = [Base.metadata.tables[name] for name in migrations.RATING_AGGREGATE_TABLES]
+    Base.metadata.create_all(engine, tables=[table for table in Base.metadata.sorted_tables if table not in aggregate_tables])
+    # 评分汇总列出现之前的媒体表
+    legacy = MetaData()
+    for table in aggregate_tables:
+        Table(table.name, legacy, *[
+            Column(column.name, column.type, primary_key=column.primary_key)
+            for column in table.columns if column.name != "review_count" and not column.name.startswith("rating_")
+        ])
+    legacy.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user_media (id, user_id, title, media_type) VALUES (1, 1, 'a', 2), (2, 1, 'b', 2)"))
+        conn.execute(text("INSERT INTO group_media (id, group_id, title, media_type) VALUES (1, 1, 'a', 2)"))
+        conn.execute(text("INSERT INTO reviews (user_id, media_id, text, rating) VALUES (:user, 1, 't', :rating)"),
+                     [{"user": 1, "rating": 3}, {"user": 2, "rating": 10}, {"user": 3, "rating": None}])
+        conn.execute(text("INSERT INTO group_reviews (user_id, media_id, text, rating) VALUES (:user, 1, 't', :rating)"),
+                     [{"user": 1, "rating": 0}, {"user": 2, "rating": 0}])
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as conn:
+        users = conn.execute(text("SELECT id, review_count, rating_sum, rating_3, rating_10 FROM user_media ORDER BY id")).all()
+        groups = conn.execute(text("SELECT id, review_count, rating_sum, rating_0 FROM group_media")).all()
+    # 没有评分的评论不计入；没有评论的媒体保持 0
+    assert users == [(1, 2, 13, 1, 1), (2, 0, 0, 0, 0)]
+    assert groups == [(1, 2, 0, 2)]
+    engine.dispose()
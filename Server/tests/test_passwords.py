@@ -0,0 +1,29 @@
+"""Password hashing in the worker process pool."""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+import asyncio
+import multiprocessing
+import os
+import pytest
+from app import passwords
+
+def broken_pool(executor: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    # 模拟工作进程被杀死（OOM、段错误）：进程异常退出后整个池失效
+    with pytest.raises(BrokenProcessPool):
+        executor.submit(os._exit, 1).result()
+    return executor
+
+def test_login_after_worker_died(client, login):
+    login("pool")
+    broken_pool(passwords._get_executor())
+    response = client.post("/token", data={"username": "pool", "password": "password"})
+    assert response.status_code == 200
+
+def test_pool_that_keeps_breaking_returns_503(monkeypatch):
+    broken = broken_pool(ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")))
+    monkeypatch.setattr(passwords, "_get_executor", lambda: broken)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(passwords.hash_password("password"))
+    assert error.value.status_code == 503
+    assert passwords._pending == 0
@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from app import crud, metrics, pubsub, schemas
+
+
+def test_rename_invalidates_cached_user(client, login):
+    headers = login("cache-before")
+    user_id = client.get("/info", headers=headers).json()["id"]
+    assert crud.user_cache.get(user_id).username == "cache-before"
+
+    response = client.put("/update", json={"username": "cache-after"}, headers=headers)
+    assert response.status_code == 200
+    assert crud.user_cache.get(user_id) is None
+    # 旧 token 指向的用户名已不存在
+    assert client.get("/info", headers=headers).status_code == 401
+
+
+def test_stale_entry_never_resolves_to_another_user(client, login):
+    headers = login("stale-before")
+    user = client.get("/info", headers=headers).json()
+    client.put("/update", json={"username": "stale-after"}, headers=headers)
+    # 模拟没有收到失效通知的 worker：缓存里仍是改名前的用户
+    crud.user_cache.set(user["id"], schemas.User(**user))
+
+    # 新用户注册了旧用户名，得到的是自己的身份
+    client.post("/register", json={"username": "stale-before", "email": "newcomer@example.com", "password": "password"})
+    newcomer = client.get("/info", headers=login("stale-before")).json()
+    assert newcomer["id"] != user["id"]
+    # 改名后的新 token 与缓存的用户名不符，重新查询而不是拒绝
+    renamed = login("stale-after")
+    assert client.get("/info", headers=renamed).json()["username"] == "stale-after"
+
+
+def test_invalidation_from_another_worker():
+    user = schemas.User(id=-1, username="remote-worker", email="remote@example.com")
+    crud.user_cache.set(-1, user)
+    # Redis 监听循环收到的是 SSE 帧，解析后交给处理函数
+    frame = pubsub.sse_frame("invalidate", [-1])
+    pubsub.broker._handle(pubsub.USER_CACHE_CHANNEL, *pubsub._frame_event(frame))
+    assert crud.user_cache.get(-1) is None
+
+    crud.user_cache.set(-1, user)
+    pubsub.publish(pubsub.USER_CACHE_CHANNEL, "invalidate", [-1])
+    assert crud.user_cache.get(-1) is None
+
+
+def collect(subscription, replay=(), after=None) -> list:
+    async def read():
+        return [frame async for frame in pubsub.sse_response(subscription, replay, after).body_iterator]
+    return asyncio.run(read())
+
+
+def test_publish_reaches_subscribers_of_the_channel():
+    broker = pubsub.Broker()
+
+    async def run():
+        listening, other = broker.subscribe("channel"), broker.subscribe("other")
+        broker.publish("channel", "comment", {"id": 1}, event_id=1)
+        # 发布方在线程池中时，经 call_soon_threadsafe 回到事件循环投递
+        await asyncio.to_thread(broker.publish, "channel", "comment", {"id": 2}, 2)
+        frames = [await asyncio.wait_for(listening.queue.get(), 1) for _ in range(2)]
+        assert other.queue.empty()
+        broker.unsubscribe(listening)
+        broker.publish("channel", "comment", {"id": 3}, event_id=3)
+        assert listening.queue.empty()
+        return frames
+
+    assert asyncio.run(run()) == [
+        pubsub.sse_frame("comment", {"id": 1}, 1),
+        pubsub.sse_frame("comment", {"id": 2}, 2),
+    ]
+
+
+def test_slow_subscriber_is_disconnected(monkeypatch):
+    monkeypatch.setattr(pubsub, "PUBSUB_QUEUE_SIZE", 2)
+    broker = pubsub.Broker()
+    overflows = metrics.get("pubsub.overflows")
+
+    async def run():
+        slow, fast = broker.subscribe("channel"), broker.subscribe("channel")
+        received = []
+        for event_id in range(1, 4):
+            broker.publish("channel", "comment", {"id": event_id}, event_id=event_id)
+            received.append(fast.queue.get_nowait())
+        return slow, received
+
+    slow, received = asyncio.run(run())
+    # 积压超过上限：丢弃积压并结束流，客户端带 Last-Event-ID 重连补齐
+    assert slow.closed and slow.queue.get_nowait() is None and slow.queue.empty()
+    assert metrics.get("pubsub.overflows") == overflows + 1
+    assert [pubsub._frame_id(frame) for frame in received] == [1, 2, 3]
+
+
+def test_replay_comes_first_and_duplicates_are_skipped():
+    async def subscribe():
+        return pubsub.subscribe("replay")
+    subscription = asyncio.run(subscribe())
+    replay = [pubsub.sse_frame("comment", {"id": event_id}, event_id) for event_id in (1, 2)]
+    # 订阅之后、补发查询之前提交的评论 2 也进入了队列
+    for event_id in (2, 3):
+        subscription.queue.put_nowait(pubsub.sse_frame("comment", {"id": event_id}, event_id))
+    subscription.queue.put_nowait(None)
+
+    frames = collect(subscription, replay, after=2)
+    assert [pubsub._frame_id(frame) for frame in frames] == [1, 2, 3]
+    assert "replay" not in pubsub.broker._subscribers
+
+
+def end_stream_after(channel: str, live: list):
+    """From another thread: wait for the stream to subscribe, publish `live`, then end the stream."""
+    def run():
+        deadline = time.monotonic() + 5
+        while not pubsub.broker._subscribers.get(channel) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        subscription, = pubsub.broker._subscribers[channel]
+        for frame in live:
+            pubsub.publish(channel, *frame)
+        # 与投递一样经 call_soon_threadsafe 入队，排在已发布的事件之后
+        pubsub.broker._loop.call_soon_threadsafe(subscription.queue.put_nowait, None)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_stream_replays_after_last_event_id(client, login):
+    owner = login("events-owner")
+    group_id = client.post("/groups/create", json={"name": "events", "description": "d"}, headers=owner).json()["id"]
+    media_id = client.post(f"/groups/{group_id}/media/add-manual", json={"title": "events", "media_type": 2}, headers=owner).json()["id"]
+    discussion_id = client.post(f"/groups/{group_id}/media/{media_id}/discussions/",
+                                json={"title": "events", "content": "c"}, headers=owner).json()["id"]
+    comments = [client.post(f"/discussions/{discussion_id}/comments/", json={"content": f"comment {i}"}, headers=owner).json()
+                for i in range(3)]
+
+    channel = pubsub.discussion_channel(discussion_id)
+    live = [("comment", comments[2], comments[2]["id"]), ("comment", {"id": comments[2]["id"] + 1000}, comments[2]["id"] + 1000)]
+    thread = end_stream_after(channel, live)
+    response = client.get(f"/discussions/{discussion_id}/events",
+                          headers={**owner, "Last-Event-ID": str(comments[0]["id"])})
+    thread.join()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    ids = [int(line[4:]) for line in response.text.splitlines() if line.startswith("id: ")]
+    # 补发 Last-Event-ID 之后的两条评论；实时流中重复的那条跳过
+    assert ids == [comments[1]["id"], comments[2]["id"], comments[2]["id"] + 1000]
+
+
+class RecordingPublisher:
+    """Stands in for the redis.asyncio client: records what would be sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def publish(self, channel, frame):
+        self.sent.append((channel, pubsub._frame_id(frame)))
+
+    async def aclose(self):
+        pass
+
+
+def test_redis_publish_is_queued_and_sent_from_the_event_loop(monkeypatch):
+    monkeypatch.setattr(pubsub, "PUBSUB_QUEUE_SIZE", 2)
+    # 创建客户端不会连接 Redis
+    broker = pubsub.RedisBroker("redis://localhost:1")
+    broker._publisher = RecordingPublisher()
+    dropped = metrics.get("pubsub.publish_dropped")
+
+    async def run():
+        broker._loop = asyncio.get_running_loop()
+        # 发布方在线程池中：只排队，不等待网络
+        await asyncio.to_thread(broker.publish, "channel", "comment", {"id": 1}, 1)
+        broker.publish("channel", "comment", {"id": 2}, event_id=2)
+        broker.publish("channel", "comment", {"id": 3}, event_id=3)
+        broker._tasks = [asyncio.create_task(broker._send())]
+        while broker._outbox.qsize():
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await broker.stop()
+
+    asyncio.run(run())
+    assert broker._publisher.sent == [(pubsub.PUBSUB_CHANNEL_PREFIX + "channel", 1), (pubsub.PUBSUB_CHANNEL_PREFIX + "channel", 2)]
+    assert metrics.get("pubsub.publish_dropped") == dropped + 1
@@ -0,0 +1,69 @@
+"""Rating aggregates on user and group media stay equal to a recount of the review rows."""
+from sqlalchemy import func
+from app import models
+from app.database import SessionLocal
+
+def recount(review_model, media_id: int) -> dict:
+    with SessionLocal() as db:
+        ratings = [rating for rating, in db.query(review_model.rating).filter(review_model.media_id == media_id)]
+        count, total = db.query(func.count(review_model.id), func.coalesce(func.sum(review_model.rating), 0)) \
+                         .filter(review_model.media_id == media_id).one()
+    expected = {"review_count": count, "rating_sum": total}
+    for bucket in range(models.RATING_BUCKETS):
+        expected[f"rating_{bucket}"] = sum(models.rating_bucket(rating) == bucket for rating in ratings)
+    return expected
+
+def stored(media_model, media_id: int) -> dict:
+    names = ["review_count", "rating_sum"] + [f"rating_{bucket}" for bucket in range(models.RATING_BUCKETS)]
+    with SessionLocal() as db:
+        row = db.get(media_model, media_id)
+        return {name: getattr(row, name) for name in names}
+
+def assert_consistent(media_model, review_model, media_id: int) -> dict:
+    values = stored(media_model, media_id)
+    assert values == recount(review_model, media_id)
+    return values
+
+def test_library_reviews(client, login):
+    first, second = login("rating-first"), login("rating-second")
+    media_id = client.post("/media/add-manual", json={"title": "rated", "media_type": 2}, headers=first).json()["id"]
+    reviews = [
+        client.post(f"/reviews/add/{media_id}", json={"text": "t", "rating": rating}, headers=headers).json()["id"]
+        for rating, headers in ((7.5, first), (3, second))
+    ]
+    values = assert_consistent(models.UserMedia, models.Review, media_id)
+    assert values["review_count"] == 2 and values["rating_7"] == 1 and values["rating_3"] == 1
+
+    # 跨桶改分：旧桶减一，新桶加一
+    client.put(f"/reviews/update/{reviews[0]}", json={"rating": 8}, headers=first)
+    values = assert_consistent(models.UserMedia, models.Review, media_id)
+    assert values["rating_7"] == 0 and values["rating_8"] == 1 and values["rating_sum"] == 11
+    # 只改正文不动汇总
+    client.put(f"/reviews/update/{reviews[1]}", json={"text": "edited", "rating": 3}, headers=second)
+    assert assert_consistent(models.UserMedia, models.Review, media_id) == values
+
+    client.delete(f"/reviews/delete/{reviews[0]}", headers=first)
+    values = assert_consistent(models.UserMedia, models.Review, media_id)
+    assert values["review_count"] == 1 and values["rating_8"] == 0
+    client.delete(f"/reviews/delete/{reviews[1]}", headers=second)
+    assert assert_consistent(models.UserMedia, models.Review, media_id)["review_count"] == 0
+
+def test_group_reviews(client, login):
+    owner, member = login("rating-owner"), login("rating-member")
+    group_id = client.post("/groups/create", json={"name": "rating", "description": "d"}, headers=owner).json()["id"]
+    client.post(f"/groups/{group_id}/invite", json={"username": "rating-member"}, headers=owner)
+    media_id = client.post(f"/groups/{group_id}/media/add-manual", json={"title": "rated", "media_type": 2}, headers=owner).json()["id"]
+    reviews = [
+        client.post(f"/groups/{group_id}/media/{media_id}/review", json={"text": "t", "rating": rating}, headers=headers).json()["id"]
+        for rating, headers in ((10, owner), (0, member))
+    ]
+    values = assert_consistent(models.GroupMedia, models.GroupReview, media_id)
+    assert values["rating_10"] == 1 and values["rating_0"] == 1
+
+    client.put(f"/groups/{group_id}/reviews/update/{reviews[0]}", json={"rating": 9}, headers=owner)
+    values = assert_consistent(models.GroupMedia, models.GroupReview, media_id)
+    assert values["rating_10"] == 0 and values["rating_9"] == 1 and values["rating_sum"] == 9
+
+    client.delete(f"/groups/{group_id}/reviews/{reviews[1]}", headers=member)
+    values = assert_consistent(models.GroupMedia, models.GroupReview, media_id)
+    assert values["review_count"] == 1 and values["rating_0"] == 0
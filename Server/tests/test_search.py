@@ -0,0 +1,98 @@
+"""Local search: the index follows every write, and results stay within what the caller can see."""
+import pytest
+from app import models
+from app.database import SessionLocal
+
+@pytest.fixture(scope="module")
+def group(client, login):
+    """A group of `author` and `member` with one media entry; `outsider` is in no group."""
+    author, member, outsider = login("search-author"), login("search-member"), login("search-outsider")
+    group_id = client.post("/groups/create", json={"name": "search group", "description": "d"}, headers=author).json()["id"]
+    client.post(f"/groups/{group_id}/invite", json={"username": "search-member"}, headers=author)
+    media_id = client.post(f"/groups/{group_id}/media/add-manual",
+                           json={"title": "group title", "media_type": 2, "image": "", "summary": "s"}, headers=author).json()["id"]
+    return {"author": author, "member": member, "outsider": outsider, "group_id": group_id, "media_id": media_id}
+
+@pytest.fixture
+def hits(client):
+    def hits(query: str, headers: dict, **params) -> set:
+        response = client.get("/search/", params={"q": query, **params}, headers=headers)
+        assert response.status_code == 200
+        return {(hit["kind"], hit["id"]) for hit in response.json()}
+    return hits
+
+def update_row(model, row_id: int, **values):
+    # 讨论和评论没有编辑接口；索引由触发器维护，直接改行也要同步
+    db = SessionLocal()
+    db.query(model).filter(model.id == row_id).update(values)
+    db.commit()
+    db.close()
+
+def test_library_review_follows_writes(client, group, hits):
+    author = group["author"]
+    media_id = client.post("/media/add-manual", json={"title": "library title", "media_type": 2}, headers=author).json()["id"]
+    review_id = client.post(f"/reviews/add/{media_id}", json={"text": "zanzibar", "rating": 8}, headers=author).json()["id"]
+    assert hits("zanzibar", author) == {("review", review_id)}
+    # 个人数据对其他用户不可见，即使同在一个小组
+    assert hits("zanzibar", group["member"]) == set()
+
+    client.put(f"/reviews/update/{review_id}", json={"text": "quokka", "rating": 8}, headers=author)
+    assert hits("zanzibar", author) == set()
+    assert hits("quokka", author) == {("review", review_id)}
+
+    client.delete(f"/reviews/delete/{review_id}", headers=author)
+    assert hits("quokka", author) == set()
+
+def test_group_review_follows_writes(client, group, hits):
+    group_id, media_id, member = group["group_id"], group["media_id"], group["member"]
+    review_id = client.post(f"/groups/{group_id}/media/{media_id}/review", json={"text": "axolotl", "rating": 6}, headers=member).json()["id"]
+    assert hits("axolotl", group["author"]) == {("group_review", review_id)}
+
+    client.put(f"/groups/{group_id}/reviews/update/{review_id}", json={"text": "narwhal", "rating": 6}, headers=member)
+    assert hits("axolotl", member) == set()
+    assert hits("narwhal", member) == {("group_review", review_id)}
+
+    client.delete(f"/groups/{group_id}/reviews/{review_id}", headers=member)
+    assert hits("narwhal", member) == set()
+
+def test_discussion_and_comment_follow_writes(client, group, hits):
+    group_id, media_id, author, member = group["group_id"], group["media_id"], group["author"], group["member"]
+    discussion_id = client.post(f"/groups/{group_id}/media/{media_id}/discussions/",
+                                json={"title": "marmalade", "content": "thread"}, headers=author).json()["id"]
+    comment_id = client.post(f"/discussions/{discussion_id}/comments/", json={"content": "pangolin"}, headers=member).json()["id"]
+    assert hits("marmalade", member) == {("discussion", discussion_id)}
+    assert hits("pangolin", author) == {("comment", comment_id)}
+
+    update_row(models.Discussion, discussion_id, title="gooseberry")
+    update_row(models.Comment, comment_id, content="wombat")
+    assert hits("marmalade", member) == set()
+    assert hits("pangolin", member) == set()
+    assert hits("gooseberry", member) == {("discussion", discussion_id)}
+    assert hits("wombat", member, group_id=group_id) == {("comment", comment_id)}
+
+    # 删除讨论时连同评论一起批量删除，索引也要一起清掉
+    client.delete(f"/discussions/{discussion_id}", headers=author)
+    assert hits("gooseberry", author) == set()
+    assert hits("wombat", author) == set()
+
+def test_non_member_cannot_see_group_content(client, group, hits):
+    group_id, media_id, author, outsider = group["group_id"], group["media_id"], group["author"], group["outsider"]
+    discussion_id = client.post(f"/groups/{group_id}/media/{media_id}/discussions/",
+                                json={"title": "tamarind", "content": "okapi"}, headers=author).json()["id"]
+    comment_id = client.post(f"/discussions/{discussion_id}/comments/", json={"content": "okapi"}, headers=author).json()["id"]
+    assert hits("okapi", author) == {("discussion", discussion_id), ("comment", comment_id)}
+
+    assert hits("tamarind", outsider) == set()
+    assert hits("okapi", outsider) == set()
+    assert hits("okapi", outsider, kind=["discussion", "comment"]) == set()
+    response = client.get("/search/", params={"q": "okapi", "group_id": group_id}, headers=outsider)
+    assert response.status_code == 403
+
+def test_own_title_of_a_shared_subject_is_searchable(client, login, hits):
+    # 同一 Bangumi 条目，两个用户各自起了标题；标题不同就不共用目录行
+    first, second = login("search-title-first"), login("search-title-second")
+    media = {"bangumi_id": 920001, "media_type": 2, "image": "", "summary": "s"}
+    first_id = client.post("/media/add-manual", json=dict(media, title="pangolin"), headers=first).json()["id"]
+    second_id = client.post("/media/add-manual", json=dict(media, title="narwhal"), headers=second).json()["id"]
+    assert hits("pangolin", first) == {("user_media", first_id)}
+    assert hits("narwhal", second) == {("user_media", second_id)}
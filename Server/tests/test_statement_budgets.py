@@ -0,0 +1,46 @@
+"""SQL statement budgets of the list and detail endpoints.
+
+Each endpoint must run a fixed number of statements however many rows it
+returns; the seeded data has several rows per list, so an N+1 query (one
+extra SELECT per discussion, comment or review) exceeds the budget.
+"""
+import pytest
+from app import querycount
+from app.database import engine
+
+# 当前每个接口执行的语句数（含成员校验和 ETag 版本查询）；优化后可以调低，不要调高
+BUDGETS = [
+    ("/media/getAll", 1),
+    ("/media/getAll?limit=2", 1),
+    ("/media/get/{library_media_id}", 1),
+    ("/reviews/media/{library_media_id}", 2),
+    ("/reviews/users/me", 1),
+    ("/groups/get", 1),
+    ("/groups/{group_id}", 2),
+    ("/groups/{group_id}/media", 3),
+    ("/groups/{group_id}/media/{media_id}", 2),
+    ("/groups/{group_id}/media/{media_id}/reviews", 3),
+    ("/groups/{group_id}/media/{media_id}/discussions/", 2),
+    ("/discussions/{discussion_id}", 3),
+    ("/discussions/{discussion_id}/comments/", 3),
+    ("/groups/{group_id}/media/{media_id}/page", 4),
+    # 详情页实际使用的组合（GroupMediaDetailPage）：不查讨论
+    ("/groups/{group_id}/media/{media_id}/page?fields=media&fields=reviews", 3),
+    ("/groups/{group_id}/members", 2),
+    ("/groups/{group_id}/activity", 2),
+    ("/activity", 1),
+]
+
+@pytest.fixture(scope="module", autouse=True)
+def tracked_engine():
+    querycount.track_statements(engine)
+    yield
+    querycount.untrack_statements(engine)
+
+@pytest.mark.parametrize("path, budget", BUDGETS, ids=[path for path, _ in BUDGETS])
+def test_endpoint_statement_budget(client, seeded, path, budget):
+    path = path.format(library_media_id=seeded["library"][0], **seeded)
+    with querycount.count_statements() as counter:
+        response = client.get(path, headers=seeded["owner"])
+    assert response.status_code == 200
+    assert counter[0] <= budget, f"{path} ran {counter[0]} SQL statements (budget {budget})"
@@ -0,0 +1,93 @@
+"""Title n-grams and the typeahead stages: prefix, then substring, then fuzzy."""
+from datetime import datetime
+import sqlite3
+import pytest
+from app import models, ngrams, search
+from app.database import engine
+
+ATTACK = {"bangumi_id": 900001, "name": "進撃の巨人", "name_cn": "进击的巨人"}
+BEBOP = {"bangumi_id": 900002, "name": "Cowboy Bebop", "name_cn": "星际牛仔"}
+BOYS = {"bangumi_id": 900003, "name": "Bebop Cowboys", "name_cn": ""}
+
+def test_match_queries_cjk_partial_title():
+    queries = ngrams.match_queries("巨人")
+    assert queries["substring"] == '"巨人"'
+    assert queries["prefix"] == '"_巨人" AND "巨人"'
+    # 标题中间的部分能在索引里找到
+    assert "巨人" in ngrams.title_grams("進撃の巨人").split()
+
+def test_match_queries_normalizes_full_width_and_case():
+    assert ngrams.match_queries("ＣＯＷＢＯＹ　Ｂｅｂ") == ngrams.match_queries("cowboy beb")
+    assert ngrams.match_queries("cowboy beb")["prefix"] == '"_cowboy" AND "cowboy" AND "beb"*'
+
+def test_match_queries_quotes_user_input():
+    assert ngrams.match_queries('"a" OR NEAR(b')["substring"] == '"a" AND "or" AND "near" AND "b"*'
+    assert ngrams.match_queries("!? —") == {}
+
+def test_similarity_ranks_prefix_then_substring_then_near_miss():
+    prefix = ngrams.similarity("cowboy", "Cowboy Bebop")
+    substring = ngrams.similarity("bebop", "Cowboy Bebop")
+    near_miss = ngrams.similarity("cowbyo", "Cowboy Bebop")
+    unrelated = ngrams.similarity("cowbyo", "进击的巨人")
+    assert prefix > substring > near_miss >= search.TYPEAHEAD_MIN_SIMILARITY > unrelated
+    assert ngrams.similarity("ＣＯＷＢＯＹ", "Cowboy Bebop") == prefix
+
+def test_similarity_tolerates_one_wrong_cjk_character():
+    assert ngrams.similarity("进军的巨", "进击的巨人") >= search.TYPEAHEAD_MIN_SIMILARITY
+
+@pytest.fixture(scope="module")
+def subjects():
+    with engine.begin() as conn:
+        conn.execute(models.BangumiSubject.__table__.insert(), [
+            dict(subject, media_type=2, image="", summary="", fetched_at=datetime.utcnow())
+            for subject in (ATTACK, BEBOP, BOYS)
+        ])
+
+@pytest.fixture(scope="module")
+def suggest(client, login, subjects):
+    headers = login("typeahead")
+
+    def suggest(query: str, **params) -> list:
+        response = client.get("/search/typeahead", params={"q": query, **params}, headers=headers)
+        assert response.status_code == 200
+        return [(item["bangumi_id"], item["source"]) for item in response.json()]
+    suggest.headers = headers
+    return suggest
+
+def test_cjk_partial_title(suggest):
+    assert suggest("巨人") == [(ATTACK["bangumi_id"], "bangumi")]
+    assert suggest("击的") == [(ATTACK["bangumi_id"], "bangumi")]
+
+def test_alias_hit(suggest, client):
+    # 日文原名是别名：命中后仍以中文名显示
+    response = client.get("/search/typeahead", params={"q": "進撃"}, headers=suggest.headers)
+    assert [(item["bangumi_id"], item["title"]) for item in response.json()] == [(ATTACK["bangumi_id"], ATTACK["name_cn"])]
+
+def test_full_width_query(suggest):
+    assert suggest("ＣＯＷＢＯＹ")[0] == (BEBOP["bangumi_id"], "bangumi")
+
+def test_prefix_ranks_before_substring(suggest):
+    assert suggest("cowboy") == [(BEBOP["bangumi_id"], "bangumi"), (BOYS["bangumi_id"], "bangumi")]
+
+def test_fuzzy_matches_typo(suggest):
+    assert (BEBOP["bangumi_id"], "bangumi") in suggest("cowbyo")
+    assert suggest("进军的巨") == [(ATTACK["bangumi_id"], "bangumi")]
+
+def test_library_entry_wins_over_cached_subject(suggest, client):
+    media = {"title": "Cowboy Bebop", "media_type": 2, "bangumi_id": BEBOP["bangumi_id"], "image": "", "summary": ""}
+    client.post("/media/add-manual", json=media, headers=suggest.headers)
+    assert suggest("cowboy")[0] == (BEBOP["bangumi_id"], "library")
+
+def test_writers_outside_the_app(suggest):
+    # sqlite3 命令行、备份恢复脚本等没有注册任何自定义函数，写入也不能失败
+    conn = sqlite3.connect(engine.url.database)
+    with conn:
+        conn.execute(
+            "INSERT INTO bangumi_subjects (bangumi_id, name, name_cn, media_type, image, summary, fetched_at) "
+            "VALUES (900004, 'Mushishi', '虫师', 2, '', '', '2026-01-01')"
+        )
+        conn.execute("UPDATE bangumi_subjects SET name = 'Kowboy Bebop' WHERE bangumi_id = ?", (BOYS["bangumi_id"],))
+    conn.close()
+    # 下一次联想查询前补算 n-gram
+    assert suggest("虫师") == [(900004, "bangumi")]
+    assert suggest("kowboy")[0] == (BOYS["bangumi_id"], "bangumi")